@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+import os
+from himena.plugins import config_field, get_config
+
+
+@dataclass
+class HimenaImageConfig:
+    imagej_path: str = config_field(
+        default="",
+        tooltip="Path to the ImageJ executable",
+    )
+    num_workers: int = config_field(
+        default=0,
+        tooltip="Number of threads used for parallel processing (0 to use all CPUs)",
+    )
+    fft_backend: str = config_field(
+        default="scipy",
+        tooltip="Library used for the fast Fourier transformation",
+        choices=["numpy", "scipy", "pyfftw"],
+    )
+
+
+def get_image_config() -> HimenaImageConfig:
+    """Get the current config, or the default one if no application is running."""
+    try:
+        cfg = get_config(HimenaImageConfig)
+    except (StopIteration, KeyError):
+        cfg = None
+    return cfg or HimenaImageConfig()
+
+
+def get_num_workers(num_workers: int | None = None) -> int:
+    """Normalize the number of workers using the config."""
+    if num_workers is None or num_workers <= 0:
+        num_workers = get_image_config().num_workers
+    if num_workers <= 0:
+        num_workers = os.cpu_count() or 1
+    return num_workers
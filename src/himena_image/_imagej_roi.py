@@ -0,0 +1,585 @@
+"""Bulk reading and writing of ImageJ ROI zip files.
+
+`roifile.roiwrite` needs one `ImagejRoi` object per ROI, which is slow for tens of
+thousands of ROIs. Here, ROIs are encoded batch by batch: ROIs of the same type are
+grouped, their bounding boxes and sub-pixel flags are calculated with vectorized
+numpy operations, and the encoded bytes are directly written to the zip file. The
+output is byte-compatible with `ImagejRoi.tobytes`.
+
+For reading, only the central directory and the multi-dimensional positions of the
+ROIs are parsed up front. Each ROI is decoded when it is first accessed.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from pathlib import Path
+import struct
+from typing import Callable, Iterable, Iterator, NamedTuple, Sequence
+import zipfile
+
+import numpy as np
+from numpy.typing import NDArray
+from roifile import ROI_COLOR_NONE, ROI_OPTIONS, ROI_SUBTYPE, ROI_TYPE
+
+from himena.standards import roi as _roi
+from himena.utils.ndobject import NDObjectCollection
+
+# number of ROIs encoded at once
+_BATCH_SIZE = 4096
+_VERSION = 229
+# number of vertices used to approximate a rotated ellipse
+_ELLIPSE_NPOINTS = 72
+
+# see `roifile.ImagejRoi.tobytes` for the layout of the headers
+_HEADER1 = struct.Struct(">4shBxhhhhH")
+_HEADER_FLOATS = struct.Struct(">ffff")
+_HEADER_NCOORDS = struct.Struct(">i12x")
+_HEADER1_REST = struct.Struct(">hi4s4shhBBhii")
+_HEADER2 = struct.Struct(">4xiiiii4shBBifiii12x")
+_NO_FLOATS = bytes(_HEADER_FLOATS.size)
+# dtype to split a big-endian float32 into the (aspect ratio, arrow head size,
+# rounded rect arc size) fields
+_ASPECT_DTYPE = np.dtype([("a", "u1"), ("b", "u1"), ("c", ">i2")])
+# zip local file header
+_ZIP_LOCAL_HEADER = struct.Struct("<4s22xHH")
+
+
+@dataclass
+class _RoiGroup:
+    """Vectorized fields of ROIs of the same type."""
+
+    roitype: ROI_TYPE
+    subtype: ROI_SUBTYPE
+    coords: NDArray[np.float64]  # concatenated (N, 2) coordinates, 1-based
+    lengths: NDArray[np.intp]  # number of coordinates of each ROI
+    floats: NDArray[np.float64] | None = None  # (n, 4) float fields in the header
+    aspect: NDArray[np.float32] | None = None  # (n,) encoded into the header
+
+
+def write_imagej_roi_zip(
+    path: str | Path,
+    rois: Sequence[_roi.RoiModel],
+    positions: Iterable[NDArray[np.integer]],
+    batch_size: int = _BATCH_SIZE,
+) -> None:
+    """Write ROIs to an ImageJ ROI zip file.
+
+    Parameters
+    ----------
+    path : str or Path
+        Path to the zip file. Existing file will be overwritten.
+    rois : sequence of RoiModel
+        ROIs to be written.
+    positions : iterable of arrays
+        1-based (position, t, z, c) indices of each ROI. 0 means not set.
+    batch_size : int, optional
+        Number of ROIs encoded at once. This bounds the memory usage.
+    """
+    p_s, t_s, z_s, c_s = (np.asarray(pos, dtype=np.int64) for pos in positions)
+    with zipfile.ZipFile(path, "w") as zf:
+        for i0 in range(0, len(rois), batch_size):
+            sl = slice(i0, i0 + batch_size)
+            batch_positions = (p_s[sl], t_s[sl], z_s[sl], c_s[sl])
+            for name, data in _encode_batch(rois[sl], batch_positions):
+                with zf.open(name, "w") as fh:
+                    fh.write(data)
+    return None
+
+
+class PolygonBatch(NamedTuple):
+    """Polygons to be written as ImageJ polygon ROIs.
+
+    Coordinates are in the ImageJ coordinates, and the polygons are concatenated
+    into one (N, 2) array of (x, y).
+    """
+
+    coords: NDArray[np.number]
+    lengths: NDArray[np.intp]
+    names: list[str]
+    positions: tuple[NDArray[np.integer], ...]  # 1-based (position, t, z, c)
+
+
+def write_imagej_polygon_zip(path: str | Path, batches: Iterable[PolygonBatch]) -> None:
+    """Write batches of polygons to an ImageJ ROI zip file.
+
+    Unlike `write_imagej_roi_zip`, no `RoiModel` is created for each polygon.
+    """
+    with zipfile.ZipFile(path, "w") as zf:
+        for batch in batches:
+            group = _RoiGroup(
+                roitype=ROI_TYPE.POLYGON,
+                subtype=ROI_SUBTYPE.UNDEFINED,
+                coords=np.asarray(batch.coords, dtype=np.float64).reshape(-1, 2),
+                lengths=np.asarray(batch.lengths, dtype=np.intp),
+            )
+            pos = [np.asarray(p).tolist() for p in batch.positions]
+            for name, data in _encode_group(group, batch.names, *pos):
+                with zf.open(name, "w") as fh:
+                    fh.write(data)
+    return None
+
+
+def _encode_batch(
+    rois: Sequence[_roi.RoiModel],
+    positions: tuple[NDArray[np.int64], ...],
+) -> Iterator[tuple[str, bytes]]:
+    """Encode ROIs into (entry name, bytes) pairs in the original order."""
+    grouped: dict[Callable, list[int]] = {}
+    for i, roi in enumerate(rois):
+        grouped.setdefault(_find_group_func(roi), []).append(i)
+
+    encoded: list[tuple[str, bytes] | None] = [None] * len(rois)
+    for group_func, indices in grouped.items():
+        group = group_func([rois[i] for i in indices])
+        names = [rois[i].name or "" for i in indices]
+        pos = [p[indices].tolist() for p in positions]
+        for i, item in zip(indices, _encode_group(group, names, *pos)):
+            encoded[i] = item
+    return iter(encoded)
+
+
+def _encode_group(
+    group: _RoiGroup,
+    names: list[str],
+    p_s: list[int],
+    t_s: list[int],
+    z_s: list[int],
+    c_s: list[int],
+) -> Iterator[tuple[str, bytes]]:
+    coords, lengths = group.coords, group.lengths
+    if lengths.size > 0 and lengths.min() == 0:
+        raise ValueError("Cannot write a ROI with no coordinates.")
+    offsets = np.zeros(lengths.size + 1, dtype=np.intp)
+    np.cumsum(lengths, out=offsets[1:])
+    starts = offsets[:-1]
+
+    # a ROI has sub-pixel resolution if any of its coordinates is not an integer
+    frac = np.modf(coords)[0].max(axis=1)
+    subpixel = np.maximum.reduceat(frac, starts) > 1e-6
+    subpixel_each = np.repeat(subpixel, lengths)
+    int_coords = np.where(subpixel_each[:, None], np.round(coords), coords).astype(
+        np.int32
+    )
+    left_top = np.minimum.reduceat(int_coords, starts, axis=0)
+    right_bottom = np.maximum.reduceat(int_coords, starts, axis=0) + 1
+    bbox = np.stack(
+        [left_top[:, 1], left_top[:, 0], right_bottom[:, 1], right_bottom[:, 0]],
+        axis=1,
+    )
+    bbox_i16 = bbox.astype(np.int16).tolist()
+
+    if _has_coordinate_data(group.roitype):
+        rel_coords = (int_coords - np.repeat(left_top, lengths, axis=0)).astype(">i2")
+        sub_coords = coords.astype(">f4")
+    else:
+        rel_coords = sub_coords = None
+
+    if group.roitype in (ROI_TYPE.RECT, ROI_TYPE.OVAL):
+        floats_mask = subpixel  # sub-pixel rectangle
+    elif group.floats is not None:
+        floats_mask = np.ones(lengths.size, dtype=np.bool_)
+    else:
+        floats_mask = np.zeros(lengths.size, dtype=np.bool_)
+
+    if group.aspect is not None:
+        enc = np.asarray(group.aspect, dtype=">f4").view(_ASPECT_DTYPE)
+        aspect = np.stack([enc["a"], enc["b"], enc["c"]], axis=1).tolist()
+    else:
+        aspect = [(0, 0, 0)] * lengths.size
+
+    options = np.where(
+        subpixel, ROI_OPTIONS.SUB_PIXEL_RESOLUTION.value, ROI_OPTIONS.NONE.value
+    ).tolist()
+    roitype = group.roitype.value
+    subtype = group.subtype.value
+    utf16 = "utf-16-be"
+    for i in range(lengths.size):
+        n = int(lengths[i])
+        top, left, bottom, right = bbox_i16[i]
+        chunks = [_HEADER1.pack(b"Iout", _VERSION, roitype, top, left, bottom, right, n if n < 2**16 else 0)]  # fmt: skip
+        if floats_mask[i]:
+            chunks.append(_HEADER_FLOATS.pack(*group.floats[i]))
+        elif n >= 2**16:
+            chunks.append(_HEADER_NCOORDS.pack(n))
+        else:
+            chunks.append(_NO_FLOATS)
+        if rel_coords is not None:
+            sl = slice(starts[i], starts[i] + n)
+            extradata = rel_coords[sl].tobytes(order="F")
+            if subpixel[i]:
+                extradata += sub_coords[sl].tobytes(order="F")
+        else:
+            extradata = b""
+        header2_offset = 64 + len(extradata)
+        chunks.append(
+            _HEADER1_REST.pack(
+                0,  # stroke width
+                0,  # shape roi size
+                ROI_COLOR_NONE,  # stroke color
+                ROI_COLOR_NONE,  # fill color
+                subtype,
+                options[i],
+                *aspect[i],
+                p_s[i],
+                header2_offset,
+            )
+        )
+        chunks.append(extradata)
+        name = names[i]
+        name_length = len(name)
+        name_offset = header2_offset + 64 if name_length > 0 else 0
+        chunks.append(
+            _HEADER2.pack(
+                c_s[i],
+                z_s[i],
+                t_s[i],
+                name_offset,
+                name_length,
+                ROI_COLOR_NONE,  # overlay label color
+                0,  # overlay font size
+                0,  # group
+                0,  # image opacity
+                0,  # image size
+                0.0,  # float stroke width
+                0,  # properties offset
+                0,  # properties length
+                0,  # counters offset
+            )
+        )
+        if name_length > 0:
+            chunks.append(name.encode(utf16))
+        yield _entry_name(name, bbox[i]), b"".join(chunks)
+
+
+def _has_coordinate_data(roitype: ROI_TYPE) -> bool:
+    return roitype in (ROI_TYPE.POLYGON, ROI_TYPE.FREEHAND, ROI_TYPE.POLYLINE, ROI_TYPE.POINT)  # fmt: skip
+
+
+def _entry_name(name: str, bbox: NDArray[np.int32]) -> str:
+    """Zip entry name, following `roifile.roiwrite`."""
+    if not name:
+        top, left, bottom, right = bbox.tolist()
+        name = f"{(bottom - top) // 2:05}-{(right - left) // 2:05}"
+    return name if name[-4:].lower() == ".roi" else name + ".roi"
+
+
+def _rect_like_group(
+    rois: list[_roi.RectangleRoi | _roi.EllipseRoi],
+    roitype: ROI_TYPE,
+) -> _RoiGroup:
+    xywh = np.array([(r.x, r.y, r.width, r.height) for r in rois], dtype=np.float64)
+    xywh = xywh.reshape(-1, 4)
+    x1, y1, w, h = xywh.T
+    x2, y2 = x1 + w, y1 + h
+    corners = np.stack([x1, y1, x1, y2, x2, y2, x2, y1], axis=1)
+    return _RoiGroup(
+        roitype=roitype,
+        subtype=ROI_SUBTYPE.UNDEFINED,
+        coords=corners.reshape(-1, 2),
+        lengths=np.full(len(rois), 4, dtype=np.intp),
+        floats=xywh,
+    )
+
+
+def _rect_group(rois: list[_roi.RectangleRoi]) -> _RoiGroup:
+    return _rect_like_group(rois, ROI_TYPE.RECT)
+
+
+def _ellipse_group(rois: list[_roi.EllipseRoi]) -> _RoiGroup:
+    return _rect_like_group(rois, ROI_TYPE.OVAL)
+
+
+def _start_end(rois: list[_roi.LineRoi | _roi.RotatedRoi2D]) -> NDArray[np.float64]:
+    """(n, 4) array of 1-based (x1, y1, x2, y2)."""
+    arr = np.array([(*r.start, *r.end) for r in rois], dtype=np.float64)
+    return arr.reshape(-1, 4) + 1
+
+
+def _line_group(rois: list[_roi.LineRoi]) -> _RoiGroup:
+    x1y1x2y2 = _start_end(rois)
+    return _RoiGroup(
+        roitype=ROI_TYPE.LINE,
+        subtype=ROI_SUBTYPE.UNDEFINED,
+        coords=x1y1x2y2.reshape(-1, 2),
+        lengths=np.full(len(rois), 2, dtype=np.intp),
+        floats=x1y1x2y2,
+    )
+
+
+def _point_group(rois: list[_roi.PointRoi2D]) -> _RoiGroup:
+    xy = np.array([(r.x, r.y) for r in rois], dtype=np.float64).reshape(-1, 2)
+    return _RoiGroup(
+        roitype=ROI_TYPE.POINT,
+        subtype=ROI_SUBTYPE.UNDEFINED,
+        coords=xy + 1,
+        lengths=np.ones(len(rois), dtype=np.intp),
+    )
+
+
+def _multi_point_group(
+    rois: list[_roi.PointsRoi2D],
+    roitype: ROI_TYPE,
+) -> _RoiGroup:
+    lengths = np.array([len(r.xs) for r in rois], dtype=np.intp)
+    xs = np.concatenate([r.xs for r in rois]).astype(np.float64)
+    ys = np.concatenate([r.ys for r in rois]).astype(np.float64)
+    return _RoiGroup(
+        roitype=roitype,
+        subtype=ROI_SUBTYPE.UNDEFINED,
+        coords=np.stack([xs, ys], axis=1) + 1,
+        lengths=lengths,
+    )
+
+
+def _points_group(rois: list[_roi.PointsRoi2D]) -> _RoiGroup:
+    return _multi_point_group(rois, ROI_TYPE.POINT)
+
+
+def _polygon_group(rois: list[_roi.PolygonRoi]) -> _RoiGroup:
+    return _multi_point_group(rois, ROI_TYPE.POLYGON)
+
+
+def _segmented_line_group(rois: list[_roi.SegmentedLineRoi]) -> _RoiGroup:
+    return _multi_point_group(rois, ROI_TYPE.POLYLINE)
+
+
+def _rotated_rect_group(rois: list[_roi.RotatedRectangleRoi]) -> _RoiGroup:
+    x1y1x2y2 = _start_end(rois)
+    return _RoiGroup(
+        roitype=ROI_TYPE.FREEHAND,
+        subtype=ROI_SUBTYPE.ROTATED_RECT,
+        coords=x1y1x2y2.reshape(-1, 2),
+        lengths=np.full(len(rois), 2, dtype=np.intp),
+        floats=x1y1x2y2,
+        aspect=np.array([r.width for r in rois], dtype=np.float32),
+    )
+
+
+def _rotated_ellipse_group(rois: list[_roi.RotatedEllipseRoi]) -> _RoiGroup:
+    x1y1x2y2 = _start_end(rois)
+    width = np.array([r.width for r in rois], dtype=np.float64)
+    length = np.array([r.length() for r in rois], dtype=np.float64)
+    phi = np.array([r.angle_radian() for r in rois], dtype=np.float64)[:, None]
+    a, b = length[:, None] / 2, width[:, None] / 2
+    center = (x1y1x2y2[:, :2] + x1y1x2y2[:, 2:]) / 2
+    ts = np.linspace(0, 2 * np.pi, _ELLIPSE_NPOINTS, endpoint=False)
+    cos_t, sin_t = np.cos(ts), np.sin(ts)
+    xs = a * cos_t * np.cos(phi) - b * sin_t * np.sin(phi) + center[:, 0:1]
+    ys = a * cos_t * np.sin(phi) + b * sin_t * np.cos(phi) + center[:, 1:2]
+    return _RoiGroup(
+        roitype=ROI_TYPE.FREEHAND,
+        subtype=ROI_SUBTYPE.ELLIPSE,
+        coords=np.stack([xs.ravel(), ys.ravel()], axis=1),
+        lengths=np.full(len(rois), _ELLIPSE_NPOINTS, dtype=np.intp),
+        floats=x1y1x2y2,
+        aspect=(width / length).astype(np.float32),
+    )
+
+
+_GROUP_FUNCS: dict[type[_roi.RoiModel], Callable[[list], _RoiGroup]] = {
+    _roi.RectangleRoi: _rect_group,
+    _roi.EllipseRoi: _ellipse_group,
+    _roi.LineRoi: _line_group,
+    _roi.PointRoi2D: _point_group,
+    _roi.PolygonRoi: _polygon_group,
+    _roi.SegmentedLineRoi: _segmented_line_group,
+    _roi.RotatedRectangleRoi: _rotated_rect_group,
+    _roi.RotatedEllipseRoi: _rotated_ellipse_group,
+    _roi.PointsRoi2D: _points_group,
+}
+
+
+def _find_group_func(roi: _roi.RoiModel) -> Callable[[list], _RoiGroup]:
+    for cls in type(roi).__mro__:
+        if func := _GROUP_FUNCS.get(cls):
+            return func
+    raise ValueError(f"Unsupported ROI type: {type(roi)}")
+
+
+class RoiZipSource:
+    """Raw bytes of the ROIs in an ImageJ ROI zip file, decoded on demand.
+
+    The whole file is read at once and each ROI entry is kept as a view of the file
+    content, so the file can safely be overwritten afterwards.
+    """
+
+    def __init__(self, path: str | Path):
+        with open(path, "rb") as f:
+            content = f.read()
+        buf = memoryview(content)
+        self._data: list[bytes | memoryview] = []
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                if info.compress_type != zipfile.ZIP_STORED:
+                    self._data.append(zf.read(info))
+                    continue
+                _, name_len, extra_len = _ZIP_LOCAL_HEADER.unpack_from(
+                    buf, info.header_offset
+                )
+                start = info.header_offset + _ZIP_LOCAL_HEADER.size + name_len + extra_len  # fmt: skip
+                self._data.append(buf[start : start + info.file_size])
+        self._cache = np.empty(len(self._data), dtype=np.object_)
+        self._is_decoded = np.zeros(len(self._data), dtype=np.bool_)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def positions(self) -> NDArray[np.int32]:
+        """The (position, t, z, c) of each ROI, parsed without decoding ROIs."""
+        out = np.zeros((len(self._data), 4), dtype=np.int32)
+        for i, data in enumerate(self._data):
+            if len(data) < 64 or data[:4] != b"Iout":
+                raise ValueError(f"Entry {i} is not an ImageJ ROI.")
+            p, header2_offset = struct.unpack_from(">ii", data, 56)
+            # see `roifile.ImagejRoi.frombytes`
+            if 0 < header2_offset < len(data) - 52:
+                c, z, t = struct.unpack_from(">iii", data, header2_offset + 4)
+            else:
+                c = z = t = 0
+            out[i] = p, t, z, c
+        return out
+
+    def get(self, entry: int) -> _roi.RoiModel:
+        """Get the decoded ROI of the given entry."""
+        if not self._is_decoded[entry]:
+            self._cache[entry] = _decode_roi(self._data[entry])
+            self._is_decoded[entry] = True
+        return self._cache[entry]
+
+    def get_many(self, entries: NDArray[np.intp]) -> NDArray[np.object_]:
+        """Get the decoded ROIs of the given entries as an object array."""
+        for entry in entries[~self._is_decoded[entries]]:
+            self.get(entry)
+        return self._cache[entries]
+
+
+def _decode_roi(data: bytes | memoryview) -> _roi.RoiModel:
+    from roifile import ImagejRoi
+    from himena_image.io import _to_standard_roi
+
+    return _to_standard_roi(ImagejRoi.frombytes(bytes(data)))[1]
+
+
+class LazyRoiListModel(_roi.RoiListModel):
+    """A `RoiListModel` whose ROIs are decoded from an ImageJ ROI zip file on demand.
+
+    Iteration and item access only decode the requested ROIs, and selection methods
+    such as `filter_by_indices` return lazy lists that share the decoded ROIs. Any
+    access to `items` (including list modifications) decodes all the ROIs.
+    """
+
+    _source: RoiZipSource | None = None
+    _entries: NDArray[np.intp] | None = None
+
+    @classmethod
+    def from_source(
+        cls,
+        source: RoiZipSource,
+        entries: NDArray[np.intp] | None = None,
+        indices: NDArray[np.int32] | None = None,
+        axis_names: list[str] | None = None,
+    ) -> LazyRoiListModel:
+        """Construct a lazy ROI list from the ROI entries of `source`."""
+        if entries is None:
+            entries = np.arange(len(source), dtype=np.intp)
+        if indices is None:
+            indices = source.positions()[entries]
+            axis_names = ["p", "t", "z", "c"]
+        self = cls.__new__(cls)
+        self._source = source
+        self._entries = np.asarray(entries, dtype=np.intp)
+        self.indices = indices
+        self.axis_names = list(axis_names)
+        return self
+
+    @property
+    def is_lazy(self) -> bool:
+        """True if the ROIs are not decoded yet."""
+        return self._entries is not None
+
+    @property
+    def items(self) -> NDArray[np.object_]:
+        if self._entries is not None:
+            self._items = self._source.get_many(self._entries)
+            self._entries = None
+        return self._items
+
+    @items.setter
+    def items(self, value):
+        self._items = value
+        self._entries = None
+
+    def __repr__(self) -> str:
+        if self._entries is None:
+            return super().__repr__()
+        return f"{type(self).__name__}(<{len(self)} ROIs>, axis_names={self.axis_names!r})"  # fmt: skip
+
+    def __len__(self) -> int:
+        if self._entries is not None:
+            return len(self._entries)
+        return super().__len__()
+
+    def __getitem__(self, key: int) -> _roi.RoiModel:
+        if self._entries is not None and isinstance(key, (int, np.integer)):
+            return self._source.get(self._entries[key])
+        return super().__getitem__(key)
+
+    def __iter__(self) -> Iterator[_roi.RoiModel]:
+        if self._entries is None:
+            return super().__iter__()
+        return (self._source.get(entry) for entry in self._entries)
+
+    def iter_with_indices(self) -> Iterator[tuple[tuple[int, ...], _roi.RoiModel]]:
+        for indices, item in zip(self.indices, self):
+            yield tuple(indices), item
+
+    def _lazy_call(self, method: str, *args):
+        """Run a selection method on the entry numbers instead of the ROIs."""
+        entries = NDObjectCollection(
+            items=self._entries, indices=self.indices, axis_names=self.axis_names
+        )
+        out = getattr(entries, method)(*args)
+        if out is entries:
+            return self
+        return self.from_source(
+            self._source,
+            entries=out.items.astype(np.intp),
+            indices=out.indices,
+            axis_names=out.axis_names,
+        )
+
+    def coerce_dimensions(self, target_axis_names):
+        if self._entries is None:
+            return super().coerce_dimensions(target_axis_names)
+        return self._lazy_call("coerce_dimensions", target_axis_names)
+
+    def filter_by_indices(self, key):
+        if self._entries is None:
+            return super().filter_by_indices(key)
+        return self._lazy_call("filter_by_indices", key)
+
+    def filter_by_selection(self, selection):
+        if self._entries is None:
+            return super().filter_by_selection(selection)
+        return self._lazy_call("filter_by_selection", selection)
+
+    def take_axis(self, axis, index):
+        if self._entries is None:
+            return super().take_axis(axis, index)
+        return self._lazy_call("take_axis", axis, index)
+
+    def project(self, axis):
+        if self._entries is None:
+            return super().project(axis)
+        return self._lazy_call("project", axis)
+
+    def simplified(self):
+        if self._entries is None:
+            return super().simplified()
+        return self._lazy_call("simplified")
+
+    def copy(self):
+        if self._entries is None:
+            return super().copy()
+        return self._lazy_call("copy")
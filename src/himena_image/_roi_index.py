@@ -0,0 +1,209 @@
+"""Index structures for fast lookup of ROIs in a `RoiListModel`.
+
+A `RoiListModel` is a flat list of ROIs with a multi-dimensional index (such as
+`p, t, z, c`) for each ROI. Finding the ROIs on a slice or in a viewport requires a
+linear scan over the list, which is slow for lists with tens of thousands of ROIs.
+`RoiIndex` groups the ROIs by their multi-dimensional indices and builds a uniform
+grid over their bounding boxes, so that these queries only visit the relevant ROIs.
+"""
+
+from __future__ import annotations
+
+from typing import Iterator, Sequence
+import numpy as np
+from numpy.typing import NDArray
+
+from himena.standards import roi as _roi
+
+# maximum number of grid cells along each axis
+_MAX_GRID_SIZE = 4096
+# ROIs overlapping more cells than this are not put into the grid but always checked
+_MAX_CELLS_PER_ROI = 256
+
+
+class RoiIndex:
+    """Index over a `RoiListModel` for per-slice and spatial queries.
+
+    The grouping by slice indices is built immediately, while the spatial grid is
+    built on the first spatial query because it needs the bounding box of every ROI.
+    Neither touches the ROIs until then, so a lazily loaded list stays lazy. The
+    index is keyed on the number of ROIs and their indices; the ROI objects
+    themselves are assumed not to be replaced or mutated.
+
+    >>> index = RoiIndex(rois)
+    >>> index.query((0, 3))  # positions of the ROIs on the slice (0, 3)
+    >>> index.query((0, 3), bbox=(0, 0, 128, 128))  # ... and in the viewport
+    """
+
+    def __init__(self, rois: _roi.RoiListModel, cell_size: float | None = None):
+        self._rois = rois
+        self._size = len(rois)
+        self._indices = np.array(rois.indices, copy=True)
+        self._cell_size = cell_size
+        indices = np.asarray(rois.indices).reshape(len(rois), -1)
+        if indices.shape[1] == 0 or indices.shape[0] == 0:
+            self._keys = np.zeros((1 if len(rois) else 0, indices.shape[1]), np.int64)
+            self._members = [np.arange(len(rois), dtype=np.intp)] if len(rois) else []
+        else:
+            keys, inverse = np.unique(indices, axis=0, return_inverse=True)
+            inverse = inverse.ravel()
+            order = np.argsort(inverse, kind="stable")
+            counts = np.bincount(inverse, minlength=keys.shape[0])
+            self._keys = keys
+            self._members = np.split(order, np.cumsum(counts)[:-1])
+        self._grid: _BBoxGrid | None = None
+
+    @property
+    def ndim(self) -> int:
+        """Number of multi-dimensional indices of each ROI."""
+        return self._keys.shape[1]
+
+    def is_valid_for(self, rois: _roi.RoiListModel) -> bool:
+        """True if this index can still be used for `rois`."""
+        if self._rois is not rois or len(rois) != self._size:
+            return False
+        return np.array_equal(rois.indices, self._indices)
+
+    def groups(self) -> Iterator[tuple[tuple[int, ...], NDArray[np.intp]]]:
+        """Iterate over the unique indices and the positions of the ROIs with them."""
+        for key, members in zip(self._keys, self._members):
+            yield tuple(key.tolist()), members
+
+    def query(
+        self,
+        key: Sequence[int] | None = None,
+        bbox: tuple[float, float, float, float] | None = None,
+    ) -> NDArray[np.intp]:
+        """Sorted positions of the ROIs matching the query.
+
+        Parameters
+        ----------
+        key : sequence of int, optional
+            Slice indices. ROIs with the same indices, or negative indices (which
+            means the ROI is shown on all the slices along the axis), are returned.
+        bbox : (float, float, float, float), optional
+            Viewport as (left, top, right, bottom). ROIs whose bounding box
+            intersects the viewport are returned.
+        """
+        if key is None:
+            out = np.arange(len(self._rois), dtype=np.intp)
+        else:
+            out = self._query_slice(key)
+        if bbox is not None:
+            out = np.intersect1d(out, self._get_grid().query(bbox), assume_unique=True)
+        return out
+
+    def filter(
+        self,
+        key: Sequence[int] | None = None,
+        bbox: tuple[float, float, float, float] | None = None,
+    ) -> _roi.RoiListModel:
+        """ROI list of the ROIs matching the query (see `query`)."""
+        return self._rois.filter_by_selection(self.query(key, bbox))
+
+    def _query_slice(self, key: Sequence[int]) -> NDArray[np.intp]:
+        if len(key) != self.ndim:
+            raise ValueError(f"Expected {self.ndim} indices, got {len(key)}")
+        if len(self._members) == 0:
+            return np.zeros(0, dtype=np.intp)
+        matched = np.all((self._keys == np.asarray(key)) | (self._keys < 0), axis=1)
+        members = [self._members[i] for i in np.flatnonzero(matched)]
+        if len(members) == 0:
+            return np.zeros(0, dtype=np.intp)
+        return np.sort(np.concatenate(members))
+
+    def _get_grid(self) -> _BBoxGrid:
+        if self._grid is None:
+            bboxes = np.array(
+                [_roi_bbox(r) for r in self._rois], dtype=np.float64
+            ).reshape(-1, 4)
+            self._grid = _BBoxGrid(bboxes, self._cell_size)
+        return self._grid
+
+
+def get_roi_index(rois: _roi.RoiListModel) -> RoiIndex:
+    """Get the index of the ROI list, building it only if needed."""
+    index = rois.__dict__.get("_himena_image_roi_index")
+    if not (isinstance(index, RoiIndex) and index.is_valid_for(rois)):
+        index = RoiIndex(rois)
+        rois.__dict__["_himena_image_roi_index"] = index
+    return index
+
+
+class _BBoxGrid:
+    """Uniform grid of bounding boxes stored in the CSR format."""
+
+    def __init__(self, bboxes: NDArray[np.float64], cell_size: float | None = None):
+        self._bboxes = bboxes
+        finite = np.all(np.isfinite(bboxes), axis=1)
+        ids = np.flatnonzero(finite)
+        x0, y0, x1, y1 = bboxes[ids].T
+        if cell_size is None:
+            if ids.size > 0:
+                cell_size = float(np.median(np.maximum(x1 - x0, y1 - y0)))
+                extent = max(x1.max() - x0.min(), y1.max() - y0.min())
+                cell_size = max(cell_size, extent / _MAX_GRID_SIZE)
+            cell_size = max(cell_size or 1.0, 1.0)
+        self._cell_size = cell_size
+        ix0, iy0 = self._to_cell(x0), self._to_cell(y0)
+        ix1, iy1 = self._to_cell(x1), self._to_cell(y1)
+        # ROIs without a finite bounding box, or too large to be expanded into the
+        # cells, are checked for any query
+        large = (ix1 - ix0 + 1) * (iy1 - iy0 + 1) > _MAX_CELLS_PER_ROI
+        self._always = np.sort(np.concatenate([np.flatnonzero(~finite), ids[large]]))
+        ids = ids[~large]
+        ix0, iy0, ix1, iy1 = ix0[~large], iy0[~large], ix1[~large], iy1[~large]
+        self._origin = (int(ix0.min()), int(iy0.min())) if ids.size > 0 else (0, 0)
+        self._nx = int(ix1.max()) - self._origin[0] + 1 if ids.size > 0 else 0
+        self._ny = int(iy1.max()) - self._origin[1] + 1 if ids.size > 0 else 0
+
+        # expand each ROI into all the cells it overlaps
+        width = ix1 - ix0 + 1
+        counts = width * (iy1 - iy0 + 1)
+        starts = np.cumsum(counts) - counts
+        local = np.arange(counts.sum()) - np.repeat(starts, counts)
+        width_rep = np.repeat(width, counts)
+        cx = np.repeat(ix0, counts) + local % width_rep - self._origin[0]
+        cy = np.repeat(iy0, counts) + local // width_rep - self._origin[1]
+        cell_ids = cy * self._nx + cx
+        order = np.argsort(cell_ids, kind="stable")
+        self._cell_ids = cell_ids[order]
+        self._roi_ids = np.repeat(ids, counts)[order]
+
+    def _to_cell(self, x: NDArray[np.float64]) -> NDArray[np.int64]:
+        return np.floor(x / self._cell_size).astype(np.int64)
+
+    def query(self, bbox: tuple[float, float, float, float]) -> NDArray[np.intp]:
+        left, top, right, bottom = bbox
+        cx0 = max(int(np.floor(left / self._cell_size)) - self._origin[0], 0)
+        cy0 = max(int(np.floor(top / self._cell_size)) - self._origin[1], 0)
+        cx1 = min(int(np.floor(right / self._cell_size)) - self._origin[0], self._nx - 1)  # fmt: skip
+        cy1 = min(int(np.floor(bottom / self._cell_size)) - self._origin[1], self._ny - 1)  # fmt: skip
+        candidates = [self._always]
+        if cx0 <= cx1:
+            for cy in range(cy0, cy1 + 1):
+                i0, i1 = np.searchsorted(
+                    self._cell_ids, [cy * self._nx + cx0, cy * self._nx + cx1 + 1]
+                )
+                candidates.append(self._roi_ids[i0:i1])
+        ids = np.unique(np.concatenate(candidates))
+        x0, y0, x1, y1 = self._bboxes[ids].T
+        hit = (x0 <= right) & (x1 >= left) & (y0 <= bottom) & (y1 >= top)
+        return ids[hit | ~np.all(np.isfinite(self._bboxes[ids]), axis=1)]
+
+
+def _roi_bbox(roi: _roi.RoiModel) -> tuple[float, float, float, float]:
+    """(left, top, right, bottom) of the ROI, or NaNs if not available."""
+    try:
+        rect = roi.bbox()
+    except NotImplementedError:
+        if isinstance(roi, _roi.RotatedEllipseRoi):
+            # the bounding box of the rotated rectangle contains the ellipse
+            rect = _roi.RotatedRectangleRoi(
+                start=roi.start, end=roi.end, width=roi.width
+            ).bbox()
+        else:
+            return (np.nan,) * 4
+    except AttributeError:
+        return (np.nan,) * 4
+    return (rect.left, rect.top, rect.right, rect.bottom)
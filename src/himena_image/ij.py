@@ -1,17 +1,8 @@
-from dataclasses import dataclass
 from pathlib import Path
 from subprocess import Popen
 from himena import StandardType, WidgetDataModel
-from himena.plugins import register_config, config_field, register_function, get_config
-
-
-@dataclass
-class HimenaImageConfig:
-    imagej_path: str = config_field(
-        default="",
-        tooltip="Path to the ImageJ executable",
-    )
-
+from himena.plugins import register_config, register_function
+from himena_image._config import HimenaImageConfig, get_image_config
 
 register_config("himena-image", "himena-image", HimenaImageConfig())
 
@@ -23,7 +14,7 @@ register_config("himena-image", "himena-image", HimenaImageConfig())
     command_id="himena-image.open-in-imagej",
 )
 def open_in_imagej(model: WidgetDataModel) -> None:
-    ij_cfg = get_config(HimenaImageConfig) or HimenaImageConfig()
+    ij_cfg = get_image_config()
     if ij_cfg.imagej_path.strip() == "":
         raise ValueError("ImageJ path is not configured.")
     ij_path = Path(ij_cfg.imagej_path).expanduser().resolve()
@@ -1,11 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from pathlib import Path
 import struct
-from typing import Any, Sequence
+from typing import Sequence
 import zipfile
 import impy as ip
 import numpy as np
-from roifile import ROI_OPTIONS, ROI_SUBTYPE, ImagejRoi, roiread, roiwrite, ROI_TYPE
+from roifile import ROI_OPTIONS, ROI_SUBTYPE, ImagejRoi, roiread, ROI_TYPE
 
 from himena import Parametric, StandardType, WidgetDataModel
 from himena.consts import MenuId
@@ -17,13 +18,29 @@ from himena.plugins import (
     register_function,
     configure_gui,
 )
-from himena_image.utils import image_to_model
+from himena_image.utils import image_to_model, model_to_image
+from himena_image._config import get_num_workers
+from himena_image._imagej_roi import (
+    LazyRoiListModel,
+    PolygonBatch,
+    RoiZipSource,
+    write_imagej_polygon_zip,
+    write_imagej_roi_zip,
+)
+from himena_image.processing._contours import trace_label_contours
 
 
 _SUPPORTED_EXT = frozenset(
     [".tif", ".tiff", ".lsm", ".mrc", ".rec", ".st", ".map", ".nd2", ".czi"]
 )  # fmt: skip
 _SUPPORTED_MULTI_EXT = frozenset([".mrc.gz", ".map.gz"])
+# axis names for the ImageJ (position, t_position, z_position, c_position)
+_IJ_POSITION_CANDIDATES = [
+    ["p", "position"],
+    ["t", "time"],
+    ["z", "slice"],
+    ["c", "channel"],
+]
 
 
 def _is_image_file(path: Path) -> bool:
@@ -96,6 +113,10 @@ def _(path: Path):
 
 @register_reader_plugin
 def read_roi(path: Path):
+    if path.suffix == ".zip":
+        source = RoiZipSource(path)
+        val = LazyRoiListModel.from_source(source).simplified()
+        return WidgetDataModel(value=val, type=StandardType.ROIS, title=path.name)
     out = roiread(path)
     if isinstance(out, ImagejRoi):
         ijrois = [out]
@@ -133,22 +154,8 @@ def write_roi(model: WidgetDataModel, path: Path):
     _ij_position_getter = partial(
         _to_ij_position, rlist.indices, axis_names=rlist.axis_names
     )
-    p_s = _ij_position_getter(["p", "position"])
-    t_s = _ij_position_getter(["t", "time"])
-    z_s = _ij_position_getter(["z", "slice"])
-    c_s = _ij_position_getter(["c", "channel"])
-    ijrois: list[ImagejRoi] = []
-    for p, t, z, c, roi in zip(p_s, t_s, z_s, c_s, rlist.items):
-        multi_dims = {
-            "position": p,
-            "t_position": t,
-            "z_position": z,
-            "c_position": c,
-        }
-        ijrois.append(_from_standard_roi(roi, multi_dims))
-    if path.exists():
-        path.unlink()
-    roiwrite(path, ijrois)
+    positions = [_ij_position_getter(cand) for cand in _IJ_POSITION_CANDIDATES]
+    write_imagej_roi_zip(path, rlist.items, positions)
     return None
 
 
@@ -173,6 +180,47 @@ def lazy_imread() -> Parametric:
     return run_lazy_imread
 
 
+@register_function(
+    menus=[MenuId.FILE, "/model_menu"],
+    title="Export labels as ImageJ ROIs ...",
+    types=StandardType.IMAGE_LABELS,
+    run_async=True,
+    command_id="himena-image:io:export-labels-as-imagej-rois",
+)
+def export_labels_as_imagej_rois(model: WidgetDataModel) -> Parametric:
+    """Trace the contours of all the labels and save them as an ImageJ ROI zip."""
+
+    @configure_gui(path={"mode": "w", "filter": "*.zip"})
+    def run_export_labels(path: Path) -> None:
+        img = model_to_image(model)
+        axis_names = [str(a) for a in img.axes][:-2]
+        plane_indices = list(np.ndindex(img.shape[:-2]))
+
+        def _trace(plane_index: tuple[int, ...]) -> PolygonBatch:
+            contours = trace_label_contours(np.asarray(img.value[plane_index]))
+            prefix = "".join(f"{i + 1:04}-" for i in plane_index)
+            indices = np.array([plane_index], dtype=np.int32).reshape(1, -1)
+            positions = tuple(
+                np.repeat(
+                    _to_ij_position(indices, cand, axis_names), contours.labels.size
+                )
+                for cand in _IJ_POSITION_CANDIDATES
+            )
+            return PolygonBatch(
+                coords=contours.coords,
+                lengths=contours.lengths,
+                names=[f"{prefix}{label:05}" for label in contours.labels.tolist()],
+                positions=positions,
+            )
+
+        num_workers = min(get_num_workers(), max(len(plane_indices), 1))
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            write_imagej_polygon_zip(path, executor.map(_trace, plane_indices))
+        return None
+
+    return run_export_labels
+
+
 def _get_coords(ijroi: ImagejRoi) -> np.ndarray:
     if ijroi.subpixelresolution:
         return ijroi.subpixel_coordinates - 1
@@ -277,132 +325,6 @@ def _to_standard_roi(ijroi: ImagejRoi) -> tuple[tuple[int, ...], _roi.RoiModel]:
     return (p, t, z, c), out
 
 
-def _from_standard_roi(
-    roi: _roi.RoiModel,
-    multi_dims: dict[str, int],
-) -> ImagejRoi:
-    if isinstance(roi, _roi.RectangleRoi):
-        y1, y2 = roi.y, roi.y + roi.height
-        x1, x2 = roi.x, roi.x + roi.width
-        return ImagejRoi(
-            roitype=ROI_TYPE.RECT,
-            name=roi.name,
-            x1=x1,
-            x2=x2,
-            xd=x1,
-            widthd=roi.width,
-            y1=y1,
-            y2=y2,
-            yd=y1,
-            heightd=roi.height,
-            **_to_ij_kwargs(np.array([[x1, y1], [x1, y2], [x2, y2], [x2, y1]])),
-            **multi_dims,
-        )
-    elif isinstance(roi, _roi.EllipseRoi):
-        y1, y2 = roi.y, roi.y + roi.height
-        x1, x2 = roi.x, roi.x + roi.width
-        return ImagejRoi(
-            roitype=ROI_TYPE.OVAL,
-            name=roi.name,
-            x1=x1,
-            x2=x2,
-            xd=x1,
-            widthd=roi.width,
-            y1=y1,
-            y2=y2,
-            yd=y1,
-            heightd=roi.height,
-            **_to_ij_kwargs(np.array([[x1, y1], [x1, y2], [x2, y2], [x2, y1]])),
-            **multi_dims,
-        )
-    elif isinstance(roi, _roi.LineRoi):
-        x1, y1 = np.ones(2) + roi.start
-        x2, y2 = np.ones(2) + roi.end
-        return ImagejRoi(
-            roitype=ROI_TYPE.LINE,
-            name=roi.name,
-            x1=x1,
-            y1=y1,
-            x2=x2,
-            y2=y2,
-            **_to_ij_kwargs(np.array([[x1, y1], [x2, y2]])),
-            **multi_dims,
-        )
-    elif isinstance(roi, _roi.PointRoi2D):
-        return ImagejRoi(
-            roitype=ROI_TYPE.POINT,
-            name=roi.name,
-            **_to_ij_kwargs(np.array([[roi.x + 1, roi.y + 1]])),
-            **multi_dims,
-        )
-    elif isinstance(roi, _roi.PolygonRoi):
-        return ImagejRoi(
-            roitype=ROI_TYPE.POLYGON,
-            name=roi.name,
-            **_to_ij_kwargs(np.stack([roi.xs + 1, roi.ys + 1], axis=1)),
-            **multi_dims,
-        )
-    elif isinstance(roi, _roi.SegmentedLineRoi):
-        return ImagejRoi(
-            roitype=ROI_TYPE.POLYLINE,
-            name=roi.name,
-            **_to_ij_kwargs(np.stack([roi.xs + 1, roi.ys + 1], axis=1)),
-            **multi_dims,
-        )
-    elif isinstance(roi, _roi.RotatedRectangleRoi):
-        enc = _encode_rotated_roi_width(roi.width)
-        x1, y1 = np.ones(2) + roi.start
-        x2, y2 = np.ones(2) + roi.end
-        return ImagejRoi(
-            roitype=ROI_TYPE.FREEHAND,
-            subtype=ROI_SUBTYPE.ROTATED_RECT,
-            name=roi.name,
-            x1=x1,
-            y1=y1,
-            x2=x2,
-            y2=y2,
-            arrow_style_or_aspect_ratio=enc[0],
-            arrow_head_size=enc[1],
-            rounded_rect_arc_size=enc[2],
-            **_to_ij_kwargs(np.array([[x1, y1], [x2, y2]])),
-            **multi_dims,
-        )
-    elif isinstance(roi, _roi.RotatedEllipseRoi):
-        enc = _encode_rotated_roi_width(roi.width / roi.length())
-        a = roi.length() / 2
-        b = roi.width / 2
-        phi = roi.angle_radian()
-        ts = np.linspace(0, 2 * np.pi, 72, endpoint=False)
-        start = np.array(roi.start) + 1
-        end = np.array(roi.end) + 1
-        center = (start + end) / 2
-        xs = a * np.cos(ts) * np.cos(phi) - b * np.sin(ts) * np.sin(phi) + center[0]
-        ys = a * np.cos(ts) * np.sin(phi) + b * np.sin(ts) * np.cos(phi) + center[1]
-        return ImagejRoi(
-            roitype=ROI_TYPE.FREEHAND,
-            subtype=ROI_SUBTYPE.ELLIPSE,
-            name=roi.name,
-            x1=start[0],
-            y1=start[1],
-            x2=end[0],
-            y2=end[1],
-            arrow_style_or_aspect_ratio=enc[0],
-            arrow_head_size=enc[1],
-            rounded_rect_arc_size=enc[2],
-            **_to_ij_kwargs(np.stack([xs, ys], axis=1)),
-            **multi_dims,
-        )
-    elif isinstance(roi, _roi.PointsRoi2D):
-        return ImagejRoi(
-            roitype=ROI_TYPE.POINT,
-            name=roi.name,
-            **_to_ij_kwargs(np.stack([roi.xs + 1, roi.ys + 1], axis=1)),
-            **multi_dims,
-        )
-
-    raise ValueError(f"Unsupported ROI type: {type(roi)}")
-
-
 def _to_ij_position(
     indices: np.ndarray,
     candidates: list[str],
@@ -414,43 +336,8 @@ def _to_ij_position(
     return np.full(indices.shape[0], 0, dtype=np.int32)
 
 
-def _encode_rotated_roi_width(
-    width: float, byteorder: str = ">"
-) -> tuple[int, int, int]:
-    s = struct.pack(byteorder + "f", width)
-    return struct.unpack(byteorder + "BBh", s)
-
-
 def _decode_rotated_roi_width(
     ints: tuple[int, int, int], byteorder: str = ">"
 ) -> float:
     s = struct.pack(byteorder + "BBh", *ints)
     return struct.unpack(byteorder + "f", s)[0]
-
-
-def _to_ij_kwargs(coords: np.ndarray) -> dict[str, Any]:
-    float_part = np.modf(coords)[0]
-    if float_part.max() > 1e-6:
-        int_coords = coords.round().astype(np.int32)
-        left_top = int_coords.min(axis=0)
-        return {
-            "integer_coordinates": int_coords - left_top,
-            "subpixel_coordinates": np.asarray(coords, dtype=np.float32),
-            "n_coordinates": coords.shape[0],
-            "options": ROI_OPTIONS.SUB_PIXEL_RESOLUTION,
-            "top": int(int_coords[:, 1].min()),
-            "left": int(int_coords[:, 0].min()),
-            "bottom": int(int_coords[:, 1].max() + 1),
-            "right": int(int_coords[:, 0].max() + 1),
-        }
-    else:
-        int_coords = coords.astype(np.int32)
-        left_top = int_coords.min(axis=0)
-        return {
-            "integer_coordinates": int_coords - left_top,
-            "n_coordinates": coords.shape[0],
-            "top": int(int_coords[:, 1].min()),
-            "left": int(int_coords[:, 0].min()),
-            "bottom": int(int_coords[:, 1].max() + 1),
-            "right": int(int_coords[:, 0].max() + 1),
-        }
@@ -9,6 +9,7 @@ from himena_image.processing import (
     measure,
     restore,
     _hints,
+    _jobs,
 )
 
 del (
@@ -22,4 +23,5 @@ del (
     measure,
     restore,
     _hints,
+    _jobs,
 )
@@ -0,0 +1,193 @@
+"""Connected component labeling of chunked (possibly larger-than-memory) masks.
+
+Each chunk of a dask array is labeled independently and the labels are made unique
+by adding the cumulative number of labels of the preceding chunks. Labels touching
+each other across a chunk boundary are found by labeling the two-pixel thick slab
+around the boundary, and merged by the connected components of the resulting graph
+(a vectorized union-find). The output is a lazy dask array that labels each chunk
+again and maps the local labels to the final ones, so that the labeled volume never
+needs to be in memory.
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Sequence
+import numpy as np
+from numpy.typing import NDArray
+from scipy import ndimage as ndi
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from himena_image._config import get_num_workers
+from himena_image.processing._jobs import Job
+
+
+def label_chunked(
+    arr: Any,
+    label_axes: Sequence[int],
+    connectivity: int = 1,
+    *,
+    num_workers: int | None = None,
+    job: Job | None = None,
+):
+    """Label the nonzero pixels of a dask array chunk by chunk.
+
+    Parameters
+    ----------
+    arr : dask array
+        Input mask. Nonzero pixels are the foreground.
+    label_axes : sequence of int
+        Axes along which pixels are connected. Sub-arrays along the other axes (such
+        as each time point) are labeled separately.
+    connectivity : int, default 1
+        Maximum number of orthogonal hops to consider a pixel as a neighbor, same as
+        `skimage.measure.label`.
+    num_workers : int, optional
+        Number of threads used to label the chunks in the first pass.
+    job : Job, optional
+        Job to report the progress of the first pass to.
+
+    Returns
+    -------
+    dask array
+        Lazy label array with the smallest sufficient unsigned integer dtype. Labels
+        are sequential from 1.
+    """
+    import dask.array as da
+
+    arr = da.asarray(arr)
+    label_axes = sorted(a % arr.ndim for a in label_axes)
+    structure = _make_structure(arr.ndim, label_axes, connectivity)
+    block_ids = list(np.ndindex(arr.numblocks))
+
+    # first pass: count the labels of each chunk and keep the faces
+    counts = np.zeros(arr.numblocks, dtype=np.int64)
+    faces: dict[tuple[int, ...], dict[int, tuple[NDArray, NDArray]]] = {}
+
+    def _first_pass(block_id: tuple[int, ...]):
+        block = np.asarray(arr.blocks[block_id].compute(scheduler="synchronous"))
+        lab, n = ndi.label(block != 0, structure=structure)
+        return n, {a: (_take(lab, a, 0), _take(lab, a, -1)) for a in label_axes}
+
+    if job is not None:
+        job.add_total(len(block_ids))
+    n_workers = max(min(get_num_workers(num_workers), len(block_ids)), 1)
+    with ThreadPoolExecutor(n_workers) as ex:
+        futures = {ex.submit(_first_pass, block_id): block_id for block_id in block_ids}
+        try:
+            for future in as_completed(futures):
+                block_id = futures[future]
+                counts[block_id], faces[block_id] = future.result()
+                if job is not None:
+                    job.advance()
+        except BaseException:
+            ex.shutdown(cancel_futures=True)
+            raise
+
+    offsets = (np.cumsum(counts.ravel()) - counts.ravel()).reshape(counts.shape)
+    n_total = int(counts.sum())
+
+    # merge the labels across the chunk boundaries
+    edges = [
+        _boundary_edges(faces, offsets, arr.numblocks, axis, k, structure)
+        for axis in label_axes
+        for k in range(arr.numblocks[axis] - 1)
+    ]
+    mapping = _resolve_equivalences(n_total, edges)
+    dtype = smallest_uint_dtype(int(mapping.max()))
+    mapping = mapping.astype(dtype)
+
+    def _relabel(block: NDArray, block_info=None) -> NDArray:
+        loc = tuple(block_info[0]["chunk-location"])
+        lab, _ = ndi.label(block != 0, structure=structure)
+        return mapping[np.where(lab > 0, lab + offsets[loc], 0)]
+
+    return arr.map_blocks(_relabel, dtype=dtype)
+
+
+def smallest_uint_dtype(max_value: int) -> np.dtype:
+    """The smallest unsigned integer dtype that can represent `max_value`."""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+
+def _make_structure(ndim: int, label_axes: list[int], connectivity: int) -> NDArray:
+    """Structuring element that only connects pixels along `label_axes`."""
+    connectivity = min(max(connectivity, 1), len(label_axes))
+    sub = ndi.generate_binary_structure(len(label_axes), connectivity)
+    structure = np.zeros((3,) * ndim, dtype=bool)
+    sl = tuple(slice(None) if i in label_axes else 1 for i in range(ndim))
+    structure[sl] = sub
+    return structure
+
+
+def _take(arr: NDArray, axis: int, index: int) -> NDArray:
+    """Slice of thickness 1 along `axis`."""
+    sl = [slice(None)] * arr.ndim
+    sl[axis] = slice(index, index + 1) if index >= 0 else slice(index, None)
+    return arr[tuple(sl)]
+
+
+def _boundary_edges(
+    faces: dict[tuple[int, ...], dict[int, tuple[NDArray, NDArray]]],
+    offsets: NDArray[np.int64],
+    numblocks: tuple[int, ...],
+    axis: int,
+    k: int,
+    structure: NDArray,
+) -> NDArray[np.int64]:
+    """Pairs of global labels connected across the k-th chunk boundary of `axis`.
+
+    The slab spans the whole array along the other axes, so that connections across
+    the corners of the chunks are also found.
+    """
+
+    def _global(block_id: tuple[int, ...], face: NDArray) -> NDArray[np.int64]:
+        face = face.astype(np.int64)
+        return np.where(face > 0, face + offsets[block_id], 0)
+
+    def _build(prefix: tuple[int, ...]):
+        dim = len(prefix)
+        if dim == len(numblocks):
+            before = prefix[:axis] + (k,) + prefix[axis + 1 :]
+            after = prefix[:axis] + (k + 1,) + prefix[axis + 1 :]
+            return np.concatenate(
+                [
+                    _global(before, faces[before][axis][1]),
+                    _global(after, faces[after][axis][0]),
+                ],
+                axis=axis,
+            )
+        if dim == axis:
+            return [_build(prefix + (k,))]
+        return [_build(prefix + (i,)) for i in range(numblocks[dim])]
+
+    slab = np.block(_build(()))
+    lab, _ = ndi.label(slab > 0, structure=structure)
+    fg = lab > 0
+    group, glabel = lab[fg], slab[fg]
+    order = np.lexsort((glabel, group))
+    group, glabel = group[order], glabel[order]
+    same = (group[1:] == group[:-1]) & (glabel[1:] != glabel[:-1])
+    return np.stack([glabel[:-1][same], glabel[1:][same]], axis=1)
+
+
+def _resolve_equivalences(
+    n_labels: int, edges: list[NDArray[np.int64]]
+) -> NDArray[np.int64]:
+    """Map from the chunk-wise labels to the sequential merged labels."""
+    pairs = np.concatenate([np.zeros((0, 2), dtype=np.int64), *edges], axis=0)
+    n_nodes = n_labels + 1
+    graph = sparse.coo_matrix(
+        (np.ones(pairs.shape[0], dtype=np.int8), (pairs[:, 0], pairs[:, 1])),
+        shape=(n_nodes, n_nodes),
+    )
+    _, component = connected_components(graph, directed=False)
+    # number the components in the order of their smallest label; 0 is background
+    _, first, inverse = np.unique(component, return_index=True, return_inverse=True)
+    rank = np.empty(first.size, dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(first.size)
+    return rank[inverse.ravel()]
@@ -0,0 +1,304 @@
+"""Local maxima detection of chunked (possibly larger-than-memory) images.
+
+A pixel is a peak if it is the maximum of its circular footprint of radius
+`min_distance` and above the threshold. This is what `ImgArray.peak_local_max` does
+in impy, which passes the footprint to `skimage.feature.peak_local_max` and leaves
+its own `min_distance` at 1, so that no peak is suppressed by the pairwise spacing
+(pixels of a plateau are all peaks). This only depends on the neighborhood of each
+pixel, so each chunk is read with a halo of the footprint radius and only the peaks
+in the core of the chunk are kept. Peaks in the overlapping halos are therefore counted
+exactly once. Coordinates of the peaks are collected column by column, so that only
+a few chunks are in memory at a time.
+
+Blob detection works the same way in the scale space. Each chunk is filtered at all
+the scales with a halo of the largest kernel, and the filtered chunks are discarded
+as soon as their local maxima are found.
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Sequence
+import numpy as np
+from numpy.typing import NDArray
+from scipy import ndimage as ndi
+
+from himena_image._config import get_num_workers
+from himena_image.processing._chunked_label import smallest_uint_dtype
+from himena_image.processing._jobs import Job
+
+# Gaussian kernels are truncated at this many sigmas
+_TRUNCATE = 4.0
+# ratio of the sigmas of the two Gaussians in a DoG
+_DOG_RATIO = 1.6
+
+
+def peak_local_max_chunked(
+    arr: Any,
+    spatial_axes: Sequence[int],
+    min_distance: float = 1.0,
+    *,
+    threshold: float | None = None,
+    exclude_border: int = 0,
+    num_workers: int | None = None,
+    job: Job | None = None,
+) -> list[NDArray[np.unsignedinteger]]:
+    """Find the local maxima of an array chunk by chunk.
+
+    Parameters
+    ----------
+    arr : numpy or dask array
+        Input image. A numpy array is processed plane by plane along the axes other
+        than `spatial_axes`, and a dask array chunk by chunk.
+    spatial_axes : sequence of int
+        Axes along which the local maxima are searched for. Each sub-array along the
+        other axes (such as each time point) is processed separately.
+    min_distance : float, default 1.0
+        Radius of the footprint, same as `min_distance` of `ImgArray.peak_local_max`.
+    threshold : float, optional
+        Peaks must be brighter than this value. By default, the minimum of each
+        plane is used.
+    exclude_border : int, default 0
+        Number of pixels at the image border along the spatial axes that cannot be
+        peaks.
+    num_workers : int, optional
+        Number of threads.
+    job : Job, optional
+        Job to report the progress to.
+
+    Returns
+    -------
+    list of arrays
+        Coordinates of the peaks along each axis, sorted in the C order.
+    """
+    spatial_axes = sorted(a % arr.ndim for a in spatial_axes)
+    footprint = _footprint(min_distance, arr.ndim, spatial_axes)
+    halo = tuple(s // 2 for s in footprint.shape)
+    regions = _block_regions(_chunks_of(arr, spatial_axes))
+    coord_dtype = smallest_uint_dtype(max(arr.shape))
+    # the default threshold and the triviality depend on the whole plane, not on the
+    # chunk, so they are computed before the chunks are processed
+    plane_min, plane_max = _plane_range(arr, spatial_axes)
+    plane_thr = plane_min if threshold is None else threshold
+    # no peak in a constant plane, same as skimage
+    plane_ok = (plane_min < plane_max) | (footprint.size == 1)
+
+    def _of_plane(values, region: tuple[slice, ...]):
+        """Values of the planes in the region, broadcastable to the region."""
+        if np.ndim(values) == 0:
+            return values
+        sl = [slice(None) if i in spatial_axes else s for i, s in enumerate(region)]
+        return values[tuple(sl)]
+
+    def _find(region: tuple[slice, ...]) -> list[NDArray]:
+        if job is not None:
+            job.check()
+        ok = _of_plane(plane_ok, region)
+        if not ok.any():
+            return [np.zeros(0, dtype=coord_dtype)] * arr.ndim
+        block, core = _read_with_halo(arr, region, halo)
+        image = block[core]
+        image_max = ndi.maximum_filter(block, footprint=footprint, mode="nearest")
+        mask = (image == image_max[core]) & (image > _of_plane(plane_thr, region)) & ok
+        coords = np.nonzero(mask)
+        out = [c + sl.start for c, sl in zip(coords, region)]
+        if exclude_border > 0:
+            inside = np.ones(out[0].size, dtype=bool)
+            for i in spatial_axes:
+                inside &= out[i] >= exclude_border
+                inside &= out[i] < arr.shape[i] - exclude_border
+            out = [c[inside] for c in out]
+        return [c.astype(coord_dtype) for c in out]
+
+    out = _collect_columns(_find, regions, arr.ndim, num_workers, job)
+    order = np.lexsort(out[::-1])
+    return [c[order] for c in out]
+
+
+def detect_blobs_chunked(
+    arr: Any,
+    spatial_axes: Sequence[int],
+    sigmas: Sequence[float],
+    method: str = "log",
+    *,
+    threshold: float = 0.0,
+    num_workers: int | None = None,
+    job: Job | None = None,
+) -> list[NDArray]:
+    """Detect blobs as the local maxima in the scale space, chunk by chunk.
+
+    Each chunk is filtered at all the scales and the local maxima of the stack of
+    the filtered chunks are searched for right away, so that the filtered image is
+    never stored. Responses are normalized by the scale, so that they can be
+    compared between scales.
+
+    Parameters
+    ----------
+    arr : numpy or dask array
+        Input image with bright blobs.
+    spatial_axes : sequence of int
+        Axes along which the blobs are searched for.
+    sigmas : sequence of float
+        Standard deviations of the Gaussian of each scale, in pixels.
+    method : {"log", "dog"}, default "log"
+        Laplacian of Gaussian (LoG) or difference of Gaussian (DoG), where each DoG
+        response is the difference between the Gaussian of sigma and 1.6 x sigma.
+    threshold : float, default 0.0
+        Blobs must have a larger normalized response than this value.
+    num_workers : int, optional
+        Number of threads.
+    job : Job, optional
+        Job to report the progress to.
+
+    Returns
+    -------
+    list of arrays
+        Coordinates of the blobs along each axis, the sigma and the normalized
+        response of each blob, sorted by the coordinates in the C order.
+    """
+    if method not in ("log", "dog"):
+        raise ValueError(f"`method` must be 'log' or 'dog', got {method!r}.")
+    spatial_axes = sorted(a % arr.ndim for a in spatial_axes)
+    sigmas = np.asarray(sigmas, dtype=np.float64)
+    max_sigma = sigmas.max() * (_DOG_RATIO if method == "dog" else 1.0)
+    # radius of the largest kernel, plus one pixel to compare with the neighbors
+    r = int(_TRUNCATE * max_sigma + 0.5) + 1
+    halo = tuple(r if i in spatial_axes else 0 for i in range(arr.ndim))
+    regions = _block_regions(_chunks_of(arr, spatial_axes))
+    coord_dtype = smallest_uint_dtype(max(arr.shape))
+    # 3x3x...x3 neighbors in the scale space
+    footprint = np.ones(
+        (3,) + tuple(3 if i in spatial_axes else 1 for i in range(arr.ndim)),
+        dtype=bool,
+    )
+
+    def _sigma_of(sigma: float) -> list[float]:
+        return [sigma if i in spatial_axes else 0.0 for i in range(arr.ndim)]
+
+    def _response(block: NDArray[np.float32], sigma: float) -> NDArray[np.float32]:
+        if method == "log":
+            # ndi.gaussian_laplace cannot skip the non-spatial axes
+            out = np.zeros_like(block)
+            for i in spatial_axes:
+                order = [2 if j == i else 0 for j in range(arr.ndim)]
+                out += ndi.gaussian_filter(
+                    block, _sigma_of(sigma), order=order, truncate=_TRUNCATE
+                )
+            out *= -(sigma**2)
+        else:
+            out = ndi.gaussian_filter(block, _sigma_of(sigma), truncate=_TRUNCATE)
+            out -= ndi.gaussian_filter(
+                block, _sigma_of(sigma * _DOG_RATIO), truncate=_TRUNCATE
+            )
+            out /= _DOG_RATIO - 1
+        return out
+
+    def _find(region: tuple[slice, ...]) -> list[NDArray]:
+        if job is not None:
+            job.check()
+        block, core = _read_with_halo(arr, region, halo, mode="symmetric")
+        block = block.astype(np.float32, copy=False)
+        cube = np.stack([_response(block, sigma) for sigma in sigmas], axis=0)
+        cube_max = ndi.maximum_filter(cube, footprint=footprint, mode="nearest")
+        core_cube = (slice(None),) + core
+        cube = cube[core_cube]
+        mask = (cube == cube_max[core_cube]) & (cube > threshold)
+        scale, *coords = np.nonzero(mask)
+        out = [(c + sl.start).astype(coord_dtype) for c, sl in zip(coords, region)]
+        return out + [sigmas[scale], cube[mask]]
+
+    out = _collect_columns(_find, regions, arr.ndim + 2, num_workers, job)
+    order = np.lexsort(out[: arr.ndim][::-1])
+    return [c[order] for c in out]
+
+
+def _collect_columns(
+    func: Callable[[tuple[slice, ...]], list[NDArray]],
+    regions: list[tuple[slice, ...]],
+    ncols: int,
+    num_workers: int | None,
+    job: Job | None,
+) -> list[NDArray]:
+    """Run `func` on each region in parallel and concatenate the returned columns."""
+    if job is not None:
+        job.add_total(len(regions))
+    columns: list[list[NDArray]] = [[] for _ in range(ncols)]
+    n_workers = max(min(get_num_workers(num_workers), len(regions)), 1)
+    with ThreadPoolExecutor(n_workers) as ex:
+        futures = [ex.submit(func, region) for region in regions]
+        try:
+            for future in as_completed(futures):
+                for column, c in zip(columns, future.result()):
+                    column.append(c)
+                if job is not None:
+                    job.advance()
+        except BaseException:
+            ex.shutdown(cancel_futures=True)
+            raise
+    return [np.concatenate(column) for column in columns]
+
+
+def _plane_range(arr: Any, spatial_axes: list[int]) -> tuple[NDArray, NDArray]:
+    """Minimum and maximum of each plane, keeping the spatial axes as size 1."""
+    axis = tuple(spatial_axes)
+    if isinstance(arr, np.ndarray):
+        return arr.min(axis=axis, keepdims=True), arr.max(axis=axis, keepdims=True)
+    import dask
+
+    return dask.compute(
+        arr.min(axis=axis, keepdims=True), arr.max(axis=axis, keepdims=True)
+    )
+
+
+def _footprint(radius: float, ndim: int, spatial_axes: list[int]) -> NDArray[np.bool_]:
+    """Ball-shaped footprint along `spatial_axes`, same as the one used in impy."""
+    nspatial = len(spatial_axes)
+    if nspatial == 1:
+        ball = np.ones(int(radius) * 2 + 1, dtype=bool)
+    else:
+        half = int(2 * radius) / 2
+        grid = np.meshgrid(*[np.arange(-half, half + 1)] * nspatial, indexing="ij")
+        ball = sum(g**2 for g in grid) <= radius**2
+    shape = [ball.shape[spatial_axes.index(i)] if i in spatial_axes else 1 for i in range(ndim)]  # fmt: skip
+    return ball.reshape(shape)
+
+
+def _chunks_of(arr: Any, spatial_axes: list[int]) -> tuple[tuple[int, ...], ...]:
+    if isinstance(arr, np.ndarray):
+        return tuple(
+            (size,) if i in spatial_axes else (1,) * size
+            for i, size in enumerate(arr.shape)
+        )
+    return arr.chunks
+
+
+def _block_regions(chunks: tuple[tuple[int, ...], ...]) -> list[tuple[slice, ...]]:
+    """Slices of all the blocks of a chunked array."""
+    bounds = [np.r_[0, np.cumsum(c)] for c in chunks]
+    return [
+        tuple(slice(b[i], b[i + 1]) for b, i in zip(bounds, block_id))
+        for block_id in np.ndindex(tuple(len(c) for c in chunks))
+    ]
+
+
+def _read_with_halo(
+    arr: Any,
+    region: tuple[slice, ...],
+    halo: tuple[int, ...],
+    mode: str = "edge",
+) -> tuple[NDArray, tuple[slice, ...]]:
+    """Read a block with its halo, padding the image border in the `np.pad` mode.
+
+    Returns the block and the slices of the core region in it.
+    """
+    ext, pad = [], []
+    for sl, h, size in zip(region, halo, arr.shape):
+        start, stop = max(sl.start - h, 0), min(sl.stop + h, size)
+        ext.append(slice(start, stop))
+        pad.append((h - (sl.start - start), h - (stop - sl.stop)))
+    block = arr[tuple(ext)]
+    if not isinstance(block, np.ndarray):
+        block = np.asarray(block.compute(scheduler="synchronous"))
+    block = np.pad(block, pad, mode=mode)
+    core = tuple(slice(h, h + sl.stop - sl.start) for sl, h in zip(region, halo))
+    return block, core
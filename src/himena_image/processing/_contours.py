@@ -0,0 +1,219 @@
+"""Vectorized contour tracing of label images.
+
+All the labels of a 2D plane are traced at once along the pixel edges. Each boundary
+edge is linked to the next one by looking up the 2x2 neighborhood of its end vertex,
+and the resulting cycles are ordered by pointer jumping, so that no Python loop runs
+over the labels or the vertices. Diagonally touching pixels of the same label are
+traced as a single contour (8-connectivity).
+"""
+
+from __future__ import annotations
+
+from typing import NamedTuple
+import numpy as np
+from numpy.typing import NDArray
+
+# edge directions (east, south, west, north) as (dx, dy) in the image coordinates,
+# where the y axis points down
+_DX = np.array([1, 0, -1, 0], dtype=np.int64)
+_DY = np.array([0, 1, 0, -1], dtype=np.int64)
+
+
+class Contours(NamedTuple):
+    """Polygons of the traced labels.
+
+    Coordinates are the (x, y) pixel corners, where the pixel (y, x) spans from
+    (x, y) to (x + 1, y + 1). Polygons are concatenated into one array.
+    """
+
+    labels: NDArray[np.integer]
+    coords: NDArray[np.int64]  # (N, 2) array of (x, y)
+    lengths: NDArray[np.intp]
+
+    def split(self) -> list[NDArray[np.int64]]:
+        """Split the coordinates into a list of polygons."""
+        return np.split(self.coords, np.cumsum(self.lengths)[:-1])
+
+
+def trace_label_contours(labels: NDArray[np.integer]) -> Contours:
+    """Trace the outer contours of all the labels in a 2D label image.
+
+    The outer contour of each label is traced clockwise (in the y-down image
+    coordinates) along the pixel edges, and only the corner vertices are returned.
+    Holes are ignored. If a label consists of several separate regions, only the
+    largest contour is returned.
+    """
+    if labels.ndim != 2:
+        raise ValueError(f"Label image must be 2D, got {labels.ndim}D.")
+    padded = np.pad(labels, 1)
+    edges = _BoundaryEdges.from_labels(padded)
+    if edges.size == 0:
+        return Contours(
+            labels=np.zeros(0, dtype=labels.dtype),
+            coords=np.zeros((0, 2), dtype=np.int64),
+            lengths=np.zeros(0, dtype=np.intp),
+        )
+    succ = edges.successors(padded)
+    rep = _cycle_representatives(succ)
+    order = _order_cycles(succ, rep)
+    rep, direction = rep[order], edges.direction[order]
+    x, y = edges.x[order], edges.y[order]
+    cycle_start = np.flatnonzero(np.r_[True, rep[1:] != rep[:-1]])
+    cycle_len = np.diff(np.r_[cycle_start, rep.size])
+
+    # only keep the vertices where the direction changes
+    prev_direction = np.roll(direction, 1)
+    prev_direction[cycle_start] = direction[cycle_start + cycle_len - 1]
+    is_corner = direction != prev_direction
+    cycle_id = np.repeat(np.arange(cycle_start.size), cycle_len)
+    x, y, cycle_id = x[is_corner], y[is_corner], cycle_id[is_corner]
+    lengths = np.bincount(cycle_id, minlength=cycle_start.size)
+    starts = np.cumsum(lengths) - lengths
+
+    # signed area by the shoelace formula; positive for outer contours
+    x_next = np.roll(x, -1)
+    y_next = np.roll(y, -1)
+    last = starts + lengths - 1
+    x_next[last], y_next[last] = x[starts], y[starts]
+    area = np.bincount(cycle_id, weights=x * y_next - x_next * y) / 2
+    cycle_label = padded.ravel()[edges.pixel[order][cycle_start]]
+
+    # the largest outer contour of each label
+    outer = np.flatnonzero(area > 0)
+    outer = outer[np.lexsort((-area[outer], cycle_label[outer]))]
+    is_first = np.r_[True, cycle_label[outer][1:] != cycle_label[outer][:-1]]
+    selected = outer[is_first]
+
+    # gather the vertices of the selected contours
+    out_lengths = lengths[selected]
+    out_starts = np.cumsum(out_lengths) - out_lengths
+    vertex = (
+        np.arange(out_lengths.sum())
+        - np.repeat(out_starts, out_lengths)
+        + np.repeat(starts[selected], out_lengths)
+    )
+    coords = np.stack([x[vertex], y[vertex]], axis=1) - 1  # remove padding
+    return Contours(
+        labels=cycle_label[selected],
+        coords=coords,
+        lengths=out_lengths.astype(np.intp),
+    )
+
+
+class _BoundaryEdges(NamedTuple):
+    """Directed boundary edges, with the label on the right-hand side."""
+
+    pixel: NDArray[np.intp]  # flat index of the pixel in the padded image
+    direction: NDArray[np.int64]
+    x: NDArray[np.int64]  # start vertex
+    y: NDArray[np.int64]
+    offsets: NDArray[np.intp]  # start of the edges of each direction
+
+    @property
+    def size(self) -> int:
+        return self.pixel.size
+
+    @classmethod
+    def from_labels(cls, padded: NDArray[np.integer]) -> _BoundaryEdges:
+        """Find all the boundary edges of a padded label image."""
+        inner = padded[1:-1, 1:-1]
+        fg = inner != 0
+        masks = [
+            fg & (inner != padded[:-2, 1:-1]),  # top side, directed east
+            fg & (inner != padded[1:-1, 2:]),  # right side, directed south
+            fg & (inner != padded[2:, 1:-1]),  # bottom side, directed west
+            fg & (inner != padded[1:-1, :-2]),  # left side, directed north
+        ]
+        # start vertex of each side relative to the pixel (r, c) -> corner (c, r)
+        start_dx = [0, 1, 1, 0]
+        start_dy = [0, 0, 1, 1]
+        pixel, direction, xs, ys = [], [], [], []
+        for d, mask in enumerate(masks):
+            r, c = np.nonzero(mask)
+            r, c = r + 1, c + 1  # padded coordinates
+            pixel.append(r * padded.shape[1] + c)
+            direction.append(np.full(r.size, d, dtype=np.int64))
+            xs.append(c + start_dx[d])
+            ys.append(r + start_dy[d])
+        counts = [p.size for p in pixel]
+        return cls(
+            pixel=np.concatenate(pixel),
+            direction=np.concatenate(direction),
+            x=np.concatenate(xs).astype(np.int64),
+            y=np.concatenate(ys).astype(np.int64),
+            offsets=np.r_[0, np.cumsum(counts)].astype(np.intp),
+        )
+
+    def _find(self, direction: NDArray[np.int64], pixel: NDArray[np.intp]):
+        """Index of the edge with the given direction and pixel."""
+        out = np.empty(pixel.size, dtype=np.intp)
+        for d in range(4):
+            sel = direction == d
+            lo, hi = self.offsets[d], self.offsets[d + 1]
+            out[sel] = lo + np.searchsorted(self.pixel[lo:hi], pixel[sel])
+        return out
+
+    def successors(self, padded: NDArray[np.integer]) -> NDArray[np.intp]:
+        """Index of the next edge of each edge.
+
+        At each end vertex, turning left is preferred over going straight, which is
+        preferred over turning right. This links diagonally touching pixels.
+        """
+        flat = padded.ravel()
+        width = padded.shape[1]
+        label = flat[self.pixel]
+        ex = self.x + _DX[self.direction]
+        ey = self.y + _DY[self.direction]
+        # pixels around the end vertex (ex, ey)
+        nw = flat[(ey - 1) * width + ex - 1]
+        ne = flat[(ey - 1) * width + ex]
+        sw = flat[ey * width + ex - 1]
+        se = flat[ey * width + ex]
+        # whether an edge of the label leaves the vertex in each direction
+        leaves = [
+            (se == label) & (ne != label),  # east: top side of the SE pixel
+            (sw == label) & (se != label),  # south: right side of the SW pixel
+            (nw == label) & (sw != label),  # west: bottom side of the NW pixel
+            (ne == label) & (nw != label),  # north: left side of the NE pixel
+        ]
+        next_pixel = [ey * width + ex, ey * width + ex - 1, (ey - 1) * width + ex - 1, (ey - 1) * width + ex]  # fmt: skip
+        leaves_arr = np.stack(leaves, axis=0)
+        next_pixel_arr = np.stack(next_pixel, axis=0)
+        next_dir = np.full(self.size, -1, dtype=np.int64)
+        # candidates in the order of priority: left, straight, right
+        for turn in (3, 0, 1):
+            d = (self.direction + turn) % 4
+            ok = (next_dir < 0) & leaves_arr[d, np.arange(self.size)]
+            next_dir[ok] = d[ok]
+        if np.any(next_dir < 0):  # pragma: no cover
+            raise RuntimeError("Failed to link the boundary edges.")
+        pix = next_pixel_arr[next_dir, np.arange(self.size)]
+        return self._find(next_dir, pix)
+
+
+def _cycle_representatives(succ: NDArray[np.intp]) -> NDArray[np.intp]:
+    """Minimum index in the cycle of each element, by pointer jumping."""
+    rep = np.arange(succ.size)
+    jump = succ.copy()
+    while True:
+        new_rep = np.minimum(rep, rep[jump])
+        if np.array_equal(new_rep, rep):
+            return rep
+        rep = new_rep
+        jump = jump[jump]
+
+
+def _order_cycles(succ: NDArray[np.intp], rep: NDArray[np.intp]) -> NDArray[np.intp]:
+    """Order of the elements, grouped by cycle and following the successors."""
+    # break each cycle before its representative and rank the elements by their
+    # distance to the end of the list
+    idx = np.arange(succ.size)
+    nxt = np.where(succ == rep, idx, succ)
+    dist = (nxt != idx).astype(np.int64)
+    while True:
+        nxt_nxt = nxt[nxt]
+        if np.array_equal(nxt_nxt, nxt):
+            break
+        dist = dist + dist[nxt]
+        nxt = nxt_nxt
+    return np.lexsort((-dist, rep))
@@ -0,0 +1,262 @@
+"""Richardson-Lucy deconvolution with cached OTFs.
+
+The optical transfer function (OTF, the real FFT of the centered PSF) only depends on
+the PSF and the shape of the image, so it is computed once and cached by the hash of
+the PSF content and the shape. Each iteration reuses the same buffers, and planes (or
+channels) are deconvolved in parallel by `map_planes`.
+
+The iterations can optionally be accelerated by the vector extrapolation of Biggs and
+Andrews (Applied Optics, 1997), which typically reaches the same result with a few
+times fewer iterations.
+
+Large volumes can be deconvolved tile by tile. Each tile is extended by a margin of the
+PSF extent and deconvolved independently, and the neighboring tiles are blended with
+linear ramps across the seams. All the tiles have the same padded shape, so they share
+a single cached OTF, and the peak memory is proportional to the tile size.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import threading
+from typing import Callable
+import numpy as np
+from numpy.typing import NDArray
+
+from himena_image._config import get_num_workers
+from himena_image.processing._fft import _TileLayout, get_fft_backend
+
+# PSF values below this fraction of the maximum are cropped in tiled deconvolution
+_PSF_CROP_THRESHOLD = 1e-4
+# maximum number of cached OTFs
+_OTF_CACHE_SIZE = 8
+_OTF_CACHE: OrderedDict[tuple, NDArray[np.complex64]] = OrderedDict()
+_OTF_CACHE_LOCK = threading.Lock()
+
+
+def get_otf(psf: NDArray[np.number], shape: tuple[int, ...]) -> NDArray[np.complex64]:
+    """Cached (read-only) OTF of a PSF for an image of the given shape.
+
+    The PSF is normalized to sum 1, centered in an array of `shape` and shifted so
+    that its center is at the origin.
+    """
+    psf = np.asarray(psf, dtype=np.float32)
+    shape = tuple(shape)
+    key = (hashlib.sha1(psf.tobytes()).hexdigest(), psf.shape, shape)
+    with _OTF_CACHE_LOCK:
+        if key in _OTF_CACHE:
+            _OTF_CACHE.move_to_end(key)
+            return _OTF_CACHE[key]
+    otf = get_fft_backend().rfftn(np.fft.ifftshift(pad_psf(psf, shape)))
+    otf = otf.astype(np.complex64, copy=False)
+    otf.setflags(write=False)
+    with _OTF_CACHE_LOCK:
+        _OTF_CACHE[key] = otf
+        while len(_OTF_CACHE) > _OTF_CACHE_SIZE:
+            _OTF_CACHE.popitem(last=False)
+    return otf
+
+
+def pad_psf(psf: NDArray[np.float32], shape: tuple[int, ...]) -> NDArray[np.float32]:
+    """Normalize the PSF and pad it to `shape`, keeping the center at `shape // 2`."""
+    if psf.ndim != len(shape):
+        raise ValueError(
+            f"PSF must be {len(shape)}D to deconvolve {len(shape)}D images, got "
+            f"{psf.ndim}D."
+        )
+    if any(p > s for p, s in zip(psf.shape, shape)):
+        raise ValueError(f"PSF of shape {psf.shape} is larger than the image {shape}.")
+    total = psf.sum()
+    if total <= 0:
+        raise ValueError("PSF must have a positive sum.")
+    pad = [(s // 2 - p // 2, s - p - (s // 2 - p // 2)) for p, s in zip(psf.shape, shape)]  # fmt: skip
+    return np.pad(psf / total, pad)
+
+
+def richardson_lucy(
+    obs: NDArray[np.number],
+    psf: NDArray[np.number],
+    niter: int = 50,
+    eps: float = 1e-5,
+    *,
+    lmd: float = 0.0,
+    tol: float = 0.0,
+    accelerate: bool = False,
+    callback: Callable[[float], None] | None = None,
+) -> NDArray[np.float32]:
+    """Deconvolve an image by the Richardson-Lucy algorithm.
+
+    Same as `impy.ImgArray.lucy` (or `lucy_tv` if `lmd > 0`), but with the cached OTF
+    and the optional acceleration.
+
+    Parameters
+    ----------
+    obs : array
+        Observed image.
+    psf : array
+        Point spread function. It must not be larger than `obs`.
+    niter : int, default 50
+        Maximum number of iterations.
+    eps : float, default 1e-5
+        Division by values below this is substituted by zero.
+    lmd : float, default 0.0
+        Strength of the total variation regularization.
+    tol : float, default 0.0
+        Iterations stop when the relative change of the estimate is below this.
+    accelerate : bool, default False
+        If True, extrapolate the estimate along the direction of the last update.
+    callback : callable, optional
+        Called after each iteration with the relative change of the estimate.
+    """
+    obs = np.asarray(obs, dtype=np.float32)
+    otf = get_otf(psf, obs.shape)
+    otf_conj = otf.conj()
+    fft = get_fft_backend()
+
+    def _convolve(a: NDArray[np.float32], kernel: NDArray[np.complex64]):
+        spec = fft.rfftn(a)
+        np.multiply(spec, kernel, out=spec)
+        return fft.irfftn(spec, s=obs.shape).astype(np.float32, copy=False)
+
+    estimated = _convolve(obs, otf)
+    ratio = np.zeros(obs.shape, dtype=np.float32)
+    prev: NDArray[np.float32] | None = None
+    g1: NDArray[np.float32] | None = None  # last two updates for the acceleration
+    g2: NDArray[np.float32] | None = None
+    for _ in range(niter):
+        y = estimated
+        if accelerate and g2 is not None:
+            alpha = float(np.vdot(g1, g2) / max(np.vdot(g2, g2), 1e-12))
+            alpha = min(max(alpha, 0.0), 1.0)
+            y = estimated + alpha * (estimated - prev)
+            np.maximum(y, 0, out=y)
+        conv = _convolve(y, otf)
+        ratio.fill(0)
+        np.divide(obs, conv, out=ratio, where=conv > eps)
+        new = _convolve(ratio, otf_conj)
+        np.multiply(new, y, out=new)
+        if lmd > 0:
+            new /= 1 - lmd * _tv_term(y)
+        change = float(
+            np.abs(new - estimated).sum() / max(np.abs(estimated).sum(), eps)
+        )
+        if accelerate:
+            g2, g1 = g1, new - y
+        prev, estimated = estimated, new
+        if callback is not None:
+            callback(change)
+        if change < tol:
+            break
+    return estimated
+
+
+def richardson_lucy_tiled(
+    obs: NDArray[np.number],
+    psf: NDArray[np.number],
+    tile_size: int,
+    niter: int = 50,
+    eps: float = 1e-5,
+    *,
+    num_workers: int | None = None,
+    callback: Callable[[float], None] | None = None,
+    **kwargs,
+) -> NDArray[np.float32]:
+    """Deconvolve an image tile by tile by the Richardson-Lucy algorithm.
+
+    Parameters are the same as `richardson_lucy`, except for `tile_size`, the size of
+    each tile along each axis, and `num_workers`, the number of threads used to
+    deconvolve the tiles in parallel. `callback` is called for each iteration of each
+    tile.
+    """
+    obs = np.asarray(obs, dtype=np.float32)
+    psf = crop_psf(psf)
+    layout = tile_layout(obs.shape, psf.shape, tile_size)
+    out = np.zeros(obs.shape, dtype=np.float32)
+    lock = threading.Lock()
+
+    def _run(tile: tuple[slice, ...]):
+        ext, pads, keep, region, weights = [], [], [], [], []
+        for sl, size, margin, block in zip(
+            tile, obs.shape, layout.margins, layout.blocks
+        ):
+            start, stop = max(sl.start - margin, 0), min(sl.stop + margin, size)
+            ext.append(slice(start, stop))
+            pad_before = margin - (sl.start - start)
+            pads.append((pad_before, block - pad_before - (stop - start)))
+            # blend with the neighbors over +/- half the margin around the seams
+            half = margin // 2
+            k0, k1 = max(sl.start - half, 0), min(sl.stop + half, size)
+            keep.append(slice(k0 - start + pad_before, k1 - start + pad_before))
+            region.append(slice(k0, k1))
+            weights.append(_ramp(k0, k1, sl, half, size))
+        block = np.pad(obs[tuple(ext)], pads, mode="reflect")
+        result = richardson_lucy(block, psf, niter, eps, callback=callback, **kwargs)
+        weight = weights[0]
+        for w in weights[1:]:
+            weight = np.multiply.outer(weight, w)
+        with lock:
+            out[tuple(region)] += result[tuple(keep)] * weight
+
+    tiles = list(layout.iter_tiles())
+    n_workers = max(min(get_num_workers(num_workers), len(tiles)), 1)
+    with ThreadPoolExecutor(n_workers) as ex:
+        futures = [ex.submit(_run, tile) for tile in tiles]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            ex.shutdown(cancel_futures=True)
+            raise
+    return out
+
+
+def crop_psf(psf: NDArray[np.number]) -> NDArray[np.float32]:
+    """Crop the negligible values of a PSF symmetrically around its center."""
+    psf = np.asarray(psf, dtype=np.float32)
+    significant = np.nonzero(psf > psf.max() * _PSF_CROP_THRESHOLD)
+    sl = []
+    for idx, size in zip(significant, psf.shape):
+        center = size // 2
+        radius = int(max(center - idx.min(), idx.max() - center))
+        sl.append(slice(max(center - radius, 0), center + radius + 1))
+    return psf[tuple(sl)]
+
+
+def tile_layout(
+    shape: tuple[int, ...], psf_shape: tuple[int, ...], tile_size: int
+) -> _TileLayout:
+    """Tiling of an image for the deconvolution with a (cropped) PSF."""
+    margin = max(psf_shape)
+    return _TileLayout.from_shape(shape, max(tile_size, 2 * margin), margin)
+
+
+def _ramp(start: int, stop: int, tile: slice, half: int, size: int) -> NDArray:
+    """1D blending weight of the kept region [start, stop) of a tile.
+
+    Weights of the neighboring tiles linearly cross over the seams and sum up to 1.
+    """
+    x = np.arange(start, stop, dtype=np.float32) + 0.5
+    weight = np.ones(stop - start, dtype=np.float32)
+    if half == 0:
+        return weight
+    if tile.start > 0:
+        weight = np.minimum(weight, (x - (tile.start - half)) / (2 * half))
+    if tile.stop < size:
+        weight = np.minimum(weight, ((tile.stop + half) - x) / (2 * half))
+    return np.clip(weight, 0, 1)
+
+
+def _tv_term(est: NDArray[np.float32]) -> NDArray[np.float32]:
+    """Divergence of the normalized gradient, for the total variation."""
+    grad = np.gradient(est)
+    if est.ndim == 1:
+        grad = [grad]
+    norm = np.sqrt(sum(g**2 for g in grad))
+    out = np.zeros(est.shape, dtype=np.float32)
+    for i, g in enumerate(grad):
+        unit = np.zeros(est.shape, dtype=np.float32)
+        np.divide(g, norm, out=unit, where=norm > 1e-8)
+        out += np.gradient(unit, axis=i)
+    return out
@@ -0,0 +1,170 @@
+"""Streaming drift tracking by phase cross-correlation.
+
+Each frame is Fourier transformed exactly once. The spectrum of a frame is shared by
+the two correlations with its previous and next frames, and is released as soon as
+both are done. Frames are read (and computed, if lazy) in the worker threads, and only
+a bounded window of frames is in flight, so the memory usage does not depend on the
+number of frames. The sub-pixel shift is refined by the upsampled DFT only around the
+peak of the cross-correlation, same as `impy.ImgArray.track_drift`.
+
+The estimated shifts are applied lazily by `shift_frames_lazy`, which only shifts
+the frames that are computed, so that a corrected time series larger than memory
+can be browsed and saved frame by frame.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Sequence
+import impy as ip
+import numpy as np
+from numpy.typing import NDArray
+from scipy import ndimage as ndi
+
+from himena_image._config import get_num_workers
+from himena_image.processing._fft import get_fft_backend
+from himena_image.processing._jobs import Job
+
+# number of frame pairs in flight per worker
+_PAIRS_PER_WORKER = 2
+
+
+def track_drift_streaming(
+    arr: Any,
+    along: int = 0,
+    *,
+    upsample_factor: int = 10,
+    max_shift: float | None = None,
+    num_workers: int | None = None,
+    job: Job | None = None,
+) -> NDArray[np.float32]:
+    """Track the drift of each frame relative to the first one.
+
+    Parameters
+    ----------
+    arr : numpy or dask array
+        Time series. Each frame is the sub-array along `along`.
+    along : int, default 0
+        Axis of the frames.
+    upsample_factor : int, default 10
+        Up-sampling factor of the sub-pixel refinement.
+    max_shift : float, optional
+        Maximum shift between two successive frames.
+    num_workers : int, optional
+        Number of threads.
+    job : Job, optional
+        Job to report the progress to.
+
+    Returns
+    -------
+    (N, ndim - 1) array
+        Cumulative shift of each frame.
+    """
+    from impy.arrays._utils._corr import subpixel_pcc
+
+    along = along % arr.ndim
+    nframes = arr.shape[along]
+    fft = get_fft_backend()
+
+    def _spectrum(i: int) -> NDArray[np.complex64]:
+        if job is not None:
+            job.check()
+        sl = (slice(None),) * along + (i,)
+        frame = arr[sl]
+        if not isinstance(frame, np.ndarray):
+            frame = frame.compute(scheduler="synchronous")
+        return fft.fftn(np.asarray(frame, dtype=np.float32))
+
+    def _shift(f0: Future, f1: Future) -> NDArray[np.float32]:
+        # the spectra are submitted earlier, so they are running or done
+        shift, _ = subpixel_pcc(
+            f0.result(),
+            f1.result(),
+            upsample_factor=upsample_factor,
+            max_shifts=max_shift,
+        )
+        return np.asarray(shift, dtype=np.float32)
+
+    if job is not None:
+        job.add_total(max(nframes - 1, 0))
+    result = np.zeros((nframes, arr.ndim - 1), dtype=np.float32)
+    n_workers = get_num_workers(num_workers)
+    window = _PAIRS_PER_WORKER * n_workers
+    pending: deque[tuple[int, Future]] = deque()
+
+    def _pop():
+        i, future = pending.popleft()
+        result[i] = future.result()
+        if job is not None:
+            job.advance()
+
+    with ThreadPoolExecutor(n_workers) as ex:
+        try:
+            prev = None
+            for i in range(nframes):
+                cur = ex.submit(_spectrum, i)
+                if prev is not None:
+                    pending.append((i, ex.submit(_shift, prev, cur)))
+                prev = cur
+                while len(pending) >= window:
+                    _pop()
+            while pending:
+                _pop()
+        except BaseException:
+            ex.shutdown(cancel_futures=True)
+            raise
+    return np.cumsum(result, axis=0)
+
+
+def shift_frames_lazy(
+    arr: Any,
+    axes: Sequence[str],
+    dims: Sequence[str],
+    shift_of: Callable[[dict[str, int]], NDArray[np.float32]],
+    *,
+    order: int = 1,
+    mode: str = "constant",
+    cval: float = 0.0,
+):
+    """Lazily shift each frame of an array by `ndi.shift`.
+
+    Parameters
+    ----------
+    arr : numpy or dask array
+        Input array.
+    axes : sequence of str
+        Names of the axes of `arr`.
+    dims : sequence of str
+        Axes of each frame. All the other axes are iterated over.
+    shift_of : callable
+        Function that returns the shift of a frame from the dict of the axis names
+        and the indices of the frame.
+    order, mode, cval
+        Passed to `ndi.shift`.
+
+    Returns
+    -------
+    dask array
+        Lazy array of the same dtype as `arr`, chunked frame by frame. Each frame is
+        only shifted when it is computed.
+    """
+    import dask.array as da
+
+    axes = [str(a) for a in axes]
+    frame_axes = [i for i, a in enumerate(axes) if a in dims]
+    arr = da.asarray(arr).rechunk(
+        {i: -1 if i in frame_axes else 1 for i in range(len(axes))}
+    )
+    squeeze = tuple(slice(None) if i in frame_axes else 0 for i in range(len(axes)))
+
+    def _shift(block: NDArray, block_info=None) -> NDArray:
+        loc = block_info[0]["chunk-location"]
+        index = {a: loc[i] for i, a in enumerate(axes) if i not in frame_axes}
+        frame = block[squeeze].astype(np.float32, copy=False)
+        out = ndi.shift(frame, shift_of(index), order=order, mode=mode, cval=cval)
+        # shift in float and cast back, same as impy
+        out = ip.asarray(out).as_img_type(block.dtype).value
+        return out.reshape(block.shape)
+
+    return arr.map_blocks(_shift, dtype=arr.dtype)
@@ -0,0 +1,261 @@
+"""Fast paths of the local filters with large radii.
+
+The ball-shaped footprint of radius r is decomposed into its 1D chords along the last
+axis (2r + 1 chords in 2D). Then
+
+- the sum over the footprint is the sum of the chord sums, each of which is the
+  difference of two values of the running sum along the last axis (mean, std and coef
+  filters),
+- the minimum (maximum) over the footprint is the minimum (maximum) of the 1D running
+  minima (maxima) of the chord lengths, which cost O(1) per pixel regardless of the
+  length (min and max filters),
+- the median of unsigned integer images is calculated from the sliding histogram of
+  `skimage.filters.rank`, which is updated incrementally as the footprint moves.
+
+The results are the same as the filters with the full footprint, while the cost per
+pixel grows with r instead of r^2 (r^2 instead of r^3 in 3D).
+
+The rank filters of `skimage.filters.rank` are built on the same principle, but the
+entropy is calculated from all the bins of the histogram at every pixel. Here, the
+sum of c log c over the bins is updated together with the histogram, so that each
+step of the window only costs the pixels entering and leaving it. Histograms of many
+lines are kept side by side and updated at once with vectorized numpy operations.
+The contrast enhancement only needs the local minimum and maximum, which are
+calculated by the running minimum and maximum above.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+from numpy.typing import NDArray
+from scipy import ndimage as ndi
+
+# radius from which the fast paths are used
+FAST_RADIUS = 4.0
+
+# maximum number of histogram bins (summed over the lines) held at once
+_HIST_BUDGET = 1 << 22
+
+# scipy.ndimage boundary modes to np.pad modes
+_PAD_MODES = {
+    "reflect": "symmetric",
+    "mirror": "reflect",
+    "nearest": "edge",
+    "wrap": "wrap",
+    "constant": "constant",
+}
+
+
+def ball_footprint(radius: float, ndim: int) -> NDArray[np.bool_]:
+    """Ball-shaped footprint, same as the one used in impy."""
+    if ndim == 1:
+        return np.ones(int(radius) * 2 + 1, dtype=bool)
+    half = int(2 * radius) / 2
+    grid = np.meshgrid(*[np.arange(-half, half + 1)] * ndim, indexing="ij")
+    return sum(g**2 for g in grid) <= radius**2
+
+
+def supports_fast_path(kind: str, radius: float, dtype: np.dtype) -> bool:
+    """True if the fast path of the filter can be used."""
+    if radius < FAST_RADIUS:
+        return False
+    if kind == "median":
+        return dtype in (np.uint8, np.uint16)
+    return kind in ("mean", "min", "max", "std", "coef")
+
+
+def fast_filter(
+    kind: str,
+    arr: NDArray[np.number],
+    radius: float,
+    mode: str = "reflect",
+    cval: float = 0.0,
+) -> NDArray[np.number]:
+    """Apply a local filter with a ball-shaped footprint of `radius` to `arr`.
+
+    The output dtype is the same as the corresponding impy method: mean and median
+    filters keep the input dtype, and the others return float32.
+    """
+    footprint = ball_footprint(radius, arr.ndim)
+    if kind in ("min", "max", "median"):
+        center = [s // 2 for s in footprint.shape]
+    else:
+        # impy calculates the sum by convolution, which flips the footprint, so the
+        # center of an even-sized footprint is shifted by one pixel
+        center = [(s - 1) // 2 for s in footprint.shape]
+    pads = [(c, s - 1 - c) for c, s in zip(center, footprint.shape)]
+    kwargs = {"constant_values": cval} if mode == "constant" else {}
+    padded = np.pad(arr, pads, mode=_PAD_MODES[mode], **kwargs)
+    if kind == "median":
+        return _median(padded, footprint, arr.shape, pads)
+    if kind in ("min", "max"):
+        return _min_or_max(padded, footprint, arr.shape, kind).astype(np.float32)
+    count = footprint.sum()
+    mean = _ball_sum(padded, footprint, arr.shape) / count
+    if kind == "mean":
+        if arr.dtype.kind in "ui":
+            mean = np.floor(mean + 0.5)
+        return mean.astype(arr.dtype)
+    sq = _ball_sum(padded.astype(np.float64) ** 2, footprint, arr.shape) / count
+    std = np.sqrt(np.maximum(sq - mean**2, 0))
+    if kind == "std":
+        return std.astype(np.float32)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (std / mean).astype(np.float32)
+
+
+def _chords(footprint: NDArray[np.bool_]):
+    """Iterate over the (leading indices, first, last) of the chords of a footprint."""
+    for lead in np.ndindex(footprint.shape[:-1]):
+        cols = np.flatnonzero(footprint[lead])
+        if cols.size > 0:
+            yield lead, int(cols[0]), int(cols[-1])
+
+
+def _ball_sum(
+    padded: NDArray[np.number],
+    footprint: NDArray[np.bool_],
+    shape: tuple[int, ...],
+) -> NDArray[np.float64]:
+    width = shape[-1]
+    csum = np.zeros(padded.shape[:-1] + (padded.shape[-1] + 1,), dtype=np.float64)
+    np.cumsum(padded, axis=-1, out=csum[..., 1:])
+    out = np.zeros(shape, dtype=np.float64)
+    for lead, first, last in _chords(footprint):
+        rows = tuple(slice(i, i + n) for i, n in zip(lead, shape[:-1]))
+        out += csum[rows + (slice(last + 1, last + 1 + width),)]
+        out -= csum[rows + (slice(first, first + width),)]
+    return out
+
+
+def _min_or_max(
+    padded: NDArray[np.number],
+    footprint: NDArray[np.bool_],
+    shape: tuple[int, ...],
+    kind: str,
+) -> NDArray[np.number]:
+    width = shape[-1]
+    filter1d = ndi.minimum_filter1d if kind == "min" else ndi.maximum_filter1d
+    reduce = np.minimum if kind == "min" else np.maximum
+    running: dict[int, NDArray[np.number]] = {}  # running min/max of each length
+    out = None
+    for lead, first, last in _chords(footprint):
+        length = last - first + 1
+        if length not in running:
+            running[length] = filter1d(padded, length, axis=-1)
+        start = first + length // 2
+        rows = tuple(slice(i, i + n) for i, n in zip(lead, shape[:-1]))
+        chord = running[length][rows + (slice(start, start + width),)]
+        out = chord.copy() if out is None else reduce(out, chord, out=out)
+    return out
+
+
+def _median(
+    padded: NDArray[np.unsignedinteger],
+    footprint: NDArray[np.bool_],
+    shape: tuple[int, ...],
+    pads: list[tuple[int, int]],
+) -> NDArray[np.unsignedinteger]:
+    from skimage.filters.rank import median
+
+    out = median(padded, footprint=footprint.astype(np.uint8))
+    return out[tuple(slice(p, p + n) for (p, _), n in zip(pads, shape))]
+
+
+def fast_entropy(
+    arr: NDArray[np.integer], radius: float, n_bins: int = 256
+) -> NDArray[np.float32]:
+    """Local entropy in bits, same as `skimage.filters.rank.entropy`.
+
+    Parameters
+    ----------
+    arr : array of integers
+        Quantized image, with values in [0, n_bins).
+    radius : float
+        Radius of the ball-shaped footprint.
+    n_bins : int, default 256
+        Number of histogram bins.
+    """
+    shape = arr.shape
+    footprint = ball_footprint(radius, arr.ndim)
+    if arr.ndim > 3:
+        raise ValueError(f"Entropy filter is not supported for {arr.ndim}D images.")
+    # (sliding axis, middle axis, vectorized axis)
+    while arr.ndim < 3:
+        arr = arr[..., np.newaxis]
+        footprint = footprint[..., np.newaxis]
+    nz, ny, nx = arr.shape
+    pads = [(s // 2, s - 1 - s // 2) for s in footprint.shape]
+    # out-of-image pixels are counted in the extra bin, which is ignored
+    padded = np.pad(arr.astype(np.intp), pads, constant_values=n_bins)
+    nbins = n_bins + 1
+    total = int(footprint.sum())
+    c = np.arange(total + 1, dtype=np.float64)
+    flog = np.zeros(total + 1, dtype=np.float64)
+    flog[1:] = c[1:] * np.log2(c[1:])
+    gain = np.diff(flog)  # change of c log c when c increases by one
+
+    # columns of the footprint along the sliding axis, which are contiguous
+    columns = []
+    for dy, dx in np.ndindex(footprint.shape[1:]):
+        rows = np.flatnonzero(footprint[:, dy, dx])
+        if rows.size > 0:
+            columns.append((dy, dx, int(rows[0]), int(rows[-1])))
+
+    # lines of the middle axis and strips of the sliding axis processed at once
+    my = min(max(_HIST_BUDGET // (nx * nbins), 1), ny)
+    nstrips = min(max(_HIST_BUDGET // (my * nx * nbins), 1), nz)
+    height = -(-nz // nstrips)
+    extra = nstrips * height - nz
+    padded = np.pad(padded, [(0, extra), (0, 0), (0, 0)], constant_values=n_bins)
+    out = np.empty((nstrips * height, ny, nx), dtype=np.float32)
+
+    for y0 in range(0, ny, my):
+        y1 = min(y0 + my, ny)
+        size = nstrips * (y1 - y0) * nx
+        hist = np.zeros(size * nbins, dtype=np.int32)
+        base = np.arange(size, dtype=np.intp) * nbins
+        sum_flog = np.zeros(size, dtype=np.float64)
+
+        def _values(z: int, dy: int, dx: int) -> NDArray[np.intp]:
+            block = padded[z : z + nstrips * height : height, y0 + dy : y1 + dy]
+            return base + block[..., dx : dx + nx].ravel()
+
+        def _update(index: NDArray[np.intp], sign: int):
+            count = hist[index]
+            hist[index] = count + sign
+            if sign > 0:
+                sum_flog[:] += gain[count]
+            else:
+                sum_flog[:] -= gain[count - 1]
+
+        for dy, dx, first, last in columns:
+            for dz in range(first, last + 1):
+                _update(_values(dz, dy, dx), 1)
+        for i in range(height):
+            if i > 0:
+                for dy, dx, first, last in columns:
+                    _update(_values(i - 1 + first, dy, dx), -1)
+                    _update(_values(i + last, dy, dx), 1)
+            outside = hist[base + n_bins]
+            n = total - outside
+            with np.errstate(divide="ignore", invalid="ignore"):
+                # n is zero only in the rows padded to fill the last strip
+                ent = np.log2(n) - (sum_flog - flog[outside]) / n
+            out[i::height, y0:y1] = ent.reshape(nstrips, y1 - y0, nx)
+    return out[:nz].reshape(shape)
+
+
+def fast_enhance_contrast(arr: NDArray[np.number], radius: float) -> NDArray[np.number]:
+    """Local contrast enhancement, same as `skimage.filters.rank.enhance_contrast`.
+
+    Each pixel is replaced by the local maximum or minimum, whichever is closer.
+    """
+    footprint = ball_footprint(radius, arr.ndim)
+    pads = [(s // 2, s - 1 - s // 2) for s in footprint.shape]
+    # the edge values are always within the footprint cropped at the border
+    padded = np.pad(arr, pads, mode="edge")
+    vmin = _min_or_max(padded, footprint, arr.shape, "min")
+    vmax = _min_or_max(padded, footprint, arr.shape, "max")
+    value = arr.astype(np.float64)
+    return np.where(vmax - value < value - vmin, vmax, vmin).astype(arr.dtype)
@@ -0,0 +1,407 @@
+"""Fourier-space filters executed tile by tile.
+
+Butterworth filters have effectively finite spatial support, so large images can be
+filtered by overlap-save: each tile is extended by a margin, filtered in Fourier space
+and only the valid center is written back. The peak memory is then proportional to the
+tile size instead of the image size.
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, reduce
+import itertools
+import math
+from typing import Any, NamedTuple, Sequence
+import warnings
+import numpy as np
+from numpy.typing import NDArray
+from scipy.fft import next_fast_len
+from himena_image._config import get_num_workers, get_image_config
+
+# default tile size for 2D and 3D filtering
+_TILE_SIZE = {2: 512, 3: 128}
+# margin is this factor divided by the lowest frequency of the filter
+_MARGIN_FACTOR = 3.0
+
+
+class FFTBackend:
+    """FFT functions of the given library with a fixed number of workers.
+
+    Supported libraries are "numpy", "scipy" (multi-threaded with `workers`) and
+    "pyfftw" (optional dependency).
+    """
+
+    def __init__(self, name: str = "scipy", workers: int = 1):
+        if name == "pyfftw":
+            try:
+                import pyfftw.interfaces.numpy_fft as mod
+                import pyfftw.interfaces.cache
+            except ImportError:
+                warnings.warn(
+                    "pyfftw is not installed. Use scipy as the FFT backend instead.",
+                    UserWarning,
+                    stacklevel=2,
+                )
+                name = "scipy"
+            else:
+                pyfftw.interfaces.cache.enable()
+                self._mod, self._kwargs = mod, {"threads": workers}
+        if name == "scipy":
+            import scipy.fft as mod
+
+            self._mod, self._kwargs = mod, {"workers": workers}
+        elif name == "numpy":
+            self._mod, self._kwargs = np.fft, {}
+        elif name != "pyfftw":
+            raise ValueError(f"Unknown FFT backend: {name!r}")
+        self.name = name
+        self.workers = workers
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.name!r}, workers={self.workers})"
+
+    def fftn(self, a, s=None, axes=None):
+        return self._mod.fftn(a, s=s, axes=axes, **self._kwargs)
+
+    def ifftn(self, a, s=None, axes=None):
+        return self._mod.ifftn(a, s=s, axes=axes, **self._kwargs)
+
+    def rfftn(self, a, s=None, axes=None):
+        return self._mod.rfftn(a, s=s, axes=axes, **self._kwargs)
+
+    def irfftn(self, a, s=None, axes=None):
+        return self._mod.irfftn(a, s=s, axes=axes, **self._kwargs)
+
+
+def get_fft_backend(name: str | None = None, workers: int = 1) -> FFTBackend:
+    """Get the FFT backend. If name is not given, the configured one is used."""
+    if name is None:
+        # resolved on every call, so that changes of the config take effect
+        name = get_image_config().fft_backend
+    return _get_fft_backend(name, workers)
+
+
+@lru_cache(maxsize=8)
+def _get_fft_backend(name: str, workers: int) -> FFTBackend:
+    return FFTBackend(name, workers)
+
+
+@lru_cache(maxsize=16)
+def filter_weight(
+    shape: tuple[int, ...],
+    cuton: float | None,
+    cutoff: float | None,
+    order: int,
+) -> NDArray[np.float32]:
+    """Cached (read-only) Butterworth band-pass weight for the half spectrum."""
+    weight = np.ones(shape[:-1] + (shape[-1] // 2 + 1,), dtype=np.float32)
+    if cutoff is not None:
+        weight *= butterworth_weight(shape, (cutoff,) * len(shape), order, False)
+    if cuton is not None:
+        weight *= butterworth_weight(shape, (cuton,) * len(shape), order, True)
+    weight.setflags(write=False)
+    return weight
+
+
+def butterworth_weight(
+    shape: Sequence[int],
+    cutoff: Sequence[float],
+    order: int,
+    high_pass: bool,
+) -> NDArray[np.float32]:
+    """Butterworth weight for the half (rfftn) spectrum of a real array."""
+    if all(c == 0 for c in cutoff):
+        fill = np.ones if high_pass else np.zeros
+        return fill(shape[:-1] + (shape[-1] // 2 + 1,), dtype=np.float32)
+    ranges = []
+    for d, fc in zip(shape, cutoff):
+        axis = np.arange(-(d - 1) // 2, (d - 1) // 2 + 1, dtype=np.float32) / (d * fc)
+        ranges.append(np.fft.ifftshift(axis**2))
+    ranges[-1] = ranges[-1][: shape[-1] // 2 + 1]
+    q2 = reduce(np.add, np.meshgrid(*ranges, indexing="ij", sparse=True))
+    weight = 1 / (1 + q2**order)
+    if high_pass:
+        weight = 1 - weight
+    return weight.astype(np.float32, copy=False)
+
+
+def butterworth_filter(
+    arr: Any,
+    axes: Sequence[int],
+    cuton: float | None = None,
+    cutoff: float | None = None,
+    order: int = 2,
+    tile_size: int | None = None,
+    num_workers: int | None = None,
+    backend: str | None = None,
+) -> Any:
+    """Apply a Butterworth low-, high- or band-pass filter along the spatial axes.
+
+    Parameters
+    ----------
+    arr : np.ndarray or dask array
+        Input array. If a dask array is given, the output is a lazy dask array that is
+        computed plane by plane.
+    axes : sequence of int
+        Spatial axes to filter.
+    cuton : float, optional
+        Frequencies below this value (in cycles/pixel) are suppressed.
+    cutoff : float, optional
+        Frequencies above this value (in cycles/pixel) are suppressed.
+    order : int, default 2
+        Steepness of the filter.
+    tile_size : int, optional
+        Size of each tile. Arrays not larger than this are filtered at once.
+    num_workers : int, optional
+        Number of threads used to process tiles in parallel. Use the configured value
+        by default. Ignored for dask arrays, whose blocks are already processed in
+        parallel by the dask scheduler.
+    backend : str, optional
+        FFT backend to use. Use the configured one by default.
+    """
+    import dask.array as da
+
+    axes = tuple(sorted(a % arr.ndim for a in axes))
+    ndim = len(axes)
+    if cutoff is not None and not 0 < cutoff < 0.5 * math.sqrt(ndim):
+        cutoff = None  # low-pass filter does nothing, same as impy
+    if cuton is not None and cuton <= 0:
+        cuton = None  # high-pass filter does nothing
+    dtype = arr.dtype if arr.dtype.kind == "f" else np.dtype(np.float32)
+    if cuton is None and cutoff is None:
+        return arr
+    freqs = [f for f in (cuton, cutoff) if f is not None]
+    # the margin never needs to exceed the image
+    margin = min(
+        math.ceil(_MARGIN_FACTOR / min(freqs)), max(arr.shape[a] for a in axes)
+    )
+    if tile_size is None:
+        tile_size = _TILE_SIZE.get(ndim, 128)
+    kwargs = dict(
+        axes=axes,
+        cuton=cuton,
+        cutoff=cutoff,
+        order=order,
+        tile_size=tile_size,
+        margin=margin,
+        num_workers=get_num_workers(num_workers),
+        backend=backend or get_image_config().fft_backend,
+    )
+    if isinstance(arr, da.Array):
+        # dask already runs the blocks in parallel, so each block uses one thread
+        kwargs["num_workers"] = 1
+        block = arr.rechunk({a: -1 for a in axes})
+        return block.map_blocks(_filter_numpy, dtype=dtype, **kwargs)
+    return _filter_numpy(np.asarray(arr), **kwargs)
+
+
+def _filter_numpy(
+    arr: NDArray[np.number],
+    axes: tuple[int, ...],
+    cuton: float | None,
+    cutoff: float | None,
+    order: int,
+    tile_size: int,
+    margin: int,
+    num_workers: int,
+    backend: str,
+) -> NDArray[np.floating]:
+    dtype = arr.dtype if arr.dtype.kind == "f" else np.dtype(np.float32)
+    out = np.empty(arr.shape, dtype=dtype)
+    # (N, ..., Y, X) where N, ... are the non-spatial axes
+    other_axes = [i for i in range(arr.ndim) if i not in axes]
+    arr_t = np.moveaxis(arr, other_axes + list(axes), range(arr.ndim))
+    out_t = np.moveaxis(out, other_axes + list(axes), range(arr.ndim))
+    layout = _TileLayout.from_shape(arr_t.shape[len(other_axes) :], tile_size, margin)
+
+    weight = filter_weight(layout.blocks, cuton, cutoff, order)
+    jobs = list(
+        itertools.product(
+            np.ndindex(arr_t.shape[: len(other_axes)]), layout.iter_tiles()
+        )
+    )
+    # if there are fewer jobs than workers, parallelize each FFT instead
+    fft = get_fft_backend(backend, max(num_workers // len(jobs), 1))
+
+    def _run(sl, tile):
+        _filter_tile(arr_t[sl], out_t[sl], tile, layout, weight, fft)
+
+    if num_workers <= 1:
+        for sl, tile in jobs:
+            _run(sl, tile)
+        return out
+    with ThreadPoolExecutor(max_workers=min(num_workers, len(jobs))) as executor:
+        for future in [executor.submit(_run, sl, tile) for sl, tile in jobs]:
+            future.result()
+    return out
+
+
+class _TileLayout(NamedTuple):
+    """Tiling of a spatial shape for overlap-save filtering."""
+
+    shape: tuple[int, ...]  # spatial shape of the input
+    inner: tuple[int, ...]  # size of the valid region of each tile
+    margins: tuple[int, ...]  # margin before each tile
+    blocks: tuple[int, ...]  # size of the padded block, always a fast FFT size
+
+    @classmethod
+    def from_shape(cls, shape: Sequence[int], tile_size: int, margin: int):
+        inner, margins, blocks = [], [], []
+        for size in shape:
+            block = max(tile_size, 4 * margin)
+            if size <= block:
+                # filter the whole axis at once without padding, which is the same
+                # as the periodic FFT filter of impy
+                inner.append(size)
+                margins.append(0)
+                blocks.append(size)
+            else:
+                block = next_fast_len(block, real=True)
+                inner.append(block - 2 * margin)
+                margins.append(margin)
+                blocks.append(block)
+        return cls(tuple(shape), tuple(inner), tuple(margins), tuple(blocks))
+
+    def iter_tiles(self):
+        ranges = [range(0, s, i) for s, i in zip(self.shape, self.inner)]
+        for starts in itertools.product(*ranges):
+            yield tuple(
+                slice(st, min(st + i, s))
+                for st, i, s in zip(starts, self.inner, self.shape)
+            )
+
+
+def _filter_tile(
+    plane: NDArray[np.number],
+    out: NDArray[np.floating],
+    tile: tuple[slice, ...],
+    layout: _TileLayout,
+    weight: NDArray[np.float32],
+    fft: FFTBackend,
+):
+    """Filter one tile of a plane by overlap-save and write it to `out`."""
+    ext = []
+    pads = []
+    for sl, size, margin, block_size in zip(
+        tile, plane.shape, layout.margins, layout.blocks
+    ):
+        start, stop = max(sl.start - margin, 0), min(sl.stop + margin, size)
+        ext.append(slice(start, stop))
+        pad_before = margin - (sl.start - start)
+        # pad the last tile to the same block size
+        pads.append((pad_before, block_size - pad_before - (stop - start)))
+    block = plane[tuple(ext)].astype(out.dtype, copy=False)
+    if any(p != (0, 0) for p in pads):
+        block = np.pad(block, pads, mode="reflect")
+    filtered = fft.irfftn(weight * fft.rfftn(block), s=block.shape)
+    center = tuple(
+        slice(m, m + sl.stop - sl.start) for sl, m in zip(tile, layout.margins)
+    )
+    out[tile] = filtered[center]
+
+
+def power_spectrum(
+    arr: Any,
+    axes: Sequence[int],
+    shift: bool = True,
+    norm: bool = False,
+    zero_norm: bool = False,
+    double_precision: bool = False,
+    half: bool = False,
+    backend: str | None = None,
+) -> Any:
+    """Power spectrum of a real array calculated from the half (rfftn) spectrum.
+
+    Parameters
+    ----------
+    arr : np.ndarray or dask array
+        Input real array. If a dask array is given, the output is a lazy dask array
+        that is computed plane by plane. `norm` is applied to each plane in this case.
+    axes : sequence of int
+        Spatial axes to transform.
+    shift : bool, default True
+        If True, the zero frequency is moved to the center.
+    norm : bool, default False
+        If True, the maximum value is normalized to 1.
+    zero_norm : bool, default False
+        If True, the center of the spectrum (the zero frequency if `shift` is True)
+        is set to 0 after `norm` is applied, same as impy.
+    double_precision : bool, default False
+        If True, the FFT is calculated in float64.
+    half : bool, default False
+        If True, the half spectrum (the last spatial axis has size N // 2 + 1) is
+        returned without being expanded to the full spectrum. The last spatial axis is
+        never shifted in this case.
+    """
+    import dask.array as da
+
+    axes = tuple(sorted(a % arr.ndim for a in axes))
+    kwargs = dict(
+        axes=axes,
+        shift=shift,
+        norm=norm,
+        zero_norm=zero_norm,
+        double_precision=double_precision,
+        half=half,
+        backend=backend or get_image_config().fft_backend,
+    )
+    if isinstance(arr, da.Array):
+        block = arr.rechunk({a: -1 for a in axes})
+        chunks = list(block.chunks)
+        if half:
+            chunks[axes[-1]] = (arr.shape[axes[-1]] // 2 + 1,)
+        return block.map_blocks(
+            _power_spectrum_numpy, chunks=tuple(chunks), dtype=np.float32, **kwargs
+        )
+    return _power_spectrum_numpy(np.asarray(arr), **kwargs)
+
+
+def _power_spectrum_numpy(
+    arr: NDArray[np.number],
+    axes: tuple[int, ...],
+    shift: bool,
+    norm: bool,
+    zero_norm: bool,
+    double_precision: bool,
+    half: bool,
+    backend: str,
+) -> NDArray[np.float32]:
+    fft = get_fft_backend(backend, get_num_workers())
+    dtype = np.float64 if double_precision else np.float32
+    freq = fft.rfftn(arr.astype(dtype, copy=False), axes=axes)
+    pw = freq.real**2 + freq.imag**2
+    del freq
+    if not half:
+        pw = _expand_half_spectrum(pw, axes, arr.shape[axes[-1]])
+    shift_axes = axes if not half else axes[:-1]
+    # same order as `impy.ImgArray.power_spectra`
+    if shift and shift_axes:
+        pw = np.fft.fftshift(pw, axes=shift_axes)
+    if norm:
+        pw /= pw.max()
+    if zero_norm:
+        center: list[int | slice] = [slice(None)] * pw.ndim
+        for a in axes:
+            center[a] = arr.shape[a] // 2
+        if half and shift:
+            # the element of the full spectrum is at the zero of the unshifted axis
+            center[axes[-1]] = 0
+        pw[tuple(center)] = 0
+    return pw.astype(np.float32, copy=False)
+
+
+def _expand_half_spectrum(
+    half: NDArray[np.floating],
+    axes: tuple[int, ...],
+    size: int,
+) -> NDArray[np.floating]:
+    """Expand the half spectrum of a real array using the Hermitian symmetry."""
+    last = axes[-1]
+    nhalf = half.shape[last]
+    # P[k] = P[-k], so the missing part is the reversed half with all the other
+    # spatial axes also inverted (index i -> -i mod N).
+    mirror = np.take(half, size - np.arange(nhalf, size), axis=last)
+    for a in axes[:-1]:
+        mirror = np.roll(np.flip(mirror, axis=a), 1, axis=a)
+    return np.concatenate([half, mirror], axis=last)
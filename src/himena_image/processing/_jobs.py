@@ -0,0 +1,142 @@
+"""Progress reporting and cooperative cancellation of long-running commands.
+
+A command creates a `Job` and passes it to the engine that processes the image plane
+by plane (or chunk by chunk). The engine calls `Job.advance` after each unit of work,
+which updates the status bar and raises `JobCancelled` if the user requested to
+cancel the job. Engines that run in worker threads call `Job.check` between units.
+
+>>> with Job("Rolling ball") as job:
+...     out = map_planes(func, img, "yx", job=job)
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+
+from himena.plugins import register_function
+
+# minimum interval (sec) between two status bar updates
+_REPORT_INTERVAL = 0.2
+
+_ACTIVE_JOBS: list[Job] = []
+_ACTIVE_JOBS_LOCK = threading.Lock()
+
+
+class JobCancelled(Exception):
+    """Raised in a running job when it is cancelled."""
+
+
+class Job:
+    """Progress and cancellation state of a running command.
+
+    Parameters
+    ----------
+    desc : str
+        Description of the job shown in the status bar.
+    total : int, default 0
+        Total number of the units of work. Engines can add more with `add_total`.
+    """
+
+    def __init__(self, desc: str, total: int = 0):
+        self._desc = desc
+        self._total = total
+        self._n_done = 0
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+        self._last_report = 0.0
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self._desc!r}, {self._n_done}/{self._total})"
+
+    def __enter__(self) -> Job:
+        with _ACTIVE_JOBS_LOCK:
+            _ACTIVE_JOBS.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        with _ACTIVE_JOBS_LOCK:
+            if self in _ACTIVE_JOBS:
+                _ACTIVE_JOBS.remove(self)
+        if exc_type is JobCancelled:
+            _set_status_tip(f"{self._desc} cancelled.")
+
+    @property
+    def desc(self) -> str:
+        """Description of the job."""
+        return self._desc
+
+    @property
+    def total(self) -> int:
+        """Total number of the units of work."""
+        return self._total
+
+    @property
+    def n_done(self) -> int:
+        """Number of the finished units of work."""
+        return self._n_done
+
+    @property
+    def cancelled(self) -> bool:
+        """True if the job is requested to be cancelled."""
+        return self._cancel_event.is_set()
+
+    def add_total(self, n: int) -> None:
+        """Add `n` units of work to the job."""
+        with self._lock:
+            self._total += n
+
+    def cancel(self) -> None:
+        """Request the job to be cancelled."""
+        self._cancel_event.set()
+
+    def check(self) -> None:
+        """Raise `JobCancelled` if the job is requested to be cancelled."""
+        if self._cancel_event.is_set():
+            raise JobCancelled(f"{self._desc} was cancelled.")
+
+    def advance(self, n: int = 1, info: str | None = None) -> None:
+        """Mark `n` units of work as done and check the cancellation.
+
+        `info` is an additional text shown in the status bar, such as the value of
+        a convergence metric.
+        """
+        with self._lock:
+            self._n_done += n
+            now = time.perf_counter()
+            report = (
+                now - self._last_report > _REPORT_INTERVAL
+                or self._n_done >= self._total
+            )
+            if report:
+                self._last_report = now
+        if report:
+            text = f"{self._desc} ({self._n_done}/{self._total})"
+            _set_status_tip(text if info is None else f"{text} {info}")
+        self.check()
+
+
+def active_jobs() -> list[Job]:
+    """List of the running jobs."""
+    with _ACTIVE_JOBS_LOCK:
+        return list(_ACTIVE_JOBS)
+
+
+def _set_status_tip(text: str) -> None:
+    from himena.widgets import set_status_tip
+
+    set_status_tip(text, duration=2.0)
+
+
+@register_function(
+    title="Cancel Running Jobs",
+    menus=["tools/image"],
+    command_id="himena-image:cancel-jobs",
+)
+def cancel_jobs() -> None:
+    """Cancel all the running image processing jobs."""
+    jobs = active_jobs()
+    for job in jobs:
+        job.cancel()
+    if jobs:
+        _set_status_tip(f"Cancelling {len(jobs)} job(s) ...")
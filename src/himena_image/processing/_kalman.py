@@ -0,0 +1,150 @@
+"""Streaming Kalman filter along the time axis.
+
+The filter is the same as `impy.ImgArray.kalman_filter` (the "Kalman Stack Filter" of
+ImageJ). It is a causal, pixel-wise recursion, and the predicted variance does not
+depend on the image at all, so the Kalman gain of each frame is known in advance.
+The only state carried from frame to frame is the current estimate. Hence
+
+- `kalman_filter_stream` filters the frames one by one as they come from any
+  iterable (such as a reader of a long acquisition), holding a single frame of
+  state, and
+- `kalman_filter_lazy` builds a dask array whose frames are computed from the filter
+  state of the previous frames. The states are kept between computations, at the
+  last computed frame and at checkpoints every ~sqrt(T) frames, so browsing through
+  the frames one by one does not filter the series from the start every time, and
+  the output can be stored frame by frame (e.g. by `da.store`) without holding the
+  whole series in memory.
+"""
+
+from __future__ import annotations
+
+from itertools import islice
+import math
+import threading
+from typing import Iterable, Iterator
+import numpy as np
+from numpy.typing import NDArray
+
+
+def iter_kalman_gains(noise_var: float) -> Iterator[float]:
+    """Iterate over the Kalman gain of each frame. The first frame is used as is."""
+    yield 0.0
+    var = noise_var
+    while True:
+        total = var + noise_var
+        k = var / total if total > 0 else 0.0
+        var *= 1 - k
+        yield k
+
+
+def kalman_update(
+    estimate: NDArray[np.float32] | None,
+    frame: NDArray[np.number],
+    gain: float,
+    kalman_gain: float,
+) -> NDArray[np.float32]:
+    """Update the estimate with a new frame."""
+    frame = np.asarray(frame, dtype=np.float32)
+    if estimate is None:
+        return frame.copy()
+    return gain * estimate + (1.0 - gain) * frame + kalman_gain * (frame - estimate)
+
+
+def kalman_filter_stream(
+    frames: Iterable[NDArray[np.number]],
+    gain: float = 0.8,
+    noise_var: float = 0.05,
+) -> Iterator[NDArray[np.float32]]:
+    """Filter frames one by one, yielding each filtered frame.
+
+    Only the current estimate is kept in memory, so `frames` can be arbitrarily long.
+    """
+    estimate = None
+    for frame, k in zip(frames, iter_kalman_gains(noise_var)):
+        estimate = kalman_update(estimate, frame, gain, k)
+        yield estimate
+
+
+def kalman_filter_lazy(
+    arr,
+    along: int = 0,
+    gain: float = 0.8,
+    noise_var: float = 0.05,
+):
+    """Lazily filter a dask array along an axis.
+
+    Parameters
+    ----------
+    arr : dask array
+        Input array.
+    along : int, default 0
+        Time axis.
+    gain : float, default 0.8
+        Filter gain.
+    noise_var : float, default 0.05
+        Initial estimate of the noise variance.
+
+    Returns
+    -------
+    dask array
+        Filtered float32 array, chunked frame by frame along `along`. The other axes
+        keep the chunks of `arr`.
+    """
+    import dask.array as da
+    from dask.base import tokenize
+    from dask.highlevelgraph import HighLevelGraph
+
+    along = along % arr.ndim
+    arr = da.moveaxis(arr, along, 0).rechunk({0: 1})
+    name = f"kalman-filter-{tokenize(arr, gain, noise_var)}"
+    states = _KalmanStates(arr, gain, noise_var)
+    dsk = {}
+    for index in np.ndindex(arr.numblocks):
+        dsk[(name, *index)] = (states.compute, index[0], index[1:])
+    # input blocks are read by `states` itself, so the graph has no dependencies
+    graph = HighLevelGraph.from_collections(name, dsk, dependencies=[])
+    out = da.Array(graph, name, chunks=arr.chunks, dtype=np.float32)
+    return da.moveaxis(out, 0, along)
+
+
+class _KalmanStates:
+    """Filter states of each spatial block of a (T, ...) dask array.
+
+    For each block, the state of the last computed frame and those of every
+    `interval`-th frame are kept, so that a frame is computed from the nearest
+    preceding state instead of from the first frame.
+    """
+
+    def __init__(self, arr, gain: float, noise_var: float):
+        self._arr = arr
+        self._gain = gain
+        self._kalman_gains = list(islice(iter_kalman_gains(noise_var), arr.shape[0]))
+        self._interval = max(math.isqrt(arr.shape[0]), 1)
+        self._checkpoints: dict[tuple[int, ...], dict[int, NDArray[np.float32]]] = {}
+        self._latest: dict[tuple[int, ...], tuple[int, NDArray[np.float32]]] = {}
+        self._locks: dict[tuple[int, ...], threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def _lock(self, rest: tuple[int, ...]) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(rest, threading.Lock())
+
+    def compute(self, t: int, rest: tuple[int, ...]) -> NDArray[np.float32]:
+        """Compute the filtered block of frame `t`."""
+        with self._lock(rest):
+            checkpoints = self._checkpoints.setdefault(rest, {})
+            start, estimate = -1, None
+            for i, state in [*checkpoints.items(), self._latest.get(rest, (-1, None))]:
+                if start < i <= t:
+                    start, estimate = i, state
+            for i in range(start + 1, t + 1):
+                # the input is read one block at a time, the outer scheduler already
+                # processes the blocks in parallel
+                frame = self._arr.blocks[(i, *rest)].compute(scheduler="sync")
+                estimate = kalman_update(
+                    estimate, frame, self._gain, self._kalman_gains[i]
+                )
+                if i % self._interval == 0:
+                    checkpoints[i] = estimate
+            self._latest[rest] = (t, estimate)
+        return estimate
@@ -0,0 +1,180 @@
+"""Parallel execution of per-plane operations on multi-dimensional images.
+
+Many methods of impy, such as `rolling_ball` or `skeletonize`, loop over the planes
+of an nD image in a single thread. `map_planes` splits the axes that are not
+processed (such as `t`, `z` and `c` for 2D operations) into batches of planes and
+runs them on a thread pool. The results are written into a preallocated output
+array as soon as each batch finishes.
+
+The progress is reported to a `Job`, which also stops the remaining planes when the
+job is cancelled.
+
+`map_planes_lazy` is the lazy counterpart for `LazyImgArray`, such as the images
+used for preview. Each plane is only processed when it is computed.
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import math
+from typing import Any, Callable, Sequence
+import impy as ip
+import numpy as np
+from numpy.typing import NDArray
+
+from himena_image._config import get_num_workers
+from himena_image.processing._jobs import Job
+
+# number of batches per worker, to balance the load between the workers
+_BATCHES_PER_WORKER = 4
+
+
+def map_planes(
+    func: Callable[[ip.ImgArray], Any],
+    img: ip.ImgArray,
+    dims: str | Sequence[str],
+    *,
+    num_workers: int | None = None,
+    job: Job | None = None,
+    with_index: bool = False,
+) -> ip.ImgArray:
+    """Apply `func` to each plane of `img` in parallel.
+
+    Parameters
+    ----------
+    func : callable
+        Function that takes an image with axes `dims` and returns an array of the
+        same shape. It is called from the worker threads. If `with_index` is True,
+        it is called as `func(plane, index)` where `index` is a dict of the axis
+        names and the indices of the plane.
+    img : ImgArray or LazyImgArray
+        Input image. If lazy, each plane is computed in the worker thread.
+    dims : str or sequence of str
+        Axes of each plane, such as "yx". All the other axes are iterated over.
+    num_workers : int, optional
+        Number of threads. Use the config value by default.
+    job : Job, optional
+        Job to report the progress to. If the job is cancelled, the remaining planes
+        are not processed and `JobCancelled` is raised.
+    with_index : bool, default False
+        If True, pass the indices of the plane to `func`.
+
+    Returns
+    -------
+    ImgArray
+        Output image with the same axes as `img`.
+    """
+    dims = [str(a) for a in dims]
+    axes = [str(a) for a in img.axes]
+    loop_axes = [i for i, a in enumerate(axes) if a not in dims]
+    loop_shape = tuple(img.shape[i] for i in loop_axes)
+    planes = list(np.ndindex(loop_shape))
+    n_total = len(planes)
+    batch_size = _batch_size(n_total, get_num_workers(num_workers))
+    batches = [planes[i : i + batch_size] for i in range(0, n_total, batch_size)]
+
+    def _slicer(index: tuple[int, ...]) -> tuple[int | slice, ...]:
+        sl: list[int | slice] = [slice(None)] * img.ndim
+        for i, idx in zip(loop_axes, index):
+            sl[i] = idx
+        return tuple(sl)
+
+    def _get_plane(index: tuple[int, ...]) -> ip.ImgArray:
+        plane = img[_slicer(index)]
+        if isinstance(plane, ip.LazyImgArray):
+            plane = plane.compute()
+        return plane
+
+    loop_names = [axes[i] for i in loop_axes]
+
+    def _run_one(index: tuple[int, ...]):
+        if job is not None:
+            job.check()
+        if with_index:
+            return func(_get_plane(index), dict(zip(loop_names, index)))
+        return func(_get_plane(index))
+
+    def _run_batch(batch: list[tuple[int, ...]]):
+        return [np.asarray(_run_one(index)) for index in batch]
+
+    if job is not None:
+        job.add_total(n_total)
+    out: NDArray[Any] | None = None
+    with ThreadPoolExecutor(max(min(get_num_workers(num_workers), n_total), 1)) as ex:
+        futures = {ex.submit(_run_batch, batch): batch for batch in batches}
+        try:
+            for future in as_completed(futures):
+                for index, result in zip(futures[future], future.result()):
+                    out = _write_plane(out, _slicer(index), result, img.shape)
+                if job is not None:
+                    job.advance(len(futures[future]))
+        except BaseException:
+            ex.shutdown(cancel_futures=True)
+            raise
+    if out is None:
+        raise ValueError(f"Image of shape {img.shape} has no plane to process.")
+    return ip.asarray(out, like=img)
+
+
+def map_planes_lazy(
+    func: Callable[[ip.ImgArray], Any],
+    img: ip.LazyImgArray,
+    dims: str | Sequence[str],
+    dtype: Any,
+) -> ip.LazyImgArray:
+    """Lazily apply `func` to each plane of `img`.
+
+    Parameters
+    ----------
+    func : callable
+        Function that takes an image with axes `dims` and returns an array of the
+        same shape.
+    img : LazyImgArray
+        Input image.
+    dims : str or sequence of str
+        Axes of each plane, such as "yx". All the other axes are iterated over.
+    dtype : dtype
+        Data type of the output.
+
+    Returns
+    -------
+    LazyImgArray
+        Output image chunked plane by plane.
+    """
+    dims = [str(a) for a in dims]
+    axes = [str(a) for a in img.axes]
+    plane_axes = [i for i, a in enumerate(axes) if a in dims]
+    arr = img.value.rechunk({i: -1 if i in plane_axes else 1 for i in range(img.ndim)})
+    squeeze = tuple(slice(None) if i in plane_axes else 0 for i in range(img.ndim))
+    plane_names = [axes[i] for i in plane_axes]
+
+    def _run(block: NDArray[Any]) -> NDArray[Any]:
+        plane = ip.asarray(block[squeeze], axes=plane_names)
+        return np.asarray(func(plane), dtype=dtype).reshape(block.shape)
+
+    out = arr.map_blocks(_run, dtype=dtype)
+    return ip.lazy.asarray(out, like=img, chunks=out.chunksize)
+
+
+def _batch_size(n_planes: int, num_workers: int) -> int:
+    return max(math.ceil(n_planes / (num_workers * _BATCHES_PER_WORKER)), 1)
+
+
+def _write_plane(
+    out: NDArray[Any] | None,
+    sl: tuple[int | slice, ...],
+    result: NDArray[Any],
+    shape: tuple[int, ...],
+) -> NDArray[Any]:
+    if out is None:
+        out = np.empty(shape, dtype=result.dtype)
+    elif not np.can_cast(result.dtype, out.dtype, "safe"):
+        out = out.astype(np.result_type(out.dtype, result.dtype))
+    target = out[sl]
+    if target.shape != result.shape:
+        raise ValueError(
+            f"Function returned an array of shape {result.shape} for a plane of "
+            f"shape {target.shape}."
+        )
+    out[sl] = result
+    return out
@@ -0,0 +1,395 @@
+"""Streaming projection of (possibly lazy) arrays.
+
+The projection is calculated by iterating over slabs of the first projected axis, so
+that only a few frames need to be in memory at the same time.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Literal, Sequence
+import numpy as np
+from numpy.typing import NDArray
+
+ProjectionMethod = Literal["mean", "median", "max", "min", "sum", "std"]
+
+# maximum number of bytes to be read at once
+_MAX_SLAB_NBYTES = 256 * 1024**2
+# number of bins and refinement passes used for the histogram-based median
+_MEDIAN_NBINS = 32
+_MEDIAN_NPASSES = 2
+
+
+def project_chunked(
+    arr: Any,
+    axis: Sequence[int],
+    method: ProjectionMethod = "mean",
+    frame_range: tuple[int, int] | None = None,
+    max_slab_nbytes: int = _MAX_SLAB_NBYTES,
+) -> NDArray[np.number]:
+    """Project an array along the given axes by reducing it slab by slab.
+
+    Parameters
+    ----------
+    arr : array-like
+        Array to project. Any array that supports numpy-style slicing (numpy, dask,
+        zarr etc.) is allowed. Only the sliced slabs are converted to numpy arrays.
+    axis : sequence of int
+        Axes to project along. The array is streamed along the first axis.
+    method : str, default "mean"
+        Projection method.
+    frame_range : (int, int), optional
+        Range of frames along the streamed axis to be projected. Only allowed when
+        exactly one axis is projected.
+    max_slab_nbytes : int, optional
+        Maximum number of bytes to be read at once.
+
+    Returns
+    -------
+    array
+        Projected array. The output of "mean", "median" and "std" is float32
+        regardless of the input dtype, "max" and "min" keep the input dtype and "sum"
+        follows `np.sum`.
+    """
+    axis = sorted(a % arr.ndim for a in axis)
+    if len(axis) == 0:
+        raise ValueError("No axis to project along.")
+    stream_axis = axis[0]
+    size = arr.shape[stream_axis]
+    if frame_range is None:
+        start, stop = 0, size
+    elif len(axis) > 1:
+        raise ValueError("Frame range can only be given for single-axis projection.")
+    else:
+        start, stop = frame_range
+        start, stop = max(start, 0), min(stop, size)
+    if start >= stop:
+        raise ValueError(f"Empty frame range: {(start, stop)!r}")
+    step = _slab_size(arr, stream_axis, max_slab_nbytes)
+    if method == "median":
+        if stop - start <= step:  # all the frames fit in one slab
+            slab = _get_slab(arr, stream_axis, start, stop)
+            return np.median(slab, axis=tuple(axis)).astype(np.float32)
+        return _median_by_histogram(arr, axis, start, stop, step)
+    if method not in _ACCUMULATORS:
+        raise ValueError(f"Unsupported projection method: {method!r}")
+    acc = _ACCUMULATORS[method](tuple(axis))
+    for slab in _iter_slabs(arr, stream_axis, start, stop, step):
+        acc.update(slab)
+    return acc.result()
+
+
+def _slab_size(arr: Any, axis: int, max_nbytes: int) -> int:
+    """Number of frames along `axis` to be read at once."""
+    frame_nbytes = arr.dtype.itemsize * np.prod(arr.shape) // max(arr.shape[axis], 1)
+    step = max(int(max_nbytes // max(frame_nbytes, 1)), 1)
+    if chunks := getattr(arr, "chunksize", None):  # dask array
+        # align slabs to the chunk boundaries
+        step = max(step // chunks[axis], 1) * chunks[axis]
+    return step
+
+
+def _get_slab(arr: Any, axis: int, start: int, stop: int) -> NDArray[np.number]:
+    sl = [slice(None)] * arr.ndim
+    sl[axis] = slice(start, stop)
+    return np.asarray(arr[tuple(sl)])
+
+
+def _iter_slabs(arr: Any, axis: int, start: int, stop: int, step: int):
+    for i0 in range(start, stop, step):
+        yield _get_slab(arr, axis, i0, min(i0 + step, stop))
+
+
+class _Accumulator:
+    def __init__(self, axis: tuple[int, ...]):
+        self._axis = axis
+        self._value = None
+
+    def update(self, slab: NDArray[np.number]) -> None:
+        raise NotImplementedError
+
+    def result(self) -> NDArray[np.number]:
+        return self._value
+
+
+class _MaxAccumulator(_Accumulator):
+    def update(self, slab):
+        value = np.max(slab, axis=self._axis)
+        if self._value is None:
+            self._value = value
+        else:
+            np.maximum(self._value, value, out=self._value)
+
+
+class _MinAccumulator(_Accumulator):
+    def update(self, slab):
+        value = np.min(slab, axis=self._axis)
+        if self._value is None:
+            self._value = value
+        else:
+            np.minimum(self._value, value, out=self._value)
+
+
+class _SumAccumulator(_Accumulator):
+    def update(self, slab):
+        value = np.sum(slab, axis=self._axis)
+        if self._value is None:
+            self._value = value
+        else:
+            self._value += value
+
+
+class _MeanAccumulator(_Accumulator):
+    def __init__(self, axis):
+        super().__init__(axis)
+        self._count = 0
+
+    def update(self, slab):
+        value = np.sum(slab, axis=self._axis, dtype=np.float64)
+        self._count += slab.size // value.size
+        if self._value is None:
+            self._value = value
+        else:
+            self._value += value
+
+    def result(self):
+        return (self._value / self._count).astype(np.float32)
+
+
+class _StdAccumulator(_Accumulator):
+    """Standard deviation using the parallel version of Welford's algorithm."""
+
+    def __init__(self, axis):
+        super().__init__(axis)
+        self._count = 0
+        self._mean = None
+        self._m2 = None
+
+    def update(self, slab):
+        slab_mean = np.mean(slab, axis=self._axis, dtype=np.float64)
+        n_b = slab.size // slab_mean.size
+        slab_m2 = np.var(slab, axis=self._axis, dtype=np.float64) * n_b
+        if self._mean is None:
+            self._mean, self._m2, self._count = slab_mean, slab_m2, n_b
+            return
+        n_a = self._count
+        n = n_a + n_b
+        delta = slab_mean - self._mean
+        self._mean += delta * (n_b / n)
+        self._m2 += slab_m2 + delta**2 * (n_a * n_b / n)
+        self._count = n
+
+    def result(self):
+        return np.sqrt(self._m2 / self._count).astype(np.float32)
+
+
+_ACCUMULATORS: dict[str, type[_Accumulator]] = {
+    "max": _MaxAccumulator,
+    "min": _MinAccumulator,
+    "sum": _SumAccumulator,
+    "mean": _MeanAccumulator,
+    "std": _StdAccumulator,
+}
+
+
+def _median_by_histogram(
+    arr: Any,
+    axis: list[int],
+    start: int,
+    stop: int,
+    step: int,
+    nbins: int = _MEDIAN_NBINS,
+    npasses: int = _MEDIAN_NPASSES,
+) -> NDArray[np.float32]:
+    """Median by iteratively refining per-pixel histograms.
+
+    The value range of each pixel is split into `nbins` bins and the bin containing
+    the (lower) middle value is searched. Each pass splits the selected bin into
+    `nbins` bins again, so only one histogram of `nbins` counts per pixel is kept. A
+    final pass records the minimum and maximum of the values in the selected bin and,
+    if the number of values is even, the smallest value above the bin, which is the
+    upper middle value unless it is in the same bin. The result is exact if the values
+    in the final bin are all equal, which is always the case for integer images whose
+    range is below `nbins ** npasses`. Otherwise, the error is below
+    `(max - min) / nbins ** npasses`.
+    """
+    axis_tuple = tuple(axis)
+    lo_acc, hi_acc = _MinAccumulator(axis_tuple), _MaxAccumulator(axis_tuple)
+    for slab in _iter_slabs(arr, axis[0], start, stop, step):
+        lo_acc.update(slab)
+        hi_acc.update(slab)
+    out_shape = lo_acc.result().shape
+    lo = lo_acc.result().astype(np.float64).ravel()
+    span = hi_acc.result().astype(np.float64).ravel() - lo
+    safe_span = np.where(span > 0, span, 1.0)
+    npix = lo.size
+    n_total = (stop - start) * int(np.prod([arr.shape[a] for a in axis[1:]]))
+    rank = (n_total - 1) // 2
+    # index of the selected bin at the current level, and the number of values in it
+    # or in the bins below it
+    selected = np.zeros(npix, dtype=np.int64)
+    n_upto = np.zeros(npix, dtype=np.int64)
+    # move the projected axes to the front and flatten the others
+    dest = list(range(len(axis)))
+
+    def _pixel_slabs():
+        for slab in _iter_slabs(arr, axis[0], start, stop, step):
+            yield np.moveaxis(slab, axis, dest).reshape(-1, npix)
+
+    def _bin_index(slab: NDArray[np.number], scale: int) -> NDArray[np.int64]:
+        # bins are defined in the normalized coordinate of the first pass, so that
+        # the bins of successive passes are consistent; the maximum belongs to the
+        # last bin
+        pos = np.floor((slab - lo) / safe_span * scale)
+        return np.minimum(pos, scale - 1).astype(np.int64)
+
+    for i_pass in range(npasses):
+        scale = nbins ** (i_pass + 1)
+        counts = np.zeros((npix, nbins), dtype=np.int32)
+        n_below = np.zeros(npix, dtype=np.int64)
+        for slab in _pixel_slabs():
+            prefix, ibin = np.divmod(_bin_index(slab, scale), nbins)
+            n_below += np.count_nonzero(prefix < selected, axis=0)
+            _count_bins(counts, prefix == selected, ibin)
+        np.cumsum(counts, axis=1, out=counts)
+        found = np.argmax(counts > (rank - n_below)[:, np.newaxis], axis=1)
+        n_upto = (
+            n_below + np.take_along_axis(counts, found[:, np.newaxis], axis=1)[:, 0]
+        )
+        selected = selected * nbins + found
+        del counts
+
+    low = np.full(npix, np.inf)
+    high = np.full(npix, -np.inf)
+    above = np.full(npix, np.inf)
+    even = n_total % 2 == 0
+    for slab in _pixel_slabs():
+        pos = _bin_index(slab, scale)
+        in_bin = pos == selected
+        np.minimum(low, np.where(in_bin, slab, np.inf).min(axis=0), out=low)
+        np.maximum(high, np.where(in_bin, slab, -np.inf).max(axis=0), out=high)
+        if even:
+            over = np.where(pos > selected, slab, np.inf).min(axis=0)
+            np.minimum(above, over, out=above)
+    center = lo + (selected + 0.5) / scale * span
+    median = np.clip(center, low, high)
+    if even:
+        # the upper middle value is the smallest value above the bin, unless the bin
+        # also contains it
+        median = (median + np.where(rank + 1 < n_upto, median, above)) / 2
+    return median.reshape(out_shape).astype(np.float32)
+
+
+def _count_bins(
+    counts: NDArray[np.int32],
+    matched: NDArray[np.bool_],
+    ibin: NDArray[np.int64],
+    max_size: int = 2**22,
+) -> None:
+    """Add the numbers of the matched values in each bin to the (npix, nbins) counts.
+
+    Pixels are processed in blocks so that the temporary array of `np.bincount` has at
+    most `max_size` elements.
+    """
+    npix, nbins = counts.shape
+    block = max(max_size // nbins, 1)
+    for p0 in range(0, npix, block):
+        p1 = min(p0 + block, npix)
+        offsets = np.arange(p1 - p0) * nbins
+        flat = (offsets + ibin[:, p0:p1])[matched[:, p0:p1]]
+        hist = np.bincount(flat, minlength=(p1 - p0) * nbins)
+        counts[p0:p1] += hist.reshape(p1 - p0, nbins).astype(np.int32, copy=False)
+
+
+RunningProjectionMethod = Literal["mean", "max", "min", "sum"]
+
+
+def running_projection(
+    arr: Any,
+    axis: int,
+    window: int,
+    method: RunningProjectionMethod = "mean",
+) -> Any:
+    """Project an array over a sliding window along an axis.
+
+    The output has `arr.shape[axis] - window + 1` frames along `axis`. Each update costs
+    O(1) regardless of the window size; cumulative sums are used for "mean" and "sum",
+    and the van Herk/Gil-Werman algorithm is used for "max" and "min".
+
+    If `arr` is a dask array, the output is also a lazy dask array, where each output
+    chunk only reads the input frames it needs.
+    """
+    import dask.array as da
+
+    axis = axis % arr.ndim
+    size = arr.shape[axis]
+    if not 1 <= window <= size:
+        raise ValueError(f"Window size must be in [1, {size}], got {window}.")
+    if method not in _RUNNING_FUNCS:
+        raise ValueError(f"Unsupported projection method: {method!r}")
+    if not isinstance(arr, da.Array):
+        return _running_projection_numpy(np.asarray(arr), axis, window, method)
+
+    n_out = size - window + 1
+    step = arr.chunksize[axis]
+    dtype = arr.dtype if method in ("max", "min") else np.dtype(np.float32)
+    blocks = []
+    for o0 in range(0, n_out, step):
+        o1 = min(o0 + step, n_out)
+        sl = [slice(None)] * arr.ndim
+        sl[axis] = slice(o0, o1 + window - 1)
+        block = arr[tuple(sl)].rechunk({axis: -1})
+        chunks = list(block.chunks)
+        chunks[axis] = (o1 - o0,)
+        blocks.append(
+            block.map_blocks(
+                _running_projection_numpy,
+                axis=axis,
+                window=window,
+                method=method,
+                chunks=tuple(chunks),
+                dtype=dtype,
+            )
+        )
+    return da.concatenate(blocks, axis=axis)
+
+
+def _running_projection_numpy(
+    arr: NDArray[np.number],
+    axis: int,
+    window: int,
+    method: RunningProjectionMethod,
+) -> NDArray[np.number]:
+    arr = np.moveaxis(arr, axis, 0)
+    out = _RUNNING_FUNCS[method](arr, window)
+    return np.moveaxis(out, 0, axis)
+
+
+def _running_sum(arr: NDArray[np.number], window: int) -> NDArray[np.float64]:
+    cumsum = np.zeros((arr.shape[0] + 1,) + arr.shape[1:], dtype=np.float64)
+    np.cumsum(arr, axis=0, dtype=np.float64, out=cumsum[1:])
+    return cumsum[window:] - cumsum[:-window]
+
+
+def _running_extremum(arr: NDArray[np.number], window: int, ufunc: np.ufunc):
+    """The van Herk/Gil-Werman algorithm for running max/min along the first axis."""
+    size = arr.shape[0]
+    nblocks = -(-size // window)
+    pad = nblocks * window - size
+    if pad > 0:
+        padded = np.concatenate([arr, np.repeat(arr[-1:], pad, axis=0)], axis=0)
+    else:
+        padded = arr
+    blocks = padded.reshape(nblocks, window, *arr.shape[1:])
+    # prefix and suffix extrema within each block
+    prefix = ufunc.accumulate(blocks, axis=1).reshape(padded.shape)
+    suffix = ufunc.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(padded.shape)
+    n_out = size - window + 1
+    return ufunc(suffix[:n_out], prefix[window - 1 : window - 1 + n_out])
+
+
+_RUNNING_FUNCS = {
+    "sum": lambda arr, w: _running_sum(arr, w).astype(np.float32),
+    "mean": lambda arr, w: (_running_sum(arr, w) / w).astype(np.float32),
+    "max": lambda arr, w: _running_extremum(arr, w, np.maximum),
+    "min": lambda arr, w: _running_extremum(arr, w, np.minimum),
+}
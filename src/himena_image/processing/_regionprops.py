@@ -0,0 +1,359 @@
+"""Vectorized measurement of region properties.
+
+`skimage.measure.regionprops` creates a Python object for each region, which is slow
+when there are many regions or many frames. The basic intensity properties (area,
+mean, min, max etc.), the centroids and the bounding boxes only need per-label sums
+or extrema, so they are calculated for all the regions at once by `np.bincount` and
+`scipy.ndimage`. Other properties (shape descriptors) fall back to skimage.
+
+Multi-valued properties are split into columns named as `skimage.measure.
+regionprops_table` does, such as "centroid-0" and "centroid-1".
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Sequence
+import numpy as np
+from numpy.typing import NDArray
+from scipy import ndimage as ndi
+
+from himena_image._config import get_num_workers
+from himena_image.processing._jobs import Job
+
+# properties that are calculated by the vectorized engine
+FAST_PROPERTIES = frozenset(
+    [
+        "label",
+        "area",
+        "num_pixels",
+        "intensity_mean",
+        "intensity_min",
+        "intensity_max",
+        "intensity_std",
+        "centroid",
+        "centroid_weighted",
+        "bbox",
+    ]
+)
+
+
+def fast_region_properties(
+    image: NDArray[np.number],
+    labels: NDArray[np.integer],
+    index: NDArray[np.integer],
+    properties: Iterable[str],
+    ndim: int | None = None,
+) -> dict[str, NDArray]:
+    """Calculate the properties in `FAST_PROPERTIES` for all the regions at once.
+
+    Parameters
+    ----------
+    image : array
+        Intensity image.
+    labels : array of int
+        Label image of the same shape as `image`. 0 is the background.
+    index : array of int
+        Labels of the regions to be measured. Regions without any pixel are NaN.
+    properties : iterable of str
+        Properties to calculate.
+    ndim : int, optional
+        Number of the last axes that the coordinates are measured along (such as
+        centroids). The regions must not span the other leading axes. All the axes
+        are used by default.
+    """
+    properties = list(properties)
+    if unknown := set(properties) - FAST_PROPERTIES:
+        raise ValueError(f"Properties {unknown!r} are not supported.")
+    ndim = labels.ndim if ndim is None else ndim
+    index = np.asarray(index)
+    nregions = index.size
+    ids = _region_ids(labels, index).ravel()
+    values = image.ravel().astype(np.float64, copy=False)
+
+    def _sum(weights=None) -> NDArray[np.float64]:
+        return np.bincount(ids, weights=weights, minlength=nregions + 1)[:nregions]
+
+    num_pixels = _sum().astype(np.int64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = _sum(values) / num_pixels
+
+    out: dict[str, NDArray] = {}
+    for prop in properties:
+        if prop == "label":
+            out[prop] = index
+        elif prop == "num_pixels":
+            out[prop] = num_pixels
+        elif prop == "area":
+            out[prop] = num_pixels.astype(np.float64)
+        elif prop == "intensity_mean":
+            out[prop] = mean
+        elif prop in ("intensity_min", "intensity_max"):
+            func = ndi.minimum if prop == "intensity_min" else ndi.maximum
+            ext = np.asarray(func(image, labels, index), dtype=np.float64)
+            out[prop] = np.where(num_pixels > 0, ext, np.nan)
+        elif prop == "intensity_std":
+            mean_ext = np.append(mean, 0.0)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                var = _sum((values - mean_ext[ids]) ** 2) / num_pixels
+            out[prop] = np.sqrt(var)
+        elif prop in ("centroid", "centroid_weighted"):
+            weights = 1.0 if prop == "centroid" else values
+            denom = num_pixels if prop == "centroid" else _sum(values)
+            for i, coord in enumerate(_iter_coords(labels.shape, ndim)):
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    out[f"{prop}-{i}"] = _sum(coord * weights) / denom
+        elif prop == "bbox":
+            out.update(_bbox(labels, index, ndim))
+    return out
+
+
+def region_properties_table(
+    image: NDArray[np.number],
+    labels: NDArray[np.integer],
+    properties: Sequence[str],
+    index: NDArray[np.integer] | None = None,
+) -> dict[str, NDArray]:
+    """Table of the region properties of a 2D or 3D label image.
+
+    Basic properties are calculated by `fast_region_properties` and the others by
+    `skimage.measure.regionprops_table`. Regions listed in `index` but missing in
+    `labels` are NaN.
+    """
+    if index is None:
+        index = np.unique(labels)
+        index = index[index > 0]
+    fast = [p for p in properties if p in FAST_PROPERTIES]
+    slow = [p for p in properties if p not in FAST_PROPERTIES]
+    out = fast_region_properties(image, labels, index, fast)
+    if slow:
+        out.update(_skimage_properties(image, labels, index, slow))
+    return out
+
+
+def iter_frame_properties(
+    image: Any,
+    labels: Any,
+    properties: Sequence[str],
+    frame_axes: Sequence[str],
+    *,
+    num_workers: int | None = None,
+    job: Job | None = None,
+) -> Iterator[dict[str, NDArray]]:
+    """Iterate over the region property tables of each frame.
+
+    Frames are read and measured lazily by a thread pool, and only a few frames are
+    in memory at the same time. Tables are yielded in the order of the frames.
+
+    Parameters
+    ----------
+    image : array-like
+        Intensity image of shape (*frame_shape, *spatial_shape). Any array that
+        supports numpy-style slicing (numpy, dask, zarr etc.) is allowed.
+    labels : array-like
+        Label image of shape (..., *spatial_shape). Its leading axes, if any, are
+        the last frame axes of `image`. For example, labels of shape (T, Y, X) can
+        be used for an image of shape (T, C, Y, X) only if C is not a frame axis,
+        so the frame axes must be ordered accordingly.
+    properties : sequence of str
+        Properties to measure.
+    frame_axes : sequence of str
+        Names of the frame axes, used as the column names of the frame indices.
+    """
+    nframe = len(frame_axes)
+    frame_shape = tuple(image.shape[:nframe])
+    n_label_frame = labels.ndim - (image.ndim - nframe)
+    if n_label_frame < 0 or labels.shape[n_label_frame:] != image.shape[nframe:]:
+        raise ValueError(
+            f"Labels of shape {labels.shape} cannot be used for image of shape "
+            f"{image.shape} with frame axes {list(frame_axes)!r}."
+        )
+
+    def _measure(frame: tuple[int, ...]) -> dict[str, NDArray]:
+        if job is not None:
+            job.check()
+        img_frame = np.asarray(image[frame])
+        lbl_frame = np.asarray(labels[frame[nframe - n_label_frame :]])
+        index = np.unique(lbl_frame)
+        index = index[index > 0]
+        table = region_properties_table(img_frame, lbl_frame, properties, index=index)
+        out = {a: np.full(index.size, i) for a, i in zip(frame_axes, frame)}
+        out["label"] = index
+        out.update(table)
+        return out
+
+    n_workers = get_num_workers(num_workers)
+    if job is not None:
+        job.add_total(int(np.prod(frame_shape)))
+    with ThreadPoolExecutor(n_workers) as ex:
+        pending = deque()
+        try:
+            for frame in np.ndindex(frame_shape):
+                pending.append(ex.submit(_measure, frame))
+                # keep a bounded number of frames in flight
+                if len(pending) >= 2 * n_workers:
+                    yield _pop_result(pending, job)
+            while pending:
+                yield _pop_result(pending, job)
+        except BaseException:
+            ex.shutdown(cancel_futures=True)
+            raise
+
+
+def _pop_result(pending: deque, job: Job | None) -> dict[str, NDArray]:
+    out = pending.popleft().result()
+    if job is not None:
+        job.advance()
+    return out
+
+
+def concat_tables(tables: Iterable[dict[str, NDArray]]) -> dict[str, NDArray]:
+    """Concatenate the tables into one columnar table."""
+    columns: dict[str, list[NDArray]] = {}
+    for table in tables:
+        for key, value in table.items():
+            columns.setdefault(key, []).append(np.asarray(value))
+    return {key: np.concatenate(values) for key, values in columns.items()}
+
+
+def write_tables(
+    tables: Iterable[dict[str, NDArray]],
+    path: str | Path,
+    batch_rows: int = 65536,
+) -> int:
+    """Stream the tables to a CSV or Parquet file and return the number of rows."""
+    path = Path(path)
+    if path.suffix == ".parquet":
+        writer = _ParquetWriter(path)
+    elif path.suffix in (".csv", ".txt"):
+        writer = _CsvWriter(path)
+    else:
+        raise ValueError(f"Unsupported file type: {path.suffix!r}")
+    buffer: list[dict[str, NDArray]] = []
+    nrows = 0
+    nrows_total = 0
+    try:
+        for table in tables:
+            buffer.append(table)
+            nrows += len(next(iter(table.values()), ()))
+            nrows_total += len(next(iter(table.values()), ()))
+            if nrows >= batch_rows:
+                writer.write(concat_tables(buffer))
+                buffer.clear()
+                nrows = 0
+        if buffer:
+            writer.write(concat_tables(buffer))
+    except BaseException:
+        # do not leave an incomplete file
+        writer.close()
+        path.unlink(missing_ok=True)
+        raise
+    writer.close()
+    return nrows_total
+
+
+class _CsvWriter:
+    def __init__(self, path: Path):
+        self._file = path.open("w", newline="")
+        self._header = True
+
+    def write(self, table: dict[str, NDArray]) -> None:
+        import pandas as pd
+
+        pd.DataFrame(table).to_csv(self._file, header=self._header, index=False)
+        self._header = False
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _ParquetWriter:
+    def __init__(self, path: Path):
+        self._path = path
+        self._writer = None
+
+    def write(self, table: dict[str, NDArray]) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        batch = pa.table(table)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self._path, batch.schema)
+        self._writer.write_table(batch)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+
+
+def _region_ids(
+    labels: NDArray[np.integer], index: NDArray[np.integer]
+) -> NDArray[np.intp]:
+    """Position of each label in `index`, or `index.size` if not in `index`."""
+    nregions = index.size
+    if labels.size == 0:
+        return np.zeros(labels.shape, dtype=np.intp)
+    max_label = int(labels.max())
+    if max_label <= 4 * labels.size:
+        # look-up table is cheaper than the binary search
+        table = np.full(max_label + 1, nregions, dtype=np.intp)
+        inrange = index[(index >= 0) & (index <= max_label)]
+        table[inrange] = np.flatnonzero((index >= 0) & (index <= max_label))
+        return table[labels]
+    order = np.argsort(index)
+    sorted_index = index[order]
+    pos = np.clip(np.searchsorted(sorted_index, labels), 0, max(nregions - 1, 0))
+    found = sorted_index[pos] == labels if nregions > 0 else np.zeros_like(labels)
+    return np.where(found, order[pos], nregions)
+
+
+def _iter_coords(shape: tuple[int, ...], ndim: int):
+    """Flattened coordinates along each of the last `ndim` axes."""
+    for axis in range(len(shape) - ndim, len(shape)):
+        coord = np.arange(shape[axis], dtype=np.float64)
+        coord = coord.reshape((-1,) + (1,) * (len(shape) - axis - 1))
+        yield np.broadcast_to(coord, shape).ravel()
+
+
+def _bbox(
+    labels: NDArray[np.integer], index: NDArray[np.integer], ndim: int
+) -> dict[str, NDArray[np.float64]]:
+    """Bounding boxes as (min_0, min_1, ..., max_0, max_1, ...) columns."""
+    lead = labels.ndim - ndim
+    bbox = np.full((index.size, 2 * ndim), np.nan)
+    if labels.size > 0 and index.size > 0:
+        max_label = int(max(labels.max(), index.max()))
+        slices = ndi.find_objects(labels, max_label=max_label)
+        for i, label in enumerate(index.tolist()):
+            if label > 0 and (sl := slices[label - 1]) is not None:
+                sl = sl[lead:]
+                bbox[i] = [s.start for s in sl] + [s.stop for s in sl]
+    return {f"bbox-{i}": bbox[:, i] for i in range(2 * ndim)}
+
+
+def _skimage_properties(
+    image: NDArray[np.number],
+    labels: NDArray[np.integer],
+    index: NDArray[np.integer],
+    properties: list[str],
+) -> dict[str, NDArray]:
+    from skimage.measure import regionprops_table
+
+    table = regionprops_table(
+        labels, intensity_image=image, properties=["label"] + properties
+    )
+    found = np.asarray(table.pop("label"))
+    pos = _region_ids(found, index)
+    out = {}
+    for key, value in table.items():
+        value = np.asarray(value)
+        if value.dtype.kind not in "biuf":
+            col = np.empty(index.size, dtype=object)
+            col[:] = None
+        else:
+            col = np.full(index.size, np.nan)
+        col[pos[pos < index.size]] = value[pos < index.size]
+        out[key] = col
+    return out
@@ -0,0 +1,97 @@
+"""Accelerated rolling-ball background, same as the one in ImageJ.
+
+The cost of the rolling ball grows with the volume of the ball, but the background
+is smooth on the scale of the radius. The image is therefore shrunk by a factor that
+depends on the radius, taking the minimum of each block so that the background stays
+below the image, the ball of the shrunk radius is rolled on the small image (with the
+intensity shrunk by the same factor, so that the ball keeps its shape), and the
+background is linearly interpolated back to the original size. The interpolated
+background is finally clipped by the (prefiltered) image, since the ball can never
+go above it.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+from numpy.typing import NDArray
+from scipy import ndimage as ndi
+
+
+def shrink_factor(radius: float) -> int:
+    """Shrink factor of the image for the ball of `radius`, same as ImageJ."""
+    if radius <= 10:
+        return 1
+    elif radius <= 30:
+        return 2
+    elif radius <= 100:
+        return 4
+    return 8
+
+
+def rolling_ball_background(
+    arr: NDArray[np.number],
+    radius: float = 30.0,
+    prefilter: str = "mean",
+    shrink: int | None = None,
+) -> NDArray[np.float32]:
+    """Background of an image estimated by the shrunk rolling ball.
+
+    Parameters
+    ----------
+    arr : array
+        Input image. All the axes are the spatial axes.
+    radius : float, default 30.0
+        Radius of the ball.
+    prefilter : {"mean", "median", "none"}, default "mean"
+        3x3 filter applied before creating the background.
+    shrink : int, optional
+        Shrink factor. Determined by the radius by default.
+    """
+    from skimage.restoration import rolling_ball
+
+    arr = np.asarray(arr, dtype=np.float32)
+    if prefilter == "mean":
+        filt = ndi.uniform_filter(arr, 3, mode="reflect")
+    elif prefilter == "median":
+        filt = ndi.median_filter(arr, 3, mode="reflect")
+    elif prefilter == "none":
+        filt = arr
+    else:
+        raise ValueError("`prefilter` must be 'mean', 'median' or 'none'.")
+    if shrink is None:
+        shrink = shrink_factor(radius)
+    if shrink <= 1:
+        return rolling_ball(filt, radius=radius).astype(np.float32, copy=False)
+    small = _shrink_min(filt, shrink)
+    # scale the intensity as well, so that the ball keeps its shape
+    back_small = rolling_ball(small / shrink, radius=radius / shrink) * shrink
+    back = _enlarge(back_small.astype(np.float32, copy=False), shrink, arr.shape)
+    return np.minimum(back, filt, out=back)
+
+
+def _shrink_min(arr: NDArray[np.float32], factor: int) -> NDArray[np.float32]:
+    """Minimum of each block of `factor` pixels along each axis."""
+    pads = [(0, -size % factor) for size in arr.shape]
+    padded = np.pad(arr, pads, mode="edge")
+    shape: list[int] = []
+    for size in padded.shape:
+        shape.extend([size // factor, factor])
+    return padded.reshape(shape).min(axis=tuple(range(1, 2 * arr.ndim, 2)))
+
+
+def _enlarge(
+    small: NDArray[np.float32], factor: int, shape: tuple[int, ...]
+) -> NDArray[np.float32]:
+    """Linearly interpolate the shrunk image back to `shape`.
+
+    Each pixel of the shrunk image is located at the center of its block.
+    """
+    out = small
+    for axis, size in enumerate(shape):
+        x = (np.arange(size, dtype=np.float32) + 0.5) / factor - 0.5
+        x = np.clip(x, 0, small.shape[axis] - 1)
+        i0 = np.floor(x).astype(np.intp)
+        i1 = np.minimum(i0 + 1, small.shape[axis] - 1)
+        w = (x - i0).reshape((-1,) + (1,) * (out.ndim - axis - 1))
+        out = np.take(out, i0, axis=axis) * (1 - w) + np.take(out, i1, axis=axis) * w
+    return out.astype(np.float32, copy=False)
@@ -1,3 +1,5 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import logging
 from typing import Literal
 from cmap import Colormap
 
@@ -6,14 +8,25 @@ import impy as ip
 from superqt.utils import qthrottled, ensure_main_thread
 from himena import WidgetDataModel, Parametric, StandardType, create_model
 from himena.plugins import register_function, configure_gui
-from himena.standards.model_meta import ImageMeta, DataFramePlotMeta
+from himena.standards.model_meta import (
+    ImageMeta,
+    ImageChannel,
+    DimAxis,
+    DataFramePlotMeta,
+)
 from himena.standards import roi
+from himena.data_wrappers import ArrayWrapper
 from himena.widgets import SubWindow
 from himena_image.utils import image_to_model, model_to_image
+from himena_image.processing._projection import (
+    project_chunked,
+    running_projection as _running_projection,
+)
 from himena_builtins.qt.image import QImageView, QtRois
 from himena_builtins.qt.dataframe import QDataFramePlotView
 
 MENU = ["tools/image/calculate", "/model_menu/calculate"]
+_LOGGER = logging.getLogger(__name__)
 
 
 @register_function(
@@ -36,14 +49,46 @@ def projection(model: WidgetDataModel) -> Parametric:
 
     @configure_gui(
         axis={"choices": axis_choices, "value": value, "widget_type": "Select"},
+        start={"min": 0},
+        stop={"min": 1},
     )
     def run_projection(
         axis: str,
         method: Literal["mean", "median", "max", "min", "sum", "std"],
-        # range: tuple[int, int],
+        start: int = 0,
+        stop: int | None = None,
     ) -> WidgetDataModel:
+        """Run projection.
+
+        Parameters
+        ----------
+        axis : str or list of str
+            Axis or axes to project along.
+        method : str
+            Projection method. "median" is calculated from histogram bins if the
+            stack does not fit in memory. "mean", "median" and "std" always return
+            float32 images.
+        start : int, default 0
+            First frame to be projected. Only available when a single axis is selected.
+        stop : int, optional
+            Frame to stop projection (exclusive). If not given, frames are projected
+            to the end. Only available when a single axis is selected.
+        """
         img = model_to_image(model)
-        out = img.proj(axis=axis, method=method)
+        axes = [axis] if isinstance(axis, str) else list(axis)
+        axis_indices = [img.axisof(a) for a in axes]
+        if start == 0 and stop is None:
+            frame_range = None
+        else:
+            frame_range = (start, stop or img.shape[axis_indices[0]])
+        out_arr = project_chunked(
+            img.value, axis_indices, method=method, frame_range=frame_range
+        )
+        out_axes = [a for i, a in enumerate(img.axes) if i not in axis_indices]
+        out = ip.asarray(out_arr, axes=[str(a) for a in out_axes])
+        for a, a_orig in zip(out.axes, out_axes):
+            a.scale = a_orig.scale
+            a.unit = a_orig.unit
         return image_to_model(
             out, title=model.title, extension_default=model.extension_default
         )
@@ -51,6 +96,59 @@ def projection(model: WidgetDataModel) -> Parametric:
     return run_projection
 
 
+@register_function(
+    title="Running Projection ...",
+    menus=MENU,
+    types=[StandardType.IMAGE],
+    run_async=True,
+    command_id="himena-image:running-projection",
+)
+def running_projection(model: WidgetDataModel) -> Parametric:
+    """Project the image over a sliding window along an axis."""
+    img = model_to_image(model)
+    axis_choices = [str(a) for a in img.axes]
+    if "t" in axis_choices:
+        value = "t"
+    elif "z" in axis_choices:
+        value = "z"
+    else:
+        value = axis_choices[0]
+
+    @configure_gui(
+        axis={"choices": axis_choices, "value": value},
+        window={"min": 1},
+    )
+    def run_running_projection(
+        axis: str,
+        window: int = 3,
+        method: Literal["mean", "max", "min", "sum"] = "mean",
+    ) -> WidgetDataModel:
+        """Run running projection.
+
+        Parameters
+        ----------
+        axis : str
+            Axis along which the window slides.
+        window : int, default 3
+            Number of frames in each window. The output will have `N - window + 1`
+            frames along `axis`.
+        method : str, default "mean"
+            Projection method.
+        """
+        img = model_to_image(model)
+        out_arr = _running_projection(img.value, img.axisof(axis), window, method)
+        if isinstance(img, ip.LazyImgArray):
+            out = ip.lazy.asarray(out_arr, axes=img.axes, chunks=out_arr.chunksize)
+        else:
+            out = ip.asarray(out_arr, axes=img.axes)
+        for a, a_orig in zip(out.axes, img.axes):
+            a.scale = a_orig.scale
+            a.unit = a_orig.unit
+        return image_to_model(out, orig=model, reset_clim=True)
+
+    return run_running_projection
+
+
 @register_function(
     title="Invert",
     menus=MENU,
@@ -107,34 +205,91 @@ def profile_line(model: WidgetDataModel) -> Parametric:
 def profile_line_live(win: SubWindow[QImageView]):
     """Live-plot the line profile of the current image slice."""
     plot_view = QDataFramePlotView()
-    update_model_throttled = ensure_main_thread(plot_view.update_model)
+    executor = ThreadPoolExecutor(max_workers=1)
+    last_future: Future | None = None
+
+    @ensure_main_thread
+    def _on_profile_done(future: Future[WidgetDataModel]):
+        if future is not last_future or future.cancelled():
+            return  # superseded by a newer request
+        try:
+            model = future.result()
+        except Exception:
+            # keep the live view running; the next update may well succeed
+            _LOGGER.exception("Failed to calculate the line profile.")
+            model = _empty_dataframe_model()
+        plot_view.update_model(model)
 
     @qthrottled(timeout=50)
     def _callback():
+        nonlocal last_future
+        if last_future is not None:
+            last_future.cancel()
+            last_future = None
         qroi = win.widget._img_view._current_roi_item
         if isinstance(qroi, (QtRois.QLineRoi, QtRois.QSegmentedLineRoi)):
-            model_input = win.widget.to_model()
-            coords = _get_profile_coords(model_input.metadata)
+            coords = _roi_to_points(qroi.toRoi())
             if len(coords) < 2:
-                model = _empty_dataframe_model()
-            else:
-                model = _run_profile_line(
-                    model_to_image(model_input),
-                    model_input.metadata,
-                    coords,
-                    _get_indices_channel_composite(model_input.metadata),
-                )
+                plot_view.update_model(_empty_dataframe_model())
+                return
+            # only snapshot the lightweight state here; slicing and computing the
+            # profile is done in the worker thread.
+            arr, meta = _snapshot_image_view(win.widget)
+            last_future = future = executor.submit(
+                _run_profile_line_on_plane, arr, meta, coords
+            )
+            future.add_done_callback(_on_profile_done)
         else:
-            model = _empty_dataframe_model()
-        update_model_throttled(model)
+            plot_view.update_model(_empty_dataframe_model())
+
+    def _on_closed():
+        win.widget.current_roi_updated.disconnect(_callback)
+        win.widget.dims_slider.valueChanged.disconnect(_callback)
+        executor.shutdown(wait=False, cancel_futures=True)
 
     win.widget.current_roi_updated.connect(_callback)
     win.widget.dims_slider.valueChanged.connect(_callback)
     child = win.add_child(plot_view, title="Profile Line (Live)")
-    child.closed.connect(lambda: win.widget.current_roi_updated.disconnect(_callback))
+    child.closed.connect(_on_closed)
     _callback()
 
 
+def _snapshot_image_view(widget: QImageView) -> tuple[ArrayWrapper, ImageMeta]:
+    """Get the array and the minimum metadata needed for line profiling.
+
+    Unlike `widget.to_model()`, this function does not convert ROIs or other states,
+    so that it is cheap enough to be called on every ROI update.
+    """
+    axes = widget.dims_slider.to_dim_axes()
+    if widget._is_rgb:
+        axes.append(DimAxis(name="RGB"))
+    meta = ImageMeta(
+        axes=axes,
+        channels=[ImageChannel(colormap=ch.colormap.name) for ch in widget._channels],
+        channel_axis=widget._channel_axis,
+        is_rgb=widget._is_rgb,
+        current_indices=widget.dims_slider.value() + (None, None),
+    )
+    return widget._arr, meta
+
+
+def _run_profile_line_on_plane(
+    arr: ArrayWrapper,
+    meta: ImageMeta,
+    coords: list[list[float]],
+) -> WidgetDataModel:
+    """Compute the line profile by only reading the current plane of the array."""
+    indices = _get_indices_channel_composite(meta)
+    img_slice = arr.get_slice(tuple(slice(None) if i is None else i for i in indices))
+    axes = [a for a, i in zip(meta.axes, indices) if i is None]
+    axes.extend(meta.axes[len(indices) :])
+    img = ip.asarray(img_slice, axes=[a.name for a in axes])
+    for a, axis in zip(img.axes, axes):
+        a.scale = axis.scale
+        a.unit = axis.unit
+    return _run_profile_line(img, meta, coords, [None] * img.ndim)
+
+
 def _run_profile_line(
     img: ip.ImgArray,
     meta: ImageMeta,
@@ -1,15 +1,32 @@
+from pathlib import Path
 import impy as ip
 
 from himena import StandardType, WidgetDataModel, Parametric
 from himena.plugins import register_function, configure_gui
 import numpy as np
 from himena_image.utils import (
+    array_like,
     label_to_model,
     make_dims_annotation,
     model_to_image,
     image_to_model,
     norm_dims,
 )
+from himena_image.processing._chunked_label import label_chunked, smallest_uint_dtype
+from himena_image.processing._chunked_peaks import (
+    detect_blobs_chunked,
+    peak_local_max_chunked,
+)
+from himena_image.processing._jobs import Job
+from himena_image.processing._parallel import map_planes
+from himena_image.processing._regionprops import (
+    FAST_PROPERTIES,
+    concat_tables,
+    fast_region_properties,
+    iter_frame_properties,
+    region_properties_table,
+    write_tables,
+)
 
 MENUS = ["tools/image/analyze/features", "/model_menu/analyze/features"]
 
@@ -31,12 +48,37 @@ def label(model: WidgetDataModel) -> Parametric:
         dimension: int = 2,
     ) -> WidgetDataModel[ip.Label]:
         img = model_to_image(model)
-        out = img.label(connectivity=connectivity, dims=norm_dims(dimension, img.axes))
+        dims = norm_dims(dimension, img.axes)
+        if isinstance(img, ip.LazyImgArray):
+            # label chunk by chunk without loading the whole mask
+            label_axes = [i for i, a in enumerate(img.axes) if str(a) in dims]
+            with Job("Labeling") as job:
+                labels = label_chunked(img.value, label_axes, connectivity, job=job)
+            return label_to_model(array_like(labels, img), orig=model)
+        with Job("Labeling") as job:
+            labels = map_planes(
+                lambda plane: plane.label(connectivity=connectivity, dims=dims),
+                img,
+                dims,
+                job=job,
+            )
+        out = _make_labels_unique(labels, dims)
         return label_to_model(out, orig=model)
 
     return run_label
 
 
+def _make_labels_unique(labels: ip.ImgArray, dims) -> ip.ImgArray:
+    """Offset the labels of each plane so that no label is shared between planes."""
+    arr = labels.value
+    plane_axes = tuple(i for i, a in enumerate(labels.axes) if str(a) in dims)
+    nlabels = arr.max(axis=plane_axes, keepdims=True).astype(np.uint64)
+    offsets = np.cumsum(nlabels.ravel()).reshape(nlabels.shape) - nlabels
+    dtype = smallest_uint_dtype(int(nlabels.sum()))
+    out = np.where(arr > 0, arr.astype(dtype) + offsets.astype(dtype), 0).astype(dtype)
+    return ip.asarray(out, like=labels)
+
+
 @register_function(
     title="Peak local maxima ...",
     menus=MENUS,
@@ -45,6 +87,14 @@ def label(model: WidgetDataModel) -> Parametric:
     command_id="himena-image:peak-local-max",
 )
 def peak_local_max(model: WidgetDataModel) -> Parametric:
+    """Find the local maxima of an image.
+
+    A pixel is a peak if it is the maximum within `min_distance` and brighter than
+    the threshold, same as `ImgArray.peak_local_max` of impy. Without `topn` and
+    `labels`, the peaks are found chunk by chunk, so that large images need not be
+    loaded into memory.
+    """
+
     @configure_gui(
         labels={"types": [StandardType.IMAGE_LABELS]},
         dimension={"choices": make_dims_annotation(model)},
@@ -59,18 +109,35 @@ def peak_local_max(model: WidgetDataModel) -> Parametric:
         dimension: int = 2,
     ) -> WidgetDataModel:
         img = model_to_image(model)
-        if labels is not None:
-            img.labels = labels
-        out = img.peak_local_max(
-            min_distance=min_distance,
-            percentile=percentile,
-            topn=topn or float("inf"),
-            topn_per_label=topn_per_label or float("inf"),
-            exclude_border=exclude_border,
-            use_labels=labels is not None,
-            dims=norm_dims(dimension, img.axes),
-        )
-        df = {k: out[k].to_numpy() for k in out.columns}
+        dims = norm_dims(dimension, img.axes)
+        if labels is None and topn is None:
+            # no global ranking is needed; find the peaks chunk by chunk
+            spatial_axes = [i for i, a in enumerate(img.axes) if str(a) in dims]
+            with Job("Finding peaks") as job:
+                coords = peak_local_max_chunked(
+                    img.value,
+                    spatial_axes,
+                    min_distance,
+                    threshold=_percentile(img.value, percentile),
+                    exclude_border=int(min_distance) if exclude_border else 0,
+                    job=job,
+                )
+            df = {str(a): c for a, c in zip(img.axes, coords)}
+        else:
+            if isinstance(img, ip.LazyImgArray):
+                img = img.compute()
+            if labels is not None:
+                img.labels = labels
+            out = img.peak_local_max(
+                min_distance=min_distance,
+                percentile=percentile,
+                topn=topn or float("inf"),
+                topn_per_label=topn_per_label or float("inf"),
+                exclude_border=exclude_border,
+                use_labels=labels is not None,
+                dims=dims,
+            )
+            df = {k: out[k].to_numpy() for k in out.columns}
         return WidgetDataModel(
             value=df, type=StandardType.DATAFRAME, title=f"Peaks of {model.title}"
         )
@@ -78,6 +145,65 @@ def peak_local_max(model: WidgetDataModel) -> Parametric:
     return run_peak_local_max
 
 
+def _percentile(arr, percentile: float | None) -> float | None:
+    if percentile is None:
+        return None
+    if isinstance(arr, np.ndarray):
+        return float(np.percentile(arr, percentile))
+    import dask.array as da
+
+    # approximate, but only needs one pass over the chunks
+    return float(da.percentile(arr.ravel(), [percentile]).compute()[0])
+
+
+@register_function(
+    title="Detect blobs ...",
+    menus=MENUS,
+    types=[StandardType.IMAGE],
+    run_async=True,
+    command_id="himena-image:detect-blobs",
+)
+def detect_blobs(model: WidgetDataModel) -> Parametric:
+    """Detect bright blobs by multi-scale LoG or DoG filtering.
+
+    The image is filtered and the local maxima in the scale space are found chunk by
+    chunk, so the filtered image is never stored. The result is a table of the blob
+    coordinates, the sigma of the best scale and the scale-normalized response.
+    """
+
+    @configure_gui(
+        method={"choices": [("LoG", "log"), ("DoG", "dog")]},
+        dimension={"choices": make_dims_annotation(model)},
+    )
+    def run_detect_blobs(
+        method: str = "log",
+        min_sigma: float = 1.0,
+        max_sigma: float = 4.0,
+        num_sigma: int = 5,
+        threshold: float = 0.0,
+        dimension: int = 2,
+    ) -> WidgetDataModel:
+        img = model_to_image(model)
+        dims = norm_dims(dimension, img.axes)
+        spatial_axes = [i for i, a in enumerate(img.axes) if str(a) in dims]
+        if method == "log":
+            sigmas = np.linspace(min_sigma, max_sigma, num_sigma)
+        else:
+            sigmas = np.geomspace(min_sigma, max_sigma, num_sigma)
+        with Job("Detecting blobs") as job:
+            *coords, sigma, response = detect_blobs_chunked(
+                img.value, spatial_axes, sigmas, method, threshold=threshold, job=job
+            )
+        df = {str(a): c for a, c in zip(img.axes, coords)}
+        df["sigma"] = sigma
+        df["response"] = response
+        return WidgetDataModel(
+            value=df, type=StandardType.DATAFRAME, title=f"Blobs of {model.title}"
+        )
+
+    return run_detect_blobs
+
+
 REGIONPROPS_CHOICES = [
     "area", "area_bbox", "area_convex", "area_filled", "axis_major_length",
     "axis_minor_length", "bbox", "centroid", "centroid_local", "centroid_weighted",
@@ -99,26 +225,49 @@ REGIONPROPS_CHOICES = [
     command_id="himena-image:region-properties",
 )
 def region_properties() -> Parametric:
-    """Measure region properties of an image."""
+    """Measure region properties of an image.
+
+    Axes other than the last `dimension` axes are the frame axes, and the labels of
+    each frame are measured separately. For example, a (t, y, x) label stack is
+    measured as 2D labels of each time point with `dimension=2`. If a save path is
+    given, the table is written to the CSV or Parquet file frame by frame, and only
+    the summary of the file is returned.
+    """
 
     @configure_gui(
         image={"types": [StandardType.IMAGE]},
         labels={"types": [StandardType.IMAGE_LABELS]},
         properties={"choices": REGIONPROPS_CHOICES, "widget_type": "Select"},
+        dimension={
+            "choices": [("same as labels", None), ("2 (yx)", 2), ("3 (zyx)", 3)]
+        },
+        save_path={"mode": "w", "filter": "*.csv;*.parquet"},
     )
     def run_region_properties(
         image: WidgetDataModel,
         labels: WidgetDataModel[ip.Label],
         properties: list[str] = ["intensity_mean"],
+        dimension: int | None = None,
+        save_path: Path | None = None,
     ) -> WidgetDataModel:
         img = model_to_image(image)
-        img.labels = labels.value
-        table = img.regionprops(properties=properties)
-        dict_ = {}
-        for key, prop in table.items():
-            dict_[key] = prop.ravel()
+        lbl = labels.value
+        ndim_spatial = lbl.ndim if dimension is None else dimension
+        frame_axes = [str(a) for a in img.axes[: img.ndim - ndim_spatial]]
+        with Job("Measuring regions") as job:
+            tables = iter_frame_properties(
+                img.value, lbl, properties, frame_axes, job=job
+            )
+            if save_path is not None:
+                nrows = write_tables(tables, save_path)
+                return WidgetDataModel(
+                    value={"path": str(save_path), "rows": nrows},
+                    type=StandardType.DICT,
+                    title=f"Properties of {image.title}",
+                )
+            table = concat_tables(tables)
         return WidgetDataModel(
-            value=dict_,
+            value=table,
             type=StandardType.DATAFRAME,
             title=f"Properties of {image.title}",
         )
@@ -173,20 +322,13 @@ def aggregate_by_mask(model: WidgetDataModel) -> Parametric:
     ) -> WidgetDataModel:
         img = model_to_image(model)
         msk = model_to_image(mask)
+        if img.shape != msk.shape:
+            raise ValueError(
+                f"Shape mismatch between image {img.shape} and mask {msk.shape}."
+            )
         dims = norm_dims(dimension, img.axes)
-        c_axes = [str(a) for a in img.axes if str(a) not in dims]
-        labels = np.zeros_like(msk.value, dtype=np.uint32)
-        dict_ = {a: [] for a in c_axes}
-        cur_label = 1
-        for sl, msk_slice in msk.iter(c_axes):
-            labels[sl][msk_slice] = cur_label
-            cur_label += 1
-            for i, axis_name in enumerate(c_axes):
-                dict_[axis_name].append(sl[i])
-        img.labels = labels
-        table = img.regionprops(properties=properties)
-        for key, prop in table.items():
-            dict_[key] = prop.ravel()
+        with Job("Aggregating by mask") as job:
+            dict_ = _aggregate_by_mask(img, msk, dims, properties, job)
         return WidgetDataModel(
             value=dict_,
             type=StandardType.DATAFRAME,
@@ -194,3 +336,64 @@ def aggregate_by_mask(model: WidgetDataModel) -> Parametric:
         )
 
     return run_aggregate_by_mask
+
+
+# maximum number of bytes of the image planes to be measured at once
+_MAX_BATCH_NBYTES = 64 * 1024**2
+
+
+def _aggregate_by_mask(
+    img: ip.ImgArray | ip.LazyImgArray,
+    msk: ip.ImgArray | ip.LazyImgArray,
+    dims,
+    properties: list[str],
+    job: Job,
+) -> dict[str, np.ndarray]:
+    """Measure the masked region of each plane, in batches of planes.
+
+    The mask of each plane is one region, so no label volume is created.
+    """
+    c_pos = [i for i, a in enumerate(img.axes) if str(a) not in dims]
+    c_shape = tuple(img.shape[i] for i in c_pos)
+    planes = list(np.ndindex(c_shape))
+    fast = [p for p in properties if p in FAST_PROPERTIES]
+    slow = [p for p in properties if p not in FAST_PROPERTIES]
+    plane_nbytes = img.dtype.itemsize * int(np.prod(img.shape)) // max(len(planes), 1)
+    batch_size = max(_MAX_BATCH_NBYTES // max(plane_nbytes, 1), 1)
+    job.add_total(len(planes))
+
+    def _get_planes(arr, batch):
+        out = []
+        for index in batch:
+            sl = [slice(None)] * arr.ndim
+            for i, idx in zip(c_pos, index):
+                sl[i] = idx
+            out.append(np.asarray(arr[tuple(sl)]))
+        return np.stack(out, axis=0)
+
+    columns: dict[str, list] = {}
+    for start in range(0, len(planes), batch_size):
+        batch = planes[start : start + batch_size]
+        img_batch = _get_planes(img.value, batch)
+        msk_batch = _get_planes(msk.value, batch) != 0
+        region = np.arange(1, len(batch) + 1, dtype=np.int32)
+        labels = msk_batch * region.reshape((-1,) + (1,) * (msk_batch.ndim - 1))
+        for i, axis_pos in enumerate(c_pos):
+            _append(columns, str(img.axes[axis_pos]), [idx[i] for idx in batch])
+        table = fast_region_properties(img_batch, labels, region, fast, ndim=len(dims))
+        for key, value in table.items():
+            _append(columns, key, value)
+        for img_plane, msk_plane in zip(img_batch, msk_batch):
+            if not slow:
+                break
+            table = region_properties_table(
+                img_plane, msk_plane.astype(np.uint8), slow, index=np.array([1])
+            )
+            for key, value in table.items():
+                _append(columns, key, value)
+        job.advance(len(batch))
+    return {k: np.concatenate(v) for k, v in columns.items()}
+
+
+def _append(columns: dict[str, list], key: str, value) -> None:
+    columns.setdefault(key, []).append(np.asarray(value))
@@ -1,11 +1,17 @@
+import impy as ip
 from himena import WidgetDataModel, Parametric, StandardType
 from himena.plugins import register_function, configure_gui, configure_submenu
 from himena_image.utils import (
+    array_like,
     make_dims_annotation,
     image_to_model,
     model_to_image,
     norm_dims,
 )
+from himena_image.processing._fft import (
+    butterworth_filter,
+    power_spectrum as _power_spectrum,
+)
 
 MENUS = ["tools/image/process/fft", "/model_menu/process/fft"]
 
@@ -89,6 +95,7 @@ def power_spectrum(model: WidgetDataModel) -> Parametric:
         dimension={"choices": make_dims_annotation(model)},
         norm={"label": "normalize maximum to 1"},
         zero_norm={"label": "normalize zero frequency to 0"},
+        half_spectrum={"label": "half spectrum (real FFT)"},
         preview=True,
     )
     def run_power_spectrum(
@@ -96,6 +103,7 @@ def power_spectrum(model: WidgetDataModel) -> Parametric:
         norm: bool = False,
         zero_norm: bool = False,
         double_precision: bool = False,
+        half_spectrum: bool = False,
         dimension=2,
         is_previewing: bool = False,
     ) -> WidgetDataModel:
@@ -113,15 +121,32 @@ def power_spectrum(model: WidgetDataModel) -> Parametric:
         double_precision : bool, optional
             If True, the calculation is done in double precision (float64). Otherwise,
             it is done in single precision (float32).
+        half_spectrum : bool, optional
+            If True, only the non-redundant half of the spectrum is returned. Because
+            the power spectrum of a real image is symmetric, the last axis will have
+            size N // 2 + 1 and will not be shifted.
         """
         img = model_to_image(model, is_previewing)
-        out = img.power_spectra(
-            shift=origin_in_center,
-            double_precision=double_precision,
-            norm=norm,
-            zero_norm=zero_norm,
-            dims=norm_dims(dimension, img.axes),
-        )
+        axes = [img.axisof(a) for a in norm_dims(dimension, img.axes)]
+        if img.dtype.kind == "c":
+            out = img.power_spectra(
+                shift=origin_in_center,
+                double_precision=double_precision,
+                norm=norm,
+                zero_norm=zero_norm,
+                dims=norm_dims(dimension, img.axes),
+            )
+        else:
+            out_arr = _power_spectrum(
+                img.value,
+                axes,
+                shift=origin_in_center,
+                norm=norm,
+                zero_norm=zero_norm,
+                double_precision=double_precision,
+                half=half_spectrum,
+            )
+            out = array_like(out_arr, like=img)
         return image_to_model(out, orig=model, is_previewing=is_previewing).astype(
             StandardType.IMAGE_FOURIER
         )
@@ -152,10 +177,8 @@ def lowpass_filter(model: WidgetDataModel) -> Parametric:
         dimension=2,
         is_previewing: bool = False,
     ) -> WidgetDataModel:
-        img = model_to_image(model)
-        out = img.lowpass_filter(
-            cutoff=cutoff, order=order, dims=norm_dims(dimension, img.axes)
-        )
+        img = model_to_image(model, is_previewing)
+        out = _run_butterworth(img, dimension, cutoff=cutoff, order=order)
         return image_to_model(out, orig=model, is_previewing=is_previewing)
 
     return run_lowpass_filter
@@ -184,12 +207,8 @@ def highpass_filter(model: WidgetDataModel) -> Parametric:
         dimension=2,
         is_previewing: bool = False,
     ) -> WidgetDataModel:
-        img = model_to_image(model)
-        out = img.highpass_filter(
-            cutoff=cutoff,
-            order=order,
-            dims=norm_dims(dimension, img.axes),
-        )
+        img = model_to_image(model, is_previewing)
+        out = _run_butterworth(img, dimension, cuton=cutoff, order=order)
         return image_to_model(out, orig=model, is_previewing=is_previewing)
 
     return run_highpass_filter
@@ -219,13 +238,21 @@ def bandpass_filter(model: WidgetDataModel) -> Parametric:
         dimension=2,
         is_previewing: bool = False,
     ) -> WidgetDataModel:
-        img = model_to_image(model)
-        out = img.bandpass_filter(
-            cuton=cuton,
-            cutoff=cutoff,
-            order=order,
-            dims=norm_dims(dimension, img.axes),
-        )
+        img = model_to_image(model, is_previewing)
+        out = _run_butterworth(img, dimension, cuton=cuton, cutoff=cutoff, order=order)
         return image_to_model(out, orig=model, is_previewing=is_previewing)
 
     return run_bandpass_filter
+
+
+def _run_butterworth(
+    img: ip.ImgArray | ip.LazyImgArray,
+    dimension: int,
+    cuton: float | None = None,
+    cutoff: float | None = None,
+    order: int = 2,
+) -> ip.ImgArray | ip.LazyImgArray:
+    """Run tiled Butterworth filter (lazily if the image is lazy)."""
+    axes = [img.axisof(a) for a in norm_dims(dimension, img.axes)]
+    out = butterworth_filter(img.value, axes, cuton=cuton, cutoff=cutoff, order=order)
+    return array_like(out, like=img)
@@ -1,5 +1,6 @@
 from typing import Annotated, Literal
 import impy as ip
+import numpy as np
 
 from himena import WidgetDataModel, Parametric
 from himena.consts import StandardType
@@ -7,11 +8,22 @@ from himena.plugins import register_function, configure_gui
 from himena.standards.model_meta import ImageMeta
 from himena_image.consts import PaddingMode
 from himena_image.utils import (
+    array_like,
     make_dims_annotation,
     model_to_image,
     image_to_model,
     norm_dims,
 )
+from himena_image.processing._fast_filters import (
+    fast_enhance_contrast,
+    fast_entropy,
+    fast_filter,
+    supports_fast_path,
+)
+from himena_image.processing._jobs import Job
+from himena_image.processing._kalman import kalman_filter_lazy, kalman_filter_stream
+from himena_image.processing._parallel import map_planes, map_planes_lazy
+from himena_image.processing._rolling_ball import rolling_ball_background
 
 MENUS = ["tools/image/process/filter", "/model_menu/process/filter"]
 
@@ -66,8 +78,8 @@ def median_filter(model: WidgetDataModel) -> Parametric:
         is_previewing: bool = False,
     ) -> WidgetDataModel:
         img = model_to_image(model, is_previewing)
-        out = img.median_filter(
-            radius, mode=mode, cval=cval, dims=norm_dims(dimension, img.axes)
+        out = _local_filter(
+            img, "median", radius, mode, cval, norm_dims(dimension, img.axes)
         )
         return image_to_model(out, orig=model, is_previewing=is_previewing)
 
@@ -94,8 +106,8 @@ def mean_filter(model: WidgetDataModel) -> Parametric:
         is_previewing: bool = False,
     ) -> WidgetDataModel:
         img = model_to_image(model, is_previewing)
-        out = img.mean_filter(
-            radius, mode=mode, cval=cval, dims=norm_dims(dimension, img.axes)
+        out = _local_filter(
+            img, "mean", radius, mode, cval, norm_dims(dimension, img.axes)
         )
         return image_to_model(out, orig=model, is_previewing=is_previewing)
 
@@ -122,8 +134,8 @@ def min_filter(model: WidgetDataModel) -> Parametric:
         is_previewing: bool = False,
     ) -> WidgetDataModel:
         img = model_to_image(model, is_previewing)
-        out = img.min_filter(
-            radius, mode=mode, cval=cval, dims=norm_dims(dimension, img.axes)
+        out = _local_filter(
+            img, "min", radius, mode, cval, norm_dims(dimension, img.axes)
         )
         return image_to_model(out, orig=model, is_previewing=is_previewing)
 
@@ -150,8 +162,8 @@ def max_filter(model: WidgetDataModel) -> Parametric:
         is_previewing: bool = False,
     ) -> WidgetDataModel:
         img = model_to_image(model, is_previewing)
-        out = img.max_filter(
-            radius, mode=mode, cval=cval, dims=norm_dims(dimension, img.axes)
+        out = _local_filter(
+            img, "max", radius, mode, cval, norm_dims(dimension, img.axes)
         )
         return image_to_model(out, orig=model, is_previewing=is_previewing)
 
@@ -178,8 +190,8 @@ def std_filter(model: WidgetDataModel) -> Parametric:
         is_previewing: bool = False,
     ) -> WidgetDataModel:
         img = model_to_image(model, is_previewing)
-        out = img.std_filter(
-            radius, mode=mode, cval=cval, dims=norm_dims(dimension, img.axes)
+        out = _local_filter(
+            img, "std", radius, mode, cval, norm_dims(dimension, img.axes)
         )
         return image_to_model(
             out, orig=model, is_previewing=is_previewing, reset_clim=True
@@ -208,8 +220,8 @@ def coef_filter(model: WidgetDataModel) -> Parametric:
         is_previewing: bool = False,
     ) -> WidgetDataModel:
         img = model_to_image(model, is_previewing)
-        out = img.coef_filter(
-            radius, mode=mode, cval=cval, dims=norm_dims(dimension, img.axes)
+        out = _local_filter(
+            img, "coef", radius, mode, cval, norm_dims(dimension, img.axes)
         )
         return image_to_model(
             out, orig=model, is_previewing=is_previewing, reset_clim=True
@@ -218,6 +230,35 @@ def coef_filter(model: WidgetDataModel) -> Parametric:
     return run_coef_filter
 
 
+def _local_filter(
+    img: ip.ImgArray,
+    kind: str,
+    radius: float,
+    mode: str,
+    cval: float,
+    dims: str,
+) -> ip.ImgArray:
+    """Apply the local filter of `kind`, using the fast path for large radii."""
+    if not supports_fast_path(kind, radius, img.dtype):
+        return getattr(img, f"{kind}_filter")(radius, mode=mode, cval=cval, dims=dims)
+
+    def _run(plane: ip.ImgArray):
+        return fast_filter(kind, plane.value, radius, mode, cval)
+
+    dtype = img.dtype if kind in ("mean", "median") else np.float32
+    return _map_planes(_run, img, dims, f"{kind.capitalize()} filter", dtype)
+
+
+def _map_planes(
+    func, img: ip.ImgArray | ip.LazyImgArray, dims: str, desc: str, dtype
+) -> ip.ImgArray | ip.LazyImgArray:
+    """Apply `func` to each plane, lazily if the image is lazy (such as in preview)."""
+    if isinstance(img, ip.LazyImgArray):
+        return map_planes_lazy(func, img, dims, dtype)
+    with Job(desc) as job:
+        return map_planes(func, img, dims, job=job)
+
+
 @register_function(
     title="Difference of Gaussian (DoG) Filter ...",
     menus=MENUS,
@@ -328,21 +369,33 @@ def log_filter(model: WidgetDataModel) -> Parametric:
 def rolling_ball(model: WidgetDataModel) -> Parametric:
     """Remove or create a background using the rolling-ball algorithm."""
 
-    @configure_gui(dimension={"choices": make_dims_annotation(model)})
+    @configure_gui(dimension={"choices": make_dims_annotation(model)}, preview=True)
     def run_rolling_ball(
         radius: Annotated[float, {"min": 0.0}] = 30.0,
         prefilter: Literal["mean", "median", "none"] = "mean",
         dimension: int = 2,
         return_background: bool = False,
+        accelerate: bool = False,
+        is_previewing: bool = False,
     ) -> WidgetDataModel:
-        img = model_to_image(model)
-        out = img.rolling_ball(
-            radius,
-            prefilter=prefilter,
-            return_bg=return_background,
-            dims=norm_dims(dimension, img.axes),
+        img = model_to_image(model, is_previewing)
+        dims = norm_dims(dimension, img.axes)
+
+        def _run(plane: ip.ImgArray):
+            if not accelerate:
+                return plane.rolling_ball(
+                    radius, prefilter=prefilter, return_bg=return_background, dims=dims
+                )
+            back = rolling_ball_background(plane.value, radius, prefilter)
+            if not return_background:
+                back = plane.value.astype(np.float32) - back
+            # same output dtype as impy
+            return ip.asarray(back, like=plane).as_img_type(plane.dtype)
+
+        out = _map_planes(_run, img, dims, "Rolling ball", img.dtype)
+        return image_to_model(
+            out, orig=model, is_previewing=is_previewing, reset_clim=True
         )
-        return image_to_model(out, orig=model, reset_clim=True)
 
     return run_rolling_ball
 
@@ -357,14 +410,28 @@ def rolling_ball(model: WidgetDataModel) -> Parametric:
 def entropy_filter(model: WidgetDataModel) -> Parametric:
     """Run entropy filter on an image."""
 
-    @configure_gui(dimension={"choices": make_dims_annotation(model)})
+    @configure_gui(dimension={"choices": make_dims_annotation(model)}, preview=True)
     def run_entropy(
         radius: Annotated[float, {"min": 0.0}] = 5.0,
         dimension: int = 2,
+        is_previewing: bool = False,
     ) -> WidgetDataModel:
-        img = model_to_image(model)
-        out = img.entropy_filter(radius, dims=norm_dims(dimension, img.axes))
-        return image_to_model(out, orig=model, reset_clim=True)
+        img = model_to_image(model, is_previewing)
+        dims = norm_dims(dimension, img.axes)
+        n_bins = 2 if img.dtype == bool else 256
+        if img.dtype == np.uint16:
+            # same as impy, which uses the upper 8 bits
+            img = array_like(img.value // 256, img)
+        elif img.dtype not in (np.uint8, bool):
+            img = _float_to_ubyte(img)
+
+        def _run(plane: ip.ImgArray):
+            return fast_entropy(plane.value, radius, n_bins)
+
+        out = _map_planes(_run, img, dims, "Entropy filter", np.float32)
+        return image_to_model(
+            out, orig=model, is_previewing=is_previewing, reset_clim=True
+        )
 
     return run_entropy
 
@@ -379,18 +446,49 @@ def entropy_filter(model: WidgetDataModel) -> Parametric:
 def enhance_contrast(model: WidgetDataModel) -> Parametric:
     """Run enhance-contrast filter on an image."""
 
-    @configure_gui(dimension={"choices": make_dims_annotation(model)})
+    @configure_gui(dimension={"choices": make_dims_annotation(model)}, preview=True)
     def run_enhance_contrast(
         radius: Annotated[float, {"min": 0.0}] = 1.0,
         dimension: int = 2,
+        is_previewing: bool = False,
     ) -> WidgetDataModel:
-        img = model_to_image(model)
-        out = img.enhance_contrast(radius, dims=norm_dims(dimension, img.axes))
-        return image_to_model(out, orig=model)
+        img = model_to_image(model, is_previewing)
+        dims = norm_dims(dimension, img.axes)
+        if img.dtype.kind == "f":
+            # same as the rank filter, which works on 8-bit images normalized with
+            # the range of the whole image, not of each plane
+            img = _float_to_ubyte(img)
+
+        def _run(plane: ip.ImgArray):
+            return fast_enhance_contrast(plane.value, radius)
+
+        out = _map_planes(_run, img, dims, "Enhance contrast", img.dtype)
+        return image_to_model(out, orig=model, is_previewing=is_previewing)
 
     return run_enhance_contrast
 
 
+def _float_to_ubyte(
+    img: ip.ImgArray | ip.LazyImgArray,
+) -> ip.ImgArray | ip.LazyImgArray:
+    """Quantize an image into 256 bins over the range of the whole image."""
+    arr = img.value.astype(np.float32)
+    if isinstance(img, ip.LazyImgArray):
+        import dask
+
+        vmin, vmax = (float(v) for v in dask.compute(arr.min(), arr.max()))
+    else:
+        vmin, vmax = float(arr.min()), float(arr.max())
+    scale = 256 / (vmax - vmin) if vmax > vmin else 0.0
+
+    def _convert(block):
+        return np.minimum((block - vmin) * scale, 255).astype(np.uint8)
+
+    if isinstance(img, ip.LazyImgArray):
+        return array_like(arr.map_blocks(_convert, dtype=np.uint8), img)
+    return ip.asarray(_convert(arr), like=img)
+
+
 @register_function(
     title="Threshold ...",
     menus=MENUS,
@@ -527,13 +625,25 @@ def kalman_filter(model: WidgetDataModel) -> Parametric:
         noise_var: Annotated[float, {"min": 0.0}] = 0.1,
         along: str = along_default,
         dimension: int = 2,
+        is_previewing: bool = False,
     ) -> WidgetDataModel:
-        out = model_to_image(model).kalman_filter(
-            gain=gain,
-            noise_var=noise_var,
-            dims=norm_dims(dimension, img.axes),
-            along=along,
-        )
-        return image_to_model(out, orig=model)
+        # the filter is pixel-wise, so `dimension` does not change the result
+        img = model_to_image(model, is_previewing)
+        t_axis = [str(a) for a in img.axes].index(along)
+        if isinstance(img, ip.LazyImgArray):
+            lazy = kalman_filter_lazy(img.value, t_axis, gain, noise_var)
+            out = array_like(lazy, img)
+        else:
+            frames = np.moveaxis(img.value, t_axis, 0)
+            filtered = np.empty(frames.shape, dtype=np.float32)
+            with Job("Kalman filter", total=frames.shape[0]) as job:
+                stream = kalman_filter_stream(frames, gain, noise_var)
+                for i, estimate in enumerate(stream):
+                    filtered[i] = estimate
+                    job.advance()
+            out = ip.asarray(np.moveaxis(filtered, 0, t_axis), like=img)
+        # same output dtype as impy
+        out = out.as_img_type(img.dtype)
+        return image_to_model(out, orig=model, is_previewing=is_previewing)
 
     return run_kalman_filter
@@ -15,6 +15,8 @@ from himena.data_wrappers import wrap_array, ArrayWrapper
 from himena.widgets import SubWindow
 from himena_builtins.qt.image import QImageView
 from himena_builtins.qt.basic import QDictView
+from himena_image._roi_index import get_roi_index
+from himena_image.processing._jobs import Job, JobCancelled
 
 MENUS = ["tools/image/analyze", "/model_menu/analyze"]
 
@@ -154,51 +156,89 @@ def roi_measure(model: WidgetDataModel) -> Parametric:
         for along_i in along:
             axis_name = axis_names[along_i]
             out[axis_name] = []
-        if pivot:
-            # initialize result dict
-            for metric in metrics:
-                for each_roi in rois:
-                    out[f"{metric}_{each_roi.name}"] = []
-            for sl in np.ndindex(ndindex_shape):
-                for sl_i, axis_name in zip(sl, axis_names):
-                    out[axis_name].append(sl_i)
-                for indices, each_roi in rois.iter_with_indices():
-                    target = _prep_sliced_array(arr, each_roi, sl, along, indices)
-                    for func, metric in zip(funcs, metrics):
-                        out[f"{metric}_{each_roi.name}"].append(func(each_roi, target))
-        else:
-            out["name"] = []
-            for metric in metrics:
-                out[metric] = []
-            for sl in np.ndindex(ndindex_shape):
-                for indices, each_roi in rois.iter_with_indices():
-                    target = _prep_sliced_array(arr, each_roi, sl, along, indices)
-                    out["name"].append(each_roi.name)
-                    for sl_i, axis_name in zip(sl, axis_names):
-                        out[axis_name].append(sl_i)
-                    for func, metric in zip(funcs, metrics):
-                        out[metric].append(func(each_roi, target))
+        title = f"Results of {model.title}"
+        try:
+            with Job("Measuring ROIs", total=int(np.prod(ndindex_shape))) as job:
+                _measure_all(
+                    out, arr, rois, funcs, metrics, along, axis_names, pivot, job
+                )
+        except JobCancelled:
+            # rows of the finished slices are complete
+            title = f"{title} (cancelled)"
         return WidgetDataModel(
             value=out,
             type=StandardType.DATAFRAME,
-            title=f"Results of {model.title}",
+            title=title,
         )
 
     return run_measure
 
 
-def _prep_sliced_array(
+def _measure_all(
+    out: dict[str, list],
+    arr: ArrayWrapper,
+    rois: roi.RoiListModel,
+    funcs: list[Callable],
+    metrics: list[str],
+    along: list[int],
+    axis_names: list[str],
+    pivot: bool,
+    job: Job,
+) -> None:
+    """Measure all the ROIs for each slice and append the results to `out`."""
+    ndindex_shape = tuple(arr.shape[i] for i in along)
+    groups = list(get_roi_index(rois).groups())
+    if pivot:
+        # initialize result dict
+        for metric in metrics:
+            for each_roi in rois:
+                out[f"{metric}_{each_roi.name}"] = []
+        for sl in np.ndindex(ndindex_shape):
+            targets = _prep_sliced_arrays(arr, rois, groups, sl, along)
+            for sl_i, axis_name in zip(sl, axis_names):
+                out[axis_name].append(sl_i)
+            for each_roi, target in zip(rois, targets):
+                for func, metric in zip(funcs, metrics):
+                    out[f"{metric}_{each_roi.name}"].append(func(each_roi, target))
+            job.advance()
+    else:
+        out["name"] = []
+        for metric in metrics:
+            out[metric] = []
+        for sl in np.ndindex(ndindex_shape):
+            targets = _prep_sliced_arrays(arr, rois, groups, sl, along)
+            for each_roi, target in zip(rois, targets):
+                out["name"].append(each_roi.name)
+                for sl_i, axis_name in zip(sl, axis_names):
+                    out[axis_name].append(sl_i)
+                for func, metric in zip(funcs, metrics):
+                    out[metric].append(func(each_roi, target))
+            job.advance()
+
+
+def _prep_sliced_arrays(
     arr: ArrayWrapper,
-    each_roi: roi.RoiModel,
+    rois: roi.RoiListModel,
+    groups: list[tuple[tuple[int, ...], NDArray[np.intp]]],
     sl: tuple[int, ...],
     along: list[int],
-    indices: list[int],
-):
-    sl_placeholder = list(indices)
-    for i, along_i in enumerate(along):
-        sl_placeholder[along_i] = sl[i]
-    arr_slice = arr.get_slice(tuple(sl_placeholder))
-    return slice_array(each_roi, arr_slice)
+) -> list[NDArray[np.number]]:
+    """Sliced arrays of all the ROIs, reading each image plane only once.
+
+    `groups` are the ROI positions grouped by their indices (see `RoiIndex.groups`).
+    """
+    plane_members: dict[tuple[int, ...], list[NDArray[np.intp]]] = {}
+    for indices, members in groups:
+        sl_placeholder = list(indices)
+        for i, along_i in enumerate(along):
+            sl_placeholder[along_i] = sl[i]
+        plane_members.setdefault(tuple(sl_placeholder), []).append(members)
+    targets: list[NDArray[np.number]] = [None] * len(rois)
+    for plane_key, members_list in plane_members.items():
+        arr_slice = arr.get_slice(plane_key)
+        for i in np.concatenate(members_list):
+            targets[i] = slice_array(rois[i], arr_slice)
+    return targets
 
 
 @singledispatch
@@ -10,6 +10,8 @@ from himena_image.utils import (
     model_to_image,
     norm_dims,
 )
+from himena_image.processing._jobs import Job
+from himena_image.processing._parallel import map_planes
 
 MENUS = ["tools/image/process/morphology", "/model_menu/process/morphology"]
 
@@ -160,7 +162,14 @@ def skeletonize(model: WidgetDataModel) -> Parametric:
         is_previewing: bool = False,
     ) -> WidgetDataModel:
         img = model_to_image(model, is_previewing)
-        out = img.skeletonize(radius=radius, dims=norm_dims(dimension, img.axes))
+        dims = norm_dims(dimension, img.axes)
+        with Job("Skeletonize") as job:
+            out = map_planes(
+                lambda plane: plane.skeletonize(radius=radius, dims=dims),
+                img,
+                dims,
+                job=job,
+            )
         return image_to_model(out, orig=model, is_previewing=is_previewing)
 
     return run_skeletonize
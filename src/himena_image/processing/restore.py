@@ -1,13 +1,31 @@
+from __future__ import annotations
+
+import threading
+import impy as ip
+import numpy as np
+from numpy.typing import NDArray
+from scipy import ndimage as ndi
+
 from himena import WidgetDataModel, Parametric
 from himena.consts import StandardType
 from himena.plugins import register_function, configure_gui
 from himena_image.consts import PaddingMode, InterpolationOrder
 from himena_image.utils import (
+    array_like,
     make_dims_annotation,
     image_to_model,
     model_to_image,
     norm_dims,
 )
+from himena_image.processing._deconv import (
+    crop_psf,
+    richardson_lucy,
+    richardson_lucy_tiled,
+    tile_layout,
+)
+from himena_image.processing._drift import shift_frames_lazy, track_drift_streaming
+from himena_image.processing._jobs import Job
+from himena_image.processing._parallel import map_planes
 
 MENUS = ["tools/image/process/restore", "/model_menu/process/restore"]
 
@@ -33,17 +51,26 @@ def track_drift(model: WidgetDataModel) -> Parametric:
         along: str,
         max_shift: float | None = None,
         upsample_factor: int = 10,
+        dimension: int = 2,
     ) -> WidgetDataModel:
         img = model_to_image(model)
-        out = img.track_drift(
-            along=along,
-            upsample_factor=upsample_factor,
-            max_shift=max_shift,
-        )
-
+        dims = norm_dims(dimension, img.axes)
+        with Job("Tracking drift") as job:
+            shifts = _track_drift_all(
+                img, along, dims, max_shift, job, upsample_factor=upsample_factor
+            )
+        ref_axes = [str(a) for a in img.axes if a not in [along, *dims]]
+        df: dict[str, list] = {a: [] for a in [*ref_axes, along, *dims]}
+        for idx, shift in shifts.items():
+            for a, i in zip(ref_axes, idx):
+                df[a].append(np.full(shift.shape[0], i))
+            df[along].append(np.arange(shift.shape[0]))
+            for i, a in enumerate(dims):
+                df[a].append(shift[:, i])
         return WidgetDataModel(
-            value=out,
+            value={k: np.concatenate(v) for k, v in df.items()},
             type=StandardType.DATAFRAME,
+            title=f"Drift of {model.title}",
         )
 
     return run_track_drift
@@ -64,11 +91,13 @@ def drift_correction(model: WidgetDataModel) -> Parametric:
 
     @configure_gui(
         along={"choices": along_choices, "value": along_default},
+        shift_table={"types": [StandardType.DATAFRAME]},
         dimension={"choices": make_dims_annotation(model)},
     )
     def run_drift_correction(
         along: str,
         reference: str = "",
+        shift_table: WidgetDataModel | None = None,
         zero_ave: bool = True,
         max_shift: float | None = None,
         order: InterpolationOrder = 1,
@@ -77,19 +106,106 @@ def drift_correction(model: WidgetDataModel) -> Parametric:
         dimension: int = 2,
     ) -> WidgetDataModel:
         img = model_to_image(model)
-        out = img.drift_correction(
-            ref=reference or None,
-            zero_ave=zero_ave,
-            along=along,
+        dims = norm_dims(dimension, img.axes)
+        with Job("Drift correction") as job:
+            if shift_table is None:
+                ref = img[reference] if reference else img
+                shifts = _track_drift_all(ref, along, dims, max_shift, job)
+                key_axes = [str(a) for a in ref.axes if a not in [along, *dims]]
+            else:
+                key_axes, shifts = _shifts_from_table(shift_table.value, along, dims)
+                if unknown := [a for a in key_axes if a not in img.axes]:
+                    raise ValueError(
+                        f"Shift table has column(s) {unknown!r} that are not the axes "
+                        f"of the image {img.axes!r}."
+                    )
+            if zero_ave:
+                shifts = {k: v - v.mean(axis=0) for k, v in shifts.items()}
+
+            def _shift_of(index: dict[str, int]) -> NDArray[np.float32]:
+                return shifts[tuple(index[a] for a in key_axes)][index[along]]
+
+            if isinstance(img, ip.LazyImgArray):
+                # frames are only shifted when they are computed
+                arr = shift_frames_lazy(
+                    img.value,
+                    img.axes,
+                    dims,
+                    _shift_of,
+                    order=order,
+                    mode=mode,
+                    cval=cval,
+                )
+                return image_to_model(array_like(arr, img), orig=model)
+
+            def _correct(plane: ip.ImgArray, index: dict[str, int]):
+                return ndi.shift(
+                    plane.value, _shift_of(index), order=order, mode=mode, cval=cval
+                )
+
+            out = map_planes(_correct, img.as_float(), dims, job=job, with_index=True)
+        # same output dtype as impy
+        return image_to_model(out.as_img_type(img.dtype), orig=model)
+
+    return run_drift_correction
+
+
+def _track_drift_all(
+    ref: ip.ImgArray,
+    along: str,
+    dims: str,
+    max_shift: float | None,
+    job: Job,
+    upsample_factor: int = 10,
+) -> dict[tuple[int, ...], NDArray[np.float32]]:
+    """Track drift of each (along, *dims) sub-image of the reference.
+
+    Returns a dict from the indices of the other axes of `ref` to the (N, ndim) shift.
+    """
+    axes = [str(a) for a in ref.axes]
+    ref_axes = [a for a in axes if a not in [along, *dims]]
+    ref_shape = tuple(ref.sizeof(a) for a in ref_axes)
+    sub_axes = [a for a in axes if a not in ref_axes]
+    shifts = {}
+    for idx in np.ndindex(ref_shape):
+        sl = tuple(idx[ref_axes.index(a)] if a in ref_axes else slice(None) for a in axes)  # fmt: skip
+        shifts[idx] = track_drift_streaming(
+            ref.value[sl],
+            sub_axes.index(along),
+            upsample_factor=upsample_factor,
             max_shift=max_shift,
-            mode=mode,
-            cval=cval,
-            order=order,
-            dims=norm_dims(dimension, img.axes),
+            job=job,
         )
-        return image_to_model(out, orig=model)
+    return shifts
 
-    return run_drift_correction
+
+def _shifts_from_table(
+    table,
+    along: str,
+    dims: str,
+) -> tuple[list[str], dict[tuple[int, ...], NDArray[np.float32]]]:
+    """Read the shifts from a table returned by the "Track drift" command.
+
+    Columns other than `along` and `dims` are the indices of the other axes, so that
+    the table of each channel (for example) is used for the same channel.
+    """
+    columns = {str(k): np.asarray(v) for k, v in table.items()}
+    missing = [a for a in [along, *dims] if a not in columns]
+    if missing:
+        raise ValueError(f"Shift table does not have the column(s) {missing!r}.")
+    key_axes = [k for k in columns if k not in [along, *dims]]
+    frame = columns[along].astype(np.int64)
+    values = np.stack([columns[a] for a in dims], axis=1).astype(np.float32)
+    keys = list(zip(*[columns[a].astype(np.int64).tolist() for a in key_axes]))
+    rows: dict[tuple[int, ...], list[int]] = {}
+    for row, key in enumerate(keys or [()] * frame.size):
+        rows.setdefault(key, []).append(row)
+    shifts = {}
+    for key, sel in rows.items():
+        shift = np.zeros((frame[sel].max() + 1, len(dims)), dtype=np.float32)
+        shift[frame[sel]] = values[sel]
+        shifts[key] = shift
+    return key_axes, shifts
 
 
 def _along_default_and_choices(axes) -> tuple[str, list[str]]:
@@ -123,9 +239,20 @@ def lucy(model: WidgetDataModel) -> Parametric:
         niter: int = 50,
         dimension: int = 2,
         eps: float = 1e-5,
+        accelerate: bool = False,
+        block_size: int | None = None,
     ) -> WidgetDataModel:
         img = model_to_image(model)
-        out = img.lucy(psf, niter=niter, eps=eps, dims=norm_dims(dimension, img.axes))
+        out = _deconvolve(
+            img,
+            psf,
+            norm_dims(dimension, img.axes),
+            "Richardson-Lucy deconvolution",
+            niter=niter,
+            block_size=block_size,
+            eps=eps,
+            accelerate=accelerate,
+        )
         return image_to_model(out, orig=model)
 
     return run_lucy
@@ -154,16 +281,73 @@ def lucy_tv(model: WidgetDataModel) -> Parametric:
         lmd: float = 1.0,
         tol: float = 1e-3,
         eps: float = 1e-5,
+        accelerate: bool = False,
+        block_size: int | None = None,
     ) -> WidgetDataModel:
         img = model_to_image(model)
-        out = img.lucy_tv(
+        out = _deconvolve(
+            img,
             psf,
+            norm_dims(dimension, img.axes),
+            "Richardson-Lucy TV deconvolution",
             niter=niter,
+            block_size=block_size,
+            eps=eps,
             lmd=lmd,
             tol=tol,
-            eps=eps,
-            dims=norm_dims(dimension, img.axes),
+            accelerate=accelerate,
         )
         return image_to_model(out, orig=model)
 
     return run_lucy_tv
+
+
+def _deconvolve(
+    img: ip.ImgArray,
+    psf: WidgetDataModel,
+    dims: str,
+    desc: str,
+    niter: int,
+    block_size: int | None = None,
+    **kwargs,
+) -> ip.ImgArray:
+    """Deconvolve each plane of the image in parallel, reporting each iteration.
+
+    If `block_size` is given, each plane is deconvolved tile by tile, and the tiles
+    are processed in parallel instead of the planes.
+    """
+    psf_arr = np.asarray(psf.value, dtype=np.float32)
+    nplanes = int(np.prod([img.sizeof(a) for a in img.axes if str(a) not in dims]))
+    # number of iterations reported for each plane
+    nsteps = niter
+    if block_size:
+        shape = tuple(img.sizeof(a) for a in dims)
+        layout = tile_layout(shape, crop_psf(psf_arr).shape, block_size)
+        nsteps *= len(list(layout.iter_tiles()))
+    with Job(desc, total=nplanes * nsteps) as job:
+
+        def _run(plane: ip.ImgArray) -> NDArray[np.float32]:
+            lock = threading.Lock()
+            n_done = 0
+
+            def _report(change: float):
+                nonlocal n_done
+                with lock:
+                    n_done += 1
+                job.advance(info=f"relative change: {change:.2e}")
+
+            if block_size:
+                out = richardson_lucy_tiled(
+                    plane.value, psf_arr, block_size, niter, callback=_report, **kwargs
+                )
+            else:
+                out = richardson_lucy(
+                    plane.value, psf_arr, niter, callback=_report, **kwargs
+                )
+            # iterations skipped by the early stop
+            job.advance(nsteps - n_done)
+            return out
+
+        # the job is not passed to `map_planes` because the iterations are the units
+        # of work; cancelling it still stops the remaining planes via `advance`
+        return map_planes(_run, img, dims, num_workers=1 if block_size else None)
@@ -80,6 +80,18 @@ def label_to_model(
     return out
 
 
+def array_like(
+    arr,
+    like: ip.ImgArray | ip.LazyImgArray,
+) -> ip.ImgArray | ip.LazyImgArray:
+    """Convert a numpy or dask array to impy array with the axes of `like`."""
+    import dask.array as da
+
+    if isinstance(arr, da.Array):
+        return ip.lazy.asarray(arr, like=like, chunks=arr.chunksize)
+    return ip.asarray(arr, like=like)
+
+
 def make_dims_annotation(model: WidgetDataModel) -> list[tuple[str, int]]:
     if not isinstance(meta := model.metadata, ImageMeta):
         return [("2 (yx)", 2)]
@@ -24,3 +24,954 @@ def test_filter(make_himena_ui, image_data, command: str):
         model_context=win.to_model(),
         with_params={},
     )
+
+
+@pytest.mark.parametrize("kind", ["median", "mean", "min", "max", "std", "coef"])
+@pytest.mark.parametrize("radius", [4.0, 5.5])
+def test_large_radius_filter(make_himena_ui, image_data, kind: str, radius: float):
+    import numpy as np
+    import impy as ip
+
+    ui: MainWindow = make_himena_ui(backend="mock")
+    arr = np.random.default_rng(0).integers(1, 1000, size=(2, 30, 40)).astype(np.uint16)
+    image_data.value = arr
+    image_data.metadata.axes = image_data.metadata.axes[2:]
+    image_data.metadata.channel_axis = None
+    win = ui.add_data_model(image_data)
+    ui.exec_action(
+        f"himena-image:{kind}-filter",
+        model_context=win.to_model(),
+        with_params={"radius": radius, "mode": "nearest"},
+    )
+    out = ui.current_model.value
+    ref = getattr(ip.asarray(arr, axes="cyx"), f"{kind}_filter")(
+        radius, mode="nearest", dims="yx"
+    )
+    assert out.dtype == ref.dtype
+    assert np.allclose(out, ref, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("accelerate", [False, True])
+@pytest.mark.parametrize("dtype", ["float32", "uint16"])
+def test_rolling_ball(make_himena_ui, image_data, accelerate: bool, dtype: str):
+    import numpy as np
+    import impy as ip
+
+    ui: MainWindow = make_himena_ui(backend="mock")
+    yy, xx = np.mgrid[:64, :64]
+    arr = np.stack([100 + 20 * np.sin(yy / 10 + i) + xx / 4 for i in range(2)])
+    arr[:, 20:24, 30:34] += 100
+    arr = arr.astype(dtype)
+    image_data.value = arr
+    image_data.metadata.axes = image_data.metadata.axes[2:]
+    image_data.metadata.channel_axis = None
+    win = ui.add_data_model(image_data)
+    ref = ip.asarray(arr, axes="cyx").rolling_ball(20.0, return_bg=True, dims="yx")
+    outputs = []
+    for is_previewing in [False, True]:
+        ui.exec_action(
+            "himena-image:rolling-ball",
+            model_context=win.to_model(),
+            with_params={
+                "radius": 20.0,
+                "return_background": True,
+                "accelerate": accelerate,
+                "is_previewing": is_previewing,
+            },
+        )
+        out = np.asarray(ui.current_model.value)
+        assert out.dtype == ref.dtype
+        assert np.allclose(out, ref, atol=2.0 if accelerate else 1e-4)
+        outputs.append(out)
+    assert np.array_equal(outputs[0], outputs[1])
+
+
+@pytest.mark.parametrize("dimension", [2, 3])
+@pytest.mark.parametrize("dtype", ["uint8", "uint16"])
+def test_entropy_and_enhance_contrast(
+    make_himena_ui, image_data, dimension: int, dtype: str
+):
+    import numpy as np
+    import impy as ip
+
+    ui: MainWindow = make_himena_ui(backend="mock")
+    high = 256 if dtype == "uint8" else 65536
+    arr = np.random.default_rng(0).integers(0, high, size=(2, 5, 30, 40)).astype(dtype)
+    image_data.value = arr
+    t, z, _, y, x = image_data.metadata.axes
+    image_data.metadata.axes = [t, z, y, x]
+    image_data.metadata.channel_axis = None
+    win = ui.add_data_model(image_data)
+    img = ip.asarray(arr, axes="tzyx")
+    dims = "zyx" if dimension == 3 else "yx"
+    for command, radius, ref in [
+        ("entropy-filter", 3.5, img.entropy_filter(3.5, dims=dims)),
+        ("enhance-contrast", 2.0, img.enhance_contrast(2.0, dims=dims)),
+    ]:
+        for is_previewing in [False, True]:
+            ui.exec_action(
+                f"himena-image:{command}",
+                model_context=win.to_model(),
+                with_params={
+                    "radius": radius,
+                    "dimension": dimension,
+                    "is_previewing": is_previewing,
+                },
+            )
+            out = np.asarray(ui.current_model.value)
+            assert out.dtype == ref.dtype
+            assert np.allclose(out, ref, atol=1e-5)
+
+
+def test_entropy_and_enhance_contrast_float(make_himena_ui, image_data):
+    import numpy as np
+    from skimage.filters.rank import enhance_contrast, entropy
+    from impy.arrays._utils._structures import ball_like
+
+    ui: MainWindow = make_himena_ui(backend="mock")
+    # negative values and an offset, quantized over the range of the whole image
+    arr = np.random.default_rng(0).normal(3.0, 2.0, size=(2, 30, 40))
+    arr[1] -= 8.0
+    image_data.value = arr.astype(np.float32)
+    image_data.metadata.axes = image_data.metadata.axes[2:]
+    image_data.metadata.channel_axis = None
+    win = ui.add_data_model(image_data)
+    lo, hi = image_data.value.min(), image_data.value.max()
+    quantized = np.minimum((image_data.value - lo) * (256 / (hi - lo)), 255)
+    quantized = quantized.astype(np.uint8)
+    footprint = ball_like(3.0, 2)
+    for command, func in [
+        ("entropy-filter", entropy),
+        ("enhance-contrast", enhance_contrast),
+    ]:
+        ui.exec_action(
+            f"himena-image:{command}",
+            model_context=win.to_model(),
+            with_params={"radius": 3.0},
+        )
+        ref = np.stack([func(q, footprint) for q in quantized])
+        assert np.allclose(ui.current_model.value, ref, atol=1e-5)
+
+
+@pytest.mark.parametrize("method", ["mean", "median", "max", "min", "sum", "std"])
+def test_projection(make_himena_ui, image_data, method: str):
+    import numpy as np
+
+    ui: MainWindow = make_himena_ui(backend="mock")
+    win = ui.add_data_model(image_data)
+    ui.exec_action(
+        "himena-image:projection",
+        model_context=win.to_model(),
+        with_params={"axis": ["t"], "method": method},
+    )
+    ui.exec_action(
+        "himena-image:projection",
+        model_context=win.to_model(),
+        with_params={"axis": ["t"], "method": method, "start": 1, "stop": 3},
+    )
+    assert ui.current_model.value.shape == (5, 2, 6, 5)
+    ref = getattr(np, method)(image_data.value[1:3], axis=0)
+    assert np.allclose(ui.current_model.value, ref, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize("method", ["mean", "median", "max", "min", "sum", "std"])
+@pytest.mark.parametrize("lazy", [False, True])
+@pytest.mark.parametrize("nframes", [50, 51])
+def test_project_chunked(method: str, lazy: bool, nframes: int):
+    import numpy as np
+    import dask.array as da
+    from himena_image.processing._projection import project_chunked
+
+    arr = np.random.default_rng(0).integers(0, 256, size=(nframes, 6, 7))
+    arr = arr.astype(np.uint8)
+    arr[:, 0, 0] = [0] + [255] * (nframes - 1)  # median equal to the maximum
+    value = da.from_array(arr, chunks=(5, 6, 7)) if lazy else arr
+    # read 10 frames at once, so that the median is calculated by the histogram
+    kwargs = {"max_slab_nbytes": arr[0].nbytes * 10}
+    for frame_range, ref_arr in [(None, arr), ((3, 47), arr[3:47])]:
+        out = project_chunked(value, [0], method, frame_range=frame_range, **kwargs)
+        ref = getattr(np, method)(ref_arr, axis=0)
+        assert np.allclose(out, ref, rtol=1e-5, atol=1e-5)
+    out = project_chunked(value, [0, 1], method, **kwargs)
+    assert np.allclose(out, getattr(np, method)(arr, axis=(0, 1)), rtol=1e-5)
+
+
+@pytest.mark.parametrize("nframes", [30, 31])
+def test_project_chunked_median_float(nframes: int):
+    import numpy as np
+    from himena_image.processing._projection import project_chunked
+
+    rng = np.random.default_rng(0)
+    arr = rng.normal(size=(nframes, 6, 7)).astype(np.float32)
+    arr[:, 0, 0] = 1.5  # all the values in one bin
+    arr[:, 0, 1] = np.arange(nframes) // 2  # ties around the middle
+    out = project_chunked(arr, [0], "median", max_slab_nbytes=arr[0].nbytes * 4)
+    ref = np.median(arr, axis=0)
+    span = arr.max(axis=0) - arr.min(axis=0)
+    assert np.all(np.abs(out - ref) <= span / 32**2 + 1e-6)
+    assert out[0, 0] == 1.5
+    assert out[0, 1] == ref[0, 1]
+
+@pytest.mark.parametrize("method", ["mean", "max", "min", "sum"])
+def test_running_projection(make_himena_ui, image_data, method: str):
+    import numpy as np
+
+    ui: MainWindow = make_himena_ui(backend="mock")
+    win = ui.add_data_model(image_data)
+    ui.exec_action(
+        "himena-image:running-projection",
+        model_context=win.to_model(),
+        with_params={"axis": "t", "window": 2, "method": method},
+    )
+    assert ui.current_model.value.shape == (3, 5, 2, 6, 5)
+    windows = np.lib.stride_tricks.sliding_window_view(image_data.value, 2, axis=0)
+    ref = getattr(np, method)(windows, axis=-1)
+    assert np.allclose(ui.current_model.value, ref, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize("method", ["mean", "max", "min", "sum"])
+@pytest.mark.parametrize("lazy", [False, True])
+@pytest.mark.parametrize("window", [1, 3, 7, 20])
+def test_running_projection_values(method: str, lazy: bool, window: int):
+    import numpy as np
+    import dask.array as da
+    from himena_image.processing._projection import running_projection
+
+    arr = np.random.default_rng(0).integers(0, 1000, size=(6, 20, 7)).astype(np.uint16)
+    # chunks that are not aligned with the window
+    value = da.from_array(arr, chunks=(3, 6, 7)) if lazy else arr
+    out = running_projection(value, 1, window, method)
+    assert isinstance(out, da.Array) == lazy
+    windows = np.lib.stride_tricks.sliding_window_view(arr, window, axis=1)
+    ref = getattr(np, method)(windows, axis=-1)
+    assert out.shape == ref.shape
+    assert np.allclose(np.asarray(out), ref, rtol=1e-5)
+
+
+@pytest.mark.parametrize(
+    "command",
+    [
+        "himena-image:lowpass-filter",
+        "himena-image:highpass-filter",
+        "himena-image:bandpass-filter",
+    ],
+)
+def test_fft_filter(make_himena_ui, image_data, command: str):
+    ui: MainWindow = make_himena_ui(backend="mock")
+    win = ui.add_data_model(image_data)
+    ui.exec_action(command, model_context=win.to_model(), with_params={})
+    assert ui.current_model.value.shape == image_data.value.shape
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+@pytest.mark.parametrize("tile_size", [None, 48])
+def test_butterworth_filter(lazy: bool, tile_size):
+    import numpy as np
+    import dask.array as da
+    import impy as ip
+    from scipy import ndimage as ndi
+    from himena_image.processing._fft import butterworth_filter
+
+    rng = np.random.default_rng(0)
+    arr = ndi.gaussian_filter(rng.normal(size=(2, 160, 170)), 1).astype(np.float32)
+    img = ip.asarray(arr, axes="tyx")
+    value = da.from_array(arr, chunks=(1, 160, 170)) if lazy else arr
+    if tile_size is None:
+        # filtered at once, same as impy
+        interior = (slice(None),) * 3
+    else:
+        # the boundary of tiles is reflected, not wrapped as in impy
+        interior = (slice(None), slice(30, -30), slice(30, -30))
+    for kwargs, ref in [
+        ({"cutoff": 0.2}, img.lowpass_filter(0.2, dims="yx")),
+        ({"cuton": 0.2}, img.highpass_filter(0.2, dims="yx")),
+        ({"cutoff": 0.0}, img),
+        ({"cutoff": 1e-6}, img.lowpass_filter(1e-6, dims="yx")),
+    ]:
+        out = butterworth_filter(value, [1, 2], tile_size=tile_size, **kwargs)
+        assert isinstance(out, da.Array) == lazy
+        assert np.allclose(np.asarray(out)[interior], ref[interior], atol=1e-4)
+
+
+def test_fft_backend(monkeypatch):
+    import numpy as np
+    import scipy.fft
+    from himena_image._config import HimenaImageConfig
+    from himena_image.processing import _fft
+
+    for name, mod in [("numpy", np.fft), ("scipy", scipy.fft)]:
+        cfg = HimenaImageConfig(fft_backend=name)
+        monkeypatch.setattr(_fft, "get_image_config", lambda: cfg)
+        backend = _fft.get_fft_backend()
+        assert backend.name == name
+        assert backend._mod is mod
+        assert _fft.get_fft_backend() is backend
+        assert _fft.get_fft_backend(name, 1) is backend
+    with pytest.raises(ValueError):
+        _fft.get_fft_backend("xxx")
+    try:
+        import pyfftw  # noqa: F401
+    except ImportError:
+        with pytest.warns(UserWarning):
+            assert _fft.FFTBackend("pyfftw").name == "scipy"
+    arr = np.random.default_rng(0).normal(size=(6, 8))
+    for name in ["numpy", "scipy"]:
+        fft = _fft.get_fft_backend(name, 2)
+        assert np.allclose(fft.irfftn(fft.rfftn(arr), s=arr.shape), arr)
+
+
+def test_filter_weight_cache():
+    import numpy as np
+    from himena_image.processing._fft import butterworth_weight, filter_weight
+
+    weight = filter_weight((16, 20), 0.05, 0.3, 2)
+    assert filter_weight((16, 20), 0.05, 0.3, 2) is weight
+    assert filter_weight((16, 20), 0.05, 0.2, 2) is not weight
+    assert not weight.flags.writeable
+    assert weight.shape == (16, 11)
+    expected = butterworth_weight((16, 20), (0.3, 0.3), 2, False) * butterworth_weight(
+        (16, 20), (0.05, 0.05), 2, True
+    )
+    assert np.allclose(weight, expected)
+    assert np.allclose(filter_weight((16, 20), None, None, 2), 1)
+
+@pytest.mark.parametrize("half_spectrum", [False, True])
+def test_power_spectrum(make_himena_ui, image_data, half_spectrum: bool):
+    ui: MainWindow = make_himena_ui(backend="mock")
+    win = ui.add_data_model(image_data)
+    ui.exec_action(
+        "himena-image:power-spectrum",
+        model_context=win.to_model(),
+        with_params={"half_spectrum": half_spectrum},
+    )
+    nx = 3 if half_spectrum else 5
+    assert ui.current_model.value.shape == (4, 5, 2, 6, nx)
+
+
+@pytest.mark.parametrize("shift", [True, False])
+@pytest.mark.parametrize("norm", [True, False])
+@pytest.mark.parametrize("zero_norm", [True, False])
+def test_power_spectrum_values(shift: bool, norm: bool, zero_norm: bool):
+    import numpy as np
+    import impy as ip
+    from himena_image.processing._fft import power_spectrum
+
+    rng = np.random.default_rng(0)
+    arr = rng.normal(size=(2, 9, 12)).astype(np.float32) + 1
+    ref = ip.asarray(arr, axes="tyx").power_spectra(
+        norm=norm, zero_norm=zero_norm, shift=shift, dims="yx"
+    )
+    out = power_spectrum(arr, [1, 2], shift=shift, norm=norm, zero_norm=zero_norm)
+    assert np.allclose(out, ref, rtol=1e-4, atol=1e-6 * ref.max())
+    half = power_spectrum(
+        arr, [1, 2], shift=shift, norm=norm, zero_norm=zero_norm, half=True
+    )
+    if shift:
+        # the last axis of the half spectrum is not shifted
+        ref = np.fft.ifftshift(ref.value, axes=2)
+    # the half spectrum has the same values as the first half of the full one
+    assert np.allclose(half, ref[..., :7], rtol=1e-4, atol=1e-6 * ref.max())
+
+@pytest.mark.parametrize("pivot", [True, False])
+def test_roi_measure(make_himena_ui, image_data, pivot: bool):
+    import numpy as np
+    from himena.standards import roi as _roi
+
+    ui: MainWindow = make_himena_ui(backend="mock")
+    rois = _roi.RoiListModel(
+        [
+            _roi.RectangleRoi(x=1, y=1, width=3, height=2, name="a"),
+            _roi.RectangleRoi(x=0, y=2, width=2, height=3, name="b"),
+            _roi.LineRoi(start=(0, 0), end=(4, 5), name="c"),
+        ],
+        indices=np.array([[0, 1, 0], [0, 1, 1], [2, 3, 0]], dtype=np.int32),
+        axis_names=["t", "z", "c"],
+    )
+    image_data.metadata.rois = rois
+    win = ui.add_data_model(image_data)
+    ui.exec_action(
+        "himena-image:roi-measure",
+        model_context=win.to_model(),
+        with_params={"metrics": ["mean"], "along": [0], "pivot": pivot},
+    )
+    out = ui.current_model.value
+    arr = image_data.value
+    if pivot:
+        assert out["mean_a"] == pytest.approx(arr[:, 1, 0, 1:3, 1:4].mean(axis=(1, 2)))
+        assert out["mean_b"] == pytest.approx(arr[:, 1, 1, 2:5, 0:2].mean(axis=(1, 2)))
+    else:
+        assert out["name"] == ["a", "b", "c"] * 4
+        assert out["mean"][1] == pytest.approx(arr[0, 1, 1, 2:5, 0:2].mean())
+
+
+@pytest.mark.parametrize(
+    "command",
+    [
+        "himena-image:rolling-ball",
+        "himena-image:entropy-filter",
+        "himena-image:enhance-contrast",
+    ],
+)
+def test_per_plane_commands(make_himena_ui, image_data, command: str):
+    ui: MainWindow = make_himena_ui(backend="mock")
+    win = ui.add_data_model(image_data)
+    ui.exec_action(command, model_context=win.to_model(), with_params={})
+    assert ui.current_model.value.shape == image_data.value.shape
+
+
+def test_label_per_plane(make_himena_ui, image_data):
+    import numpy as np
+
+    ui: MainWindow = make_himena_ui(backend="mock")
+    image_data.value = image_data.value > 0.5
+    win = ui.add_data_model(image_data)
+    ui.exec_action("himena-image:label", model_context=win.to_model(), with_params={})
+    out = ui.current_model.value
+    assert out.shape == image_data.value.shape
+    assert np.array_equal(out > 0, image_data.value)
+    # labels are not shared between planes
+    planes = out.reshape(-1, *out.shape[-2:])
+    ids = [set(np.unique(p[p > 0]).tolist()) for p in planes]
+    assert sum(len(s) for s in ids) == len(set().union(*ids))
+
+    ui.exec_action(
+        "himena-image:skeletonize", model_context=win.to_model(), with_params={}
+    )
+    assert ui.current_model.value.shape == image_data.value.shape
+
+
+def test_cancel_job(make_himena_ui, image_data):
+    import numpy as np
+    import impy as ip
+    from himena_image.processing._jobs import Job, JobCancelled, active_jobs
+    from himena_image.processing._parallel import map_planes
+
+    ui: MainWindow = make_himena_ui(backend="mock")
+    img = ip.asarray(image_data.value, axes="tzcyx")
+    n_called = 0
+
+    def _func(plane):
+        nonlocal n_called
+        n_called += 1
+        ui.exec_action("himena-image:cancel-jobs")
+        return plane
+
+    with pytest.raises(JobCancelled):
+        with Job("Test") as job:
+            map_planes(_func, img, "yx", job=job, num_workers=1)
+    assert job.cancelled
+    assert n_called < 40
+    assert active_jobs() == []
+
+    with Job("Test") as job:
+        out = map_planes(lambda p: -p, img, "yx", job=job)
+    assert np.array_equal(out, -image_data.value)
+    assert job.n_done == job.total == 40
+
+
+@pytest.mark.parametrize("connectivity", [1, 2])
+def test_label_chunked(make_himena_ui, image_data, connectivity: int):
+    import numpy as np
+    import dask.array as da
+    from skimage.measure import label
+
+    ui: MainWindow = make_himena_ui(backend="mock")
+    mask = np.random.default_rng(0).random((2, 40, 50)) > 0.6
+    image_data.value = da.from_array(mask, chunks=(1, 15, 20))
+    image_data.metadata.axes = image_data.metadata.axes[2:]
+    image_data.metadata.channel_axis = None
+    win = ui.add_data_model(image_data)
+    ui.exec_action(
+        "himena-image:label",
+        model_context=win.to_model(),
+        with_params={"connectivity": connectivity},
+    )
+    out = np.asarray(ui.current_model.value)
+    assert out.dtype == (np.uint8 if out.max() < 256 else np.uint16)
+    for i in range(2):
+        ref = label(mask[i], connectivity=connectivity)
+        pairs = np.unique(np.stack([out[i][mask[i]], ref[mask[i]]]), axis=1)
+        assert pairs.shape[1] == ref.max() == len(np.unique(out[i][mask[i]]))
+    assert np.array_equal(np.unique(out), np.arange(out.max() + 1))
+
+
+@pytest.mark.parametrize("min_distance", [1.0, 1.5, 3.0])
+@pytest.mark.parametrize("lazy", [False, True])
+def test_peak_local_max_chunked(make_himena_ui, image_data, min_distance, lazy):
+    import numpy as np
+    import dask.array as da
+    import impy as ip
+
+    ui: MainWindow = make_himena_ui(backend="mock")
+    arr = np.random.default_rng(0).normal(size=(2, 40, 50)).astype(np.float32)
+    image_data.value = da.from_array(arr, chunks=(1, 15, 20)) if lazy else arr
+    image_data.metadata.axes = image_data.metadata.axes[2:]
+    image_data.metadata.channel_axis = None
+    # percentile of a dask array is approximate
+    percentile = None if lazy else 50.0
+    win = ui.add_data_model(image_data)
+    ui.exec_action(
+        "himena-image:peak-local-max",
+        model_context=win.to_model(),
+        with_params={"min_distance": min_distance, "percentile": percentile},
+    )
+    out = ui.current_model.value
+    ref = ip.asarray(arr, axes="cyx").peak_local_max(
+        min_distance=min_distance, percentile=percentile, dims="yx"
+    )
+    coords = np.stack([out["c"], out["y"], out["x"]], axis=1)
+    ref = np.stack([ref["c"], ref["y"], ref["x"]], axis=1)
+    ref = ref[np.lexsort(ref.T[::-1])]
+    assert np.array_equal(coords, ref)
+
+
+@pytest.mark.parametrize("threshold", [None, 1.0])
+def test_peak_local_max_plateau(threshold):
+    import numpy as np
+    import dask.array as da
+    import impy as ip
+    from skimage.feature import peak_local_max
+    from himena_image.processing._chunked_peaks import peak_local_max_chunked
+    from impy.arrays._utils._structures import ball_like
+
+    # a flat half, and a constant plane that has no peak
+    plane = np.zeros((40, 40), dtype=np.float32)
+    plane[:, 20:] = 5
+    plane[10, 10] = plane[30, 30] = 10
+    arr = np.stack([plane, np.full_like(plane, 3)])
+    refs = []
+    for i, a in enumerate(arr):
+        p = peak_local_max(
+            a, footprint=ball_like(2, 2), threshold_abs=threshold, exclude_border=0
+        )
+        refs.append(np.column_stack([np.full(len(p), i), p]))
+    ref = np.concatenate(refs)
+    ref = ref[np.lexsort(ref.T[::-1])]
+    assert len(ref) > 2
+    for value in [arr, da.from_array(arr, chunks=(1, 20, 20))]:
+        out = peak_local_max_chunked(value, [1, 2], 2.0, threshold=threshold)
+        assert np.array_equal(np.stack(out, axis=1), ref)
+    if threshold is None:
+        # adjacent peaks of the plateau are not suppressed in impy either
+        df = ip.asarray(arr, axes="cyx").peak_local_max(
+            min_distance=2.0, exclude_border=False, dims="yx"
+        )
+        ref_ip = np.stack([df["c"], df["y"], df["x"]], axis=1)
+        ref_ip = ref_ip[np.lexsort(ref_ip.T[::-1])]
+        assert np.array_equal(ref_ip, ref)
+
+
+@pytest.mark.parametrize("method", ["log", "dog"])
+def test_detect_blobs(make_himena_ui, image_data, method: str):
+    import numpy as np
+    import dask.array as da
+
+    ui: MainWindow = make_himena_ui(backend="mock")
+    yy, xx = np.indices((40, 50))
+    centers = [(10, 12, 1.5), (25, 30, 3.0), (30, 8, 2.0)]
+    arr = np.stack(
+        [
+            sum(np.exp(-((yy - y) ** 2 + (xx - x) ** 2) / (2 * s**2)) for y, x, s in centers[i:])  # fmt: skip
+            for i in range(2)
+        ]
+    )
+    arr += np.random.default_rng(0).normal(scale=0.01, size=arr.shape)
+    image_data.metadata.axes = image_data.metadata.axes[2:]
+    image_data.metadata.channel_axis = None
+    params = {"method": method, "min_sigma": 1.0, "max_sigma": 4.0, "threshold": 0.1}
+    tables = []
+    for value in [arr, da.from_array(arr, chunks=(1, 15, 20))]:
+        image_data.value = value
+        win = ui.add_data_model(image_data)
+        ui.exec_action(
+            "himena-image:detect-blobs",
+            model_context=win.to_model(),
+            with_params=params,
+        )
+        tables.append(ui.current_model.value)
+    # chunked detection gives the same result as the in-memory one
+    for key in ["c", "y", "x", "sigma"]:
+        assert np.array_equal(tables[0][key], tables[1][key])
+    assert np.allclose(tables[0]["response"], tables[1]["response"], atol=1e-6)
+    out = tables[0]
+    found = set(zip(out["c"].tolist(), out["y"].tolist(), out["x"].tolist()))
+    expected = {(i, y, x) for i in range(2) for y, x, _ in centers[i:]}
+    assert found == expected
+
+
+def test_aggregate_by_mask(make_himena_ui, image_data):
+    import numpy as np
+
+    ui: MainWindow = make_himena_ui(backend="mock")
+    win = ui.add_data_model(image_data)
+    mask = image_data.with_value(image_data.value > 0)
+    win_mask = ui.add_data_model(mask)
+    ui.exec_action(
+        "himena-image:aggregate-by-mask",
+        model_context=win.to_model(),
+        with_params={
+            "mask": win_mask.to_model(),
+            "properties": ["intensity_mean", "area", "centroid", "eccentricity"],
+        },
+    )
+    out = ui.current_model.value
+    arr, msk = image_data.value, mask.value
+    assert len(out["t"]) == 4 * 5 * 2
+    assert out["z"][3] == 1 and out["c"][3] == 1
+    assert out["intensity_mean"][3] == pytest.approx(arr[0, 1, 1][msk[0, 1, 1]].mean())
+    assert out["area"][3] == msk[0, 1, 1].sum()
+    assert out["centroid-0"][3] == pytest.approx(np.nonzero(msk[0, 1, 1])[0].mean())
+    assert len(out["eccentricity"]) == 40
+
+
+def test_region_properties(make_himena_ui, image_data):
+    import numpy as np
+    from himena.standards.model_meta import ImageMeta
+
+    ui: MainWindow = make_himena_ui(backend="mock")
+    win = ui.add_data_model(image_data)
+    labels = np.zeros((6, 5), dtype=np.uint8)
+    labels[1:3, 1:4] = 1
+    labels[4:, :2] = 3
+    win_labels = ui.add_data_model(
+        image_data.with_value(labels, type="array.image.labels", metadata=ImageMeta())
+    )
+    ui.exec_action(
+        "himena-image:region-properties",
+        model_context=win.to_model(),
+        with_params={
+            "image": win.to_model(),
+            "labels": win_labels.to_model(),
+            "properties": ["intensity_mean", "intensity_max"],
+        },
+    )
+    out = ui.current_model.value
+    arr = image_data.value
+    assert len(out["label"]) == 4 * 5 * 2 * 2
+    assert list(out["label"][:4]) == [1, 3, 1, 3]
+    assert out["intensity_mean"][2] == pytest.approx(arr[0, 0, 1, 1:3, 1:4].mean())
+    assert out["intensity_max"][3] == pytest.approx(arr[0, 0, 1, 4:, :2].max())
+
+
+@pytest.mark.parametrize("save_as", [None, ".csv", ".parquet"])
+def test_region_properties_per_frame(make_himena_ui, image_data, tmp_path, save_as):
+    import numpy as np
+    from himena.standards.model_meta import ImageMeta
+
+    ui: MainWindow = make_himena_ui(backend="mock")
+    image_data.value = image_data.value[:, 0, 0]  # (t, y, x)
+    image_data.metadata.axes = [image_data.metadata.axes[i] for i in (0, 3, 4)]
+    image_data.metadata.channel_axis = None
+    win = ui.add_data_model(image_data)
+    labels = np.zeros((4, 6, 5), dtype=np.uint16)
+    labels[:, 1:3, 1:4] = 1
+    labels[2, 4:, :2] = 5  # only in the 3rd frame
+    win_labels = ui.add_data_model(
+        image_data.with_value(labels, type="array.image.labels", metadata=ImageMeta())
+    )
+    save_path = None if save_as is None else tmp_path / f"props{save_as}"
+    ui.exec_action(
+        "himena-image:region-properties",
+        model_context=win.to_model(),
+        with_params={
+            "image": win.to_model(),
+            "labels": win_labels.to_model(),
+            "properties": ["intensity_mean", "centroid"],
+            "dimension": 2,
+            "save_path": save_path,
+        },
+    )
+    if save_as is None:
+        out = ui.current_model.value
+    elif save_as == ".csv":
+        import pandas as pd
+
+        out = pd.read_csv(save_path)
+    else:
+        import pandas as pd
+
+        out = pd.read_parquet(save_path)
+    arr = image_data.value
+    assert list(out["t"]) == [0, 1, 2, 2, 3]
+    assert list(out["label"]) == [1, 1, 1, 5, 1]
+    assert out["intensity_mean"][3] == pytest.approx(arr[2, 4:, :2].mean())
+    assert out["centroid-0"][4] == pytest.approx(1.5)
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_track_drift(make_himena_ui, image_data, lazy: bool):
+    import numpy as np
+    import dask.array as da
+    import impy as ip
+    from scipy import ndimage as ndi
+
+    ui: MainWindow = make_himena_ui(backend="mock")
+    rng = np.random.default_rng(0)
+    base = ndi.gaussian_filter(rng.random((40, 50)), 2)
+    true_shifts = np.cumsum(rng.uniform(-2, 2, size=(7, 2)), axis=0)
+    arr = np.stack([ndi.shift(base, s) for s in true_shifts]).astype(np.float32)
+    image_data.value = da.from_array(arr, chunks=(1, 40, 50)) if lazy else arr
+    image_data.metadata.axes = image_data.metadata.axes[2:]
+    image_data.metadata.axes[0].name = "t"
+    image_data.metadata.channel_axis = None
+    win = ui.add_data_model(image_data)
+    ui.exec_action(
+        "himena-image:track-drift",
+        model_context=win.to_model(),
+        with_params={"along": "t"},
+    )
+    out = ui.current_model.value
+    ref = ip.asarray(arr, axes="tyx").track_drift(along="t")
+    assert np.allclose(out["y"], ref["y"], atol=1e-5)
+    assert np.allclose(out["x"], ref["x"], atol=1e-5)
+
+    table = ui.current_model
+    corrected = []
+    for shift_table in [None, table]:
+        ui.exec_action(
+            "himena-image:drift-correction",
+            model_context=win.to_model(),
+            with_params={"along": "t", "zero_ave": False, "shift_table": shift_table},
+        )
+        out = ui.current_model.value
+        # lazy images are corrected lazily
+        assert isinstance(out, da.Array) == lazy
+        corrected.append(np.asarray(out))
+    assert np.allclose(corrected[0], corrected[1])
+    diff = corrected[0][3, 10:-10, 10:-10] - arr[0, 10:-10, 10:-10]
+    assert np.abs(diff).max() < 0.05
+
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_drift_correction_dtype(make_himena_ui, image_data, lazy: bool):
+    import numpy as np
+    import dask.array as da
+    import impy as ip
+    from scipy import ndimage as ndi
+
+    ui: MainWindow = make_himena_ui(backend="mock")
+    rng = np.random.default_rng(1)
+    base = ndi.gaussian_filter(rng.random((40, 50)), 2) * 1000
+    shifts = np.cumsum(rng.uniform(-2, 2, size=(5, 2)), axis=0)
+    arr = np.stack([ndi.shift(base, s) for s in shifts]).astype(np.uint16)
+    image_data.value = da.from_array(arr, chunks=(1, 40, 50)) if lazy else arr
+    image_data.metadata.axes = image_data.metadata.axes[2:]
+    image_data.metadata.axes[0].name = "t"
+    image_data.metadata.channel_axis = None
+    win = ui.add_data_model(image_data)
+    ui.exec_action(
+        "himena-image:drift-correction",
+        model_context=win.to_model(),
+        with_params={"along": "t"},
+    )
+    out = ui.current_model.value
+    assert isinstance(out, da.Array) == lazy
+    assert out.dtype == np.uint16
+    ref = ip.asarray(arr, axes="tyx").drift_correction(along="t")
+    assert ref.dtype == np.uint16
+    diff = np.asarray(out, dtype=np.float32) - ref.value
+    assert np.abs(diff[:, 5:-5, 5:-5]).max() <= 1
+
+def test_lucy(make_himena_ui, image_data):
+    import numpy as np
+    import impy as ip
+    from himena import StandardType
+    from scipy import ndimage as ndi
+
+    ui: MainWindow = make_himena_ui(backend="mock")
+    rng = np.random.default_rng(0)
+    truth = np.zeros((2, 32, 32), dtype=np.float32)
+    truth[:, rng.integers(0, 32, 10), rng.integers(0, 32, 10)] = 10
+    arr = ndi.gaussian_filter(truth, (0, 1.5, 1.5)) + 0.01
+    yy, xx = np.indices((32, 32))
+    psf = np.exp(-((yy - 16) ** 2 + (xx - 16) ** 2) / 4.5).astype(np.float32)
+    image_data.value = arr
+    image_data.metadata.axes = image_data.metadata.axes[2:]
+    image_data.metadata.channel_axis = None
+    win = ui.add_data_model(image_data)
+    psf_win = ui.add_object(psf, type=StandardType.IMAGE)
+    outputs = {}
+    for accelerate in [False, True]:
+        ui.exec_action(
+            "himena-image:lucy-deconv",
+            model_context=win.to_model(),
+            with_params={"psf": psf_win.to_model(), "niter": 10, "accelerate": accelerate},  # fmt: skip
+        )
+        outputs[accelerate] = ui.current_model.value
+    ref = ip.asarray(arr, axes="cyx").lucy(psf, niter=10, dims="yx")
+    assert np.allclose(outputs[False], ref, atol=1e-4)
+    # acceleration gets closer to the converged result
+    converged = ip.asarray(arr, axes="cyx").lucy(psf, niter=100, dims="yx")
+    err = {k: np.abs(v - converged).mean() for k, v in outputs.items()}
+    assert err[True] < err[False]
+
+    ui.exec_action(
+        "himena-image:lucy-tv-deconv",
+        model_context=win.to_model(),
+        with_params={"psf": psf_win.to_model(), "niter": 10, "lmd": 0.01},
+    )
+    assert ui.current_model.value.shape == arr.shape
+
+
+def test_lucy_tv(make_himena_ui, image_data):
+    import numpy as np
+    import impy as ip
+    from himena import StandardType
+    from scipy import ndimage as ndi
+
+    ui: MainWindow = make_himena_ui(backend="mock")
+    rng = np.random.default_rng(0)
+    truth = np.zeros((2, 64, 64), dtype=np.float32)
+    truth[:, rng.integers(0, 64, 30), rng.integers(0, 64, 30)] = 10
+    arr = ndi.gaussian_filter(truth, (0, 1.5, 1.5)) + 0.01
+    yy, xx = np.indices((64, 64))
+    psf = np.exp(-((yy - 32) ** 2 + (xx - 32) ** 2) / 4.5).astype(np.float32)
+    image_data.value = arr
+    image_data.metadata.axes = image_data.metadata.axes[2:]
+    image_data.metadata.channel_axis = None
+    win = ui.add_data_model(image_data)
+    psf_win = ui.add_object(psf, type=StandardType.IMAGE)
+    ui.exec_action(
+        "himena-image:lucy-tv-deconv",
+        model_context=win.to_model(),
+        with_params={"psf": psf_win.to_model(), "niter": 10, "lmd": 0.01, "tol": 0},
+    )
+    ref = ip.asarray(arr, axes="cyx").lucy_tv(
+        psf, max_iter=10, lmd=0.01, tol=0, dims="yx"
+    )
+    # impy estimates the image circularly shifted by the PSF center, so the gradient
+    # of the TV term differs near the image border and the center lines
+    dist = np.minimum.reduce(
+        [yy, 63 - yy, xx, 63 - xx, np.abs(yy - 31.5), np.abs(xx - 31.5)]
+    )
+    diff = np.abs(ui.current_model.value - ref)[:, dist > 10]
+    assert diff.max() < 1e-4
+
+
+def test_lucy_progress_with_early_stop(make_himena_ui, image_data, monkeypatch):
+    import numpy as np
+    from himena import StandardType
+    from himena_image.processing import restore
+    from himena_image.processing._jobs import Job
+
+    jobs: list[Job] = []
+
+    class _Job(Job):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            jobs.append(self)
+
+    monkeypatch.setattr(restore, "Job", _Job)
+    ui: MainWindow = make_himena_ui(backend="mock")
+    image_data.value = np.ones((2, 32, 32), dtype=np.float32)
+    image_data.metadata.axes = image_data.metadata.axes[2:]
+    image_data.metadata.channel_axis = None
+    win = ui.add_data_model(image_data)
+    yy, xx = np.indices((5, 5))
+    psf = np.exp(-((yy - 2) ** 2 + (xx - 2) ** 2) / 2).astype(np.float32)
+    psf_win = ui.add_object(psf, type=StandardType.IMAGE)
+    # a flat image converges immediately
+    ui.exec_action(
+        "himena-image:lucy-tv-deconv",
+        model_context=win.to_model(),
+        with_params={"psf": psf_win.to_model(), "niter": 20, "tol": 1e-3},
+    )
+    assert jobs[-1].total == 2 * 20
+    assert jobs[-1].n_done == jobs[-1].total
+
+
+def test_lucy_tiled(make_himena_ui, image_data):
+    import numpy as np
+    from himena import StandardType
+    from scipy import ndimage as ndi
+
+    ui: MainWindow = make_himena_ui(backend="mock")
+    rng = np.random.default_rng(0)
+    truth = np.zeros((2, 100, 90), dtype=np.float32)
+    truth[:, rng.integers(0, 100, 40), rng.integers(0, 90, 40)] = 10
+    arr = ndi.gaussian_filter(truth, (0, 1.5, 1.5)) + 0.01
+    yy, xx = np.indices((15, 15))
+    psf = np.exp(-((yy - 7) ** 2 + (xx - 7) ** 2) / 4.5).astype(np.float32)
+    image_data.value = arr
+    image_data.metadata.axes = image_data.metadata.axes[2:]
+    image_data.metadata.channel_axis = None
+    win = ui.add_data_model(image_data)
+    psf_win = ui.add_object(psf, type=StandardType.IMAGE)
+    outputs = []
+    for block_size in [None, 32]:
+        ui.exec_action(
+            "himena-image:lucy-deconv",
+            model_context=win.to_model(),
+            with_params={"psf": psf_win.to_model(), "niter": 10, "block_size": block_size},  # fmt: skip
+        )
+        outputs.append(ui.current_model.value)
+    # tiles are seamless; only the image border differs (reflect vs. periodic)
+    inner = (slice(None), slice(15, -15), slice(15, -15))
+    assert np.abs(outputs[0][inner] - outputs[1][inner]).max() < 1e-2
+
+
+@pytest.mark.parametrize("dtype", ["float32", "uint16"])
+@pytest.mark.parametrize("lazy", [False, True])
+def test_kalman_filter(make_himena_ui, image_data, lazy: bool, dtype: str):
+    import numpy as np
+    import dask.array as da
+    import impy as ip
+
+    ui: MainWindow = make_himena_ui(backend="mock")
+    arr = (np.abs(np.asarray(image_data.value)) * 100).astype(dtype)
+    image_data.value = da.from_array(arr, chunks=(2, 1, 1, 6, 5)) if lazy else arr
+    win = ui.add_data_model(image_data)
+    ui.exec_action(
+        "himena-image:kalman-filter",
+        model_context=win.to_model(),
+        with_params={"gain": 0.5, "noise_var": 0.2, "along": "t"},
+    )
+    out = ui.current_model.value
+    assert isinstance(out, da.Array) == lazy
+    assert out.dtype == arr.dtype
+    ref = ip.asarray(arr, axes="tzcyx").kalman_filter(0.5, 0.2, along="t", dims="yx")
+    assert ref.dtype == arr.dtype
+    assert np.allclose(np.asarray(out), ref, rtol=1e-5, atol=1e-5)
+    ui.exec_action(
+        "himena-image:kalman-filter",
+        model_context=win.to_model(),
+        with_params={
+            "gain": 0.5,
+            "noise_var": 0.2,
+            "along": "t",
+            "is_previewing": True,
+        },
+    )
+    assert np.allclose(np.asarray(ui.current_model.value), ref, rtol=1e-5, atol=1e-5)
+
+
+def test_kalman_filter_lazy_reuses_states():
+    import numpy as np
+    import dask.array as da
+    from himena_image.processing._kalman import (
+        kalman_filter_lazy,
+        kalman_filter_stream,
+    )
+
+    rng = np.random.default_rng(0)
+    arr = rng.normal(size=(20, 6, 5)).astype(np.float32)
+    ref = np.stack(list(kalman_filter_stream(arr, 0.5, 0.2)))
+    reads = []
+
+    def _read(block, block_info=None):
+        reads.append(block_info[0]["chunk-location"][0])
+        return block
+
+    inp = da.from_array(arr, chunks=(1, 6, 5)).map_blocks(_read, dtype=np.float32)
+    out = kalman_filter_lazy(inp, 0, 0.5, 0.2)
+    # browsing forward reads each frame only once
+    for t in range(arr.shape[0]):
+        assert np.allclose(out[t].compute(), ref[t], atol=1e-6)
+    assert sorted(reads) == list(range(arr.shape[0]))
+    # browsing backward starts from the nearest checkpoint
+    reads.clear()
+    for t in [18, 9, 3]:
+        assert np.allclose(out[t].compute(), ref[t], atol=1e-6)
+    assert len(reads) <= 3 * 4
+    assert np.allclose(out.compute(), ref, atol=1e-6)
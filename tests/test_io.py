@@ -3,7 +3,154 @@ from himena_image.io import read_roi, write_roi
 
 _TEST_PATH = Path(__file__).parent
 
+
 def test_roi_io(tmpdir):
     tmpdir = Path(tmpdir)
     rois = read_roi(_TEST_PATH / "test-rois.zip")
     write_roi(rois, tmpdir / "test-rois.zip")
+
+
+def test_roi_zip_compatible_with_roifile(tmpdir):
+    import zipfile
+    import numpy as np
+    from himena.standards import roi as _roi
+    from roifile import ImagejRoi
+    from himena_image.io import _to_standard_roi
+    from himena_image._imagej_roi import write_imagej_roi_zip
+
+    rois = [
+        _roi.RectangleRoi(x=1, y=2, width=3, height=4, name="rect"),
+        _roi.RectangleRoi(x=1.5, y=2, width=3, height=4.2, name="rect-sub"),
+        _roi.EllipseRoi(x=3.2, y=2, width=3, height=4, name="ellipse"),
+        _roi.LineRoi(start=(1, 2), end=(5.5, 3), name="line"),
+        _roi.PointRoi2D(x=3, y=4, name="point"),
+        _roi.PointsRoi2D(xs=[1, 2, 3], ys=[4, 5, 6.5], name="points"),
+        _roi.PolygonRoi(xs=[1, 4, 3], ys=[4, 5, 9], name="polygon"),
+        _roi.SegmentedLineRoi(xs=[1.1, 4, 3], ys=[4, 5, 9], name="segmented"),
+        _roi.RotatedRectangleRoi(start=(1, 2), end=(8, 6), width=3, name="rot"),
+        _roi.RotatedEllipseRoi(start=(1, 2), end=(8, 6), width=3, name="rot-ell"),
+    ]
+    positions = [np.arange(len(rois)) % 3 for _ in range(4)]
+    path = Path(tmpdir) / "rois.zip"
+    write_imagej_roi_zip(path, rois, positions, batch_size=4)
+    with zipfile.ZipFile(path) as zf:
+        assert zf.namelist() == [f"{roi.name}.roi" for roi in rois]
+        for i, roi in enumerate(rois):
+            data = zf.read(f"{roi.name}.roi")
+            ijroi = ImagejRoi.frombytes(data)
+            assert ijroi.tobytes() == data
+            indices, out = _to_standard_roi(ijroi)
+            assert list(indices) == [pos[i] for pos in positions]
+            assert type(out) is type(roi)
+            assert out.name == roi.name
+            if roi.name == "rect":
+                # integer rectangles are written as the bounding box of the corners
+                bbox = (ijroi.left, ijroi.top, ijroi.right, ijroi.bottom)
+                assert bbox == (1, 2, 5, 7)
+                continue
+            for key, value in roi.model_dump(exclude={"name"}).items():
+                np.testing.assert_allclose(getattr(out, key), value, rtol=1e-6)
+
+
+def test_roi_zip_same_bytes_as_roifile(tmpdir):
+    import struct
+    import zipfile
+    import numpy as np
+    from himena.standards import roi as _roi
+    from roifile import ROI_OPTIONS, ROI_SUBTYPE, ROI_TYPE, ImagejRoi
+    from himena_image._imagej_roi import write_imagej_roi_zip
+
+    rois = [
+        _roi.PolygonRoi(xs=[1, 4, 3], ys=[4, 5, 9], name="polygon"),
+        _roi.LineRoi(start=(1, 2), end=(5.5, 3), name="line"),
+        _roi.RotatedRectangleRoi(start=(1, 2), end=(8, 6), width=3, name="rot"),
+    ]
+    positions = [[1, 0, 2], [0, 3, 0], [2, 0, 4], [1, 1, 0]]
+    aspect = struct.unpack(">BBh", struct.pack(">f", 3.0))
+    expected = [
+        ImagejRoi(
+            roitype=ROI_TYPE.POLYGON,
+            name="polygon",
+            top=5, left=2, bottom=11, right=6,
+            n_coordinates=3,
+            integer_coordinates=np.array([[0, 0], [3, 1], [2, 5]]),
+            position=1, t_position=0, z_position=2, c_position=1,
+        ),
+        ImagejRoi(
+            roitype=ROI_TYPE.LINE,
+            name="line",
+            options=ROI_OPTIONS.SUB_PIXEL_RESOLUTION,
+            top=3, left=2, bottom=5, right=7,
+            n_coordinates=2,
+            x1=2, y1=3, x2=6.5, y2=4,
+            position=0, t_position=3, z_position=0, c_position=1,
+        ),
+        ImagejRoi(
+            roitype=ROI_TYPE.FREEHAND,
+            subtype=ROI_SUBTYPE.ROTATED_RECT,
+            name="rot",
+            top=3, left=2, bottom=8, right=10,
+            n_coordinates=2,
+            integer_coordinates=np.array([[0, 0], [7, 4]]),
+            x1=2, y1=3, x2=9, y2=7,
+            arrow_style_or_aspect_ratio=aspect[0],
+            arrow_head_size=aspect[1],
+            rounded_rect_arc_size=aspect[2],
+            position=2, t_position=0, z_position=4, c_position=0,
+        ),
+    ]  # fmt: skip
+    path = Path(tmpdir) / "rois.zip"
+    write_imagej_roi_zip(path, rois, positions)
+    with zipfile.ZipFile(path) as zf:
+        for roi, ijroi in zip(rois, expected):
+            assert zf.read(f"{roi.name}.roi") == ijroi.tobytes()
+
+
+def test_read_roi_lazily():
+    from roifile import roiread
+    from himena_image.io import _to_standard_roi
+
+    rois = read_roi(_TEST_PATH / "test-rois.zip").value
+    assert rois.is_lazy
+    expected = [_to_standard_roi(ijroi) for ijroi in roiread(_TEST_PATH / "test-rois.zip")]  # fmt: skip
+    assert len(rois) == len(expected)
+    assert rois.indices.tolist() == [list(ind) for ind, _ in expected]
+    filtered = rois.filter_by_indices((0, 0, 0, 0))
+    assert filtered.is_lazy
+    assert type(filtered[0]) is type(expected[0][1])
+    assert rois.is_lazy
+    for roi, (_, roi_expected) in zip(rois, expected):
+        assert repr(roi) == repr(roi_expected)
+    assert len(rois.items) == len(expected)
+    assert not rois.is_lazy
+
+
+def test_export_labels_as_imagej_rois(make_himena_ui, tmpdir):
+    import numpy as np
+    from himena import StandardType, WidgetDataModel
+    from himena.standards.model_meta import ImageMeta, DimAxis
+
+    labels = np.zeros((2, 12, 10), dtype=np.uint16)
+    labels[0, 1:4, 1:5] = 1
+    labels[0, 6:9, 2:8] = 2
+    labels[1, 2:10, 3:6] = 3
+    model = WidgetDataModel(
+        value=labels,
+        type=StandardType.IMAGE_LABELS,
+        metadata=ImageMeta(axes=[DimAxis(name=n) for n in "tyx"]),
+    )
+    ui = make_himena_ui(backend="mock")
+    win = ui.add_data_model(model)
+    path = Path(tmpdir) / "labels.zip"
+    ui.exec_action(
+        "himena-image:io:export-labels-as-imagej-rois",
+        model_context=win.to_model(),
+        with_params={"path": path},
+    )
+    rois = read_roi(path).value
+    assert len(rois) == 3
+    assert [roi.name for roi in rois] == ["0001-00001", "0001-00002", "0002-00003"]
+    assert rois.indices[:, rois.axis_names.index("t")].tolist() == [1, 1, 2]
+    # the ImageJ polygon traces the pixel corners
+    xs, ys = rois[0].xs + 1, rois[0].ys + 1
+    assert (xs.min(), xs.max(), ys.min(), ys.max()) == (1, 5, 1, 4)
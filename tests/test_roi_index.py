@@ -0,0 +1,85 @@
+import numpy as np
+from himena.standards import roi as _roi
+from himena_image._roi_index import RoiIndex
+
+
+def _random_rois(n: int = 300) -> _roi.RoiListModel:
+    rng = np.random.default_rng(0)
+    items = []
+    for i in range(n):
+        x, y = rng.uniform(0, 200, size=2)
+        w, h = rng.uniform(1, 20, size=2)
+        if i % 3 == 0:
+            items.append(_roi.RectangleRoi(x=x, y=y, width=w, height=h))
+        elif i % 3 == 1:
+            items.append(_roi.LineRoi(start=(x, y), end=(x + w, y + h)))
+        else:
+            items.append(_roi.RotatedEllipseRoi(start=(x, y), end=(x + w, y), width=h))
+    indices = rng.integers(-1, 3, size=(n, 2)).astype(np.int32)
+    return _roi.RoiListModel(items, indices=indices, axis_names=["t", "z"])
+
+
+def test_roi_index_query():
+    rois = _random_rois()
+    index = RoiIndex(rois, cell_size=7)
+    for key in [(0, 0), (1, 2), (2, -1)]:
+        expected = np.flatnonzero(rois.mask_by_indices(key))
+        np.testing.assert_array_equal(index.query(key), expected)
+
+    bbox = (50, 60, 90, 120)
+    result = index.query((0, 0), bbox=bbox)
+    for i in result:
+        assert rois.mask_by_indices((0, 0))[i]
+    # all the rectangles and lines intersecting the viewport must be found
+    for i, r in enumerate(rois):
+        if isinstance(r, _roi.RotatedEllipseRoi) or not rois.mask_by_indices((0, 0))[i]:
+            continue
+        b = r.bbox()
+        hit = b.left <= 90 and b.right >= 50 and b.top <= 120 and b.bottom >= 60
+        assert hit == (i in result)
+    assert len(index.filter((0, 0), bbox=bbox)) == len(result)
+
+
+def test_roi_index_large_rois():
+    from himena_image._roi_index import _MAX_CELLS_PER_ROI
+
+    rois = _random_rois()
+    # a few ROIs spanning the whole extent are not expanded into the grid cells
+    big = [_roi.RectangleRoi(x=-1000, y=-1000, width=3000, height=3000)] * 3
+    items = list(rois.items) + big
+    indices = np.concatenate([rois.indices, np.full((3, 2), -1, dtype=np.int32)])
+    rois = _roi.RoiListModel(items, indices=indices, axis_names=["t", "z"])
+    index = RoiIndex(rois, cell_size=1)
+    result = index.query((0, 0), bbox=(50, 60, 52, 62))
+    assert set(range(300, 303)) <= set(result.tolist())
+    grid = index._get_grid()
+    assert grid._roi_ids.size <= len(rois) * _MAX_CELLS_PER_ROI
+    assert set(range(300, 303)) <= set(grid._always.tolist())
+
+
+def test_roi_index_validity():
+    from himena_image._roi_index import get_roi_index
+
+    rois = _random_rois()
+    index = get_roi_index(rois)
+    assert get_roi_index(rois) is index
+    rois.indices[0] = (2, 2)
+    assert not index.is_valid_for(rois)
+    index = get_roi_index(rois)
+    rois.items = np.append(rois.items, _roi.RectangleRoi(x=0, y=0, width=1, height=1))
+    rois.indices = np.append(rois.indices, [[0, 0]], axis=0)
+    assert not index.is_valid_for(rois)
+
+
+def test_roi_index_keeps_lazy_list_lazy():
+    from pathlib import Path
+    from himena_image._roi_index import get_roi_index
+    from himena_image.io import read_roi
+
+    rois = read_roi(Path(__file__).parent / "test-rois.zip").value
+    assert rois.is_lazy
+    index = get_roi_index(rois)
+    list(index.groups())
+    index.query(tuple(rois.indices[0]))
+    assert get_roi_index(rois) is index
+    assert rois.is_lazy